@@ -0,0 +1,63 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Measures the import time of the NAV entry points in fresh interpreters and fails when a budget is exceeded
+# or when an entry point pulls in modules that only the export stage needs
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXPORT_ONLY_MODULES = ['matplotlib', 'sklearn', 'scipy', 'helper.figures', 'helper.tables', 'helper.export_statistics']
+
+# entry point -> (modules imported, import time budget in seconds)
+IMPORT_BUDGETS = {
+    'Extraction (main.py)': (['main'], 0.5),
+    'Query/parse workers': (['helper.scheduler', 'helper.kernel', 'helper.transfer', 'helper.communication'], 0.3),
+    'Daemon client (client.py)': (['client'], 0.1),
+}
+
+MEASURE_IMPORT = """
+import json, sys, time
+start_time = time.perf_counter()
+for module in {modules!r}:
+    __import__(module)
+print(json.dumps({{'Seconds': time.perf_counter() - start_time,
+                  'Export Modules': [module for module in {export_modules!r} if module in sys.modules]}}))
+"""
+
+
+def measure_import(modules, repeats):
+    timings = []
+    export_modules = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', MEASURE_IMPORT.format(modules=modules,
+                                                                            export_modules=EXPORT_ONLY_MODULES)],
+                                cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        timings.append(result['Seconds'])
+        export_modules = result['Export Modules']
+    return statistics.median(timings), export_modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time budget of the NAV entry points")
+    parser.add_argument('--repeats', type=int, default=5, help="Fresh interpreters per entry point, median is reported")
+    parser.add_argument('--scale', type=float, default=1.0, help="Multiply every budget, for slow machines")
+    args = parser.parse_args()
+
+    failed = False
+    for name, (modules, budget) in IMPORT_BUDGETS.items():
+        seconds, export_modules = measure_import(modules, args.repeats)
+        budget *= args.scale
+        within_budget = seconds <= budget and not export_modules
+        failed |= not within_budget
+        print(f"{'OK  ' if within_budget else 'FAIL'} {name}: {seconds * 1000:.0f} ms (budget {budget * 1000:.0f} ms)" +
+              (f", imports {', '.join(export_modules)}" if export_modules else ""))
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
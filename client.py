@@ -0,0 +1,38 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+# Thin client of the NAV analysis daemon (python3 main.py --serve), arguments are passed on as main.py flags
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Submit a NAV job to a running analysis daemon")
+    parser.add_argument('--daemon_socket', '-dsk', default=f"/tmp/nav-{os.getuid()}.sock",
+                        help="Unix socket the analysis daemon listens on")
+    parser.add_argument('--shutdown', action='store_true', help="Stop the daemon once its running jobs finished")
+    args, argv = parser.parse_known_args()
+
+    request = {'command': 'shutdown'} if args.shutdown else {'argv': argv, 'cwd': os.getcwd()}
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(args.daemon_socket)
+    except OSError as error:
+        sys.exit(f"Cannot reach NAV daemon on {args.daemon_socket}: {error}")
+
+    with client, client.makefile('r') as reader:
+        client.sendall((json.dumps(request) + '\n').encode())
+        for line in reader:
+            message = json.loads(line)
+            if 'log' in message:
+                print(message['log'], file=sys.stderr)
+            if 'status' in message:
+                print(f"Job finished in {message['elapsed']:.3f} s", file=sys.stderr)
+                sys.exit(message['status'])
+
+    sys.exit("NAV daemon closed the connection before the job finished")
+
+
+if __name__ == "__main__":
+    main()
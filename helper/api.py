@@ -0,0 +1,169 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from helper.general import NAV_METADATA, NVTX_ATTRIBUTION, import_from_NAV, run_to_completion
+
+# In-process API returning NAV statistics as typed objects, no NAV file, tables or figures are written
+#
+#   trace = analyze_trace('trace.sqlite', ExtractionOptions(summary_only=True))
+#   for item in iter_trace('trace.sqlite'):  # items as they complete
+#       print(item.name, item.metrics['Execution Duration'].median)
+#   png_files = render_figures(trace.kernels['gemm_kernel'])
+
+CATEGORY_ITEMS = {
+    'Kernel Statistics': 'Individual Kernels',
+    'Transfer Statistics': 'Individual Transfers',
+    'Communication Statistics': 'Individual Communications',
+    'MPI Statistics': 'Individual MPI Operations',
+}
+
+
+@dataclass
+class ExtractionOptions:
+    kernels: bool = True
+    transfers: bool = True
+    communications: bool = True
+    mpi: bool = True
+    time_window: Optional[str] = None
+    nvtx_range: Optional[str] = None
+    sample_cap: Optional[int] = None
+    summary_only: bool = False
+    chunk_rows: Optional[int] = None
+    histogram_precision: Optional[int] = None
+    outlier_filter: Optional[str] = None
+    nvtx_kernel_attribution: bool = False
+
+
+@dataclass
+class MetricStatistics:
+    name: str
+    count: Optional[int]
+    mean: Optional[float]
+    median: Optional[float]
+    minimum: Optional[float]
+    maximum: Optional[float]
+    standard_deviation: Optional[float]
+    raw_data: Optional[List[float]] = None
+    buckets: Optional[List[list]] = None
+    distribution: Optional[Dict[str, Any]] = None
+
+
+@dataclass
+class ItemResult:
+    category: str
+    id: Any
+    name: str
+    time_total: Optional[float]
+    time_percent: Optional[float]
+    instances: Optional[int]
+    metrics: Dict[str, MetricStatistics]
+    statistics: Dict[str, Any]  # the item as stored in a NAV file
+
+
+@dataclass
+class TraceResult:
+    source: str
+    total_duration: Optional[float]
+    items: Dict[str, Dict[str, ItemResult]]  # category -> item name -> item
+    general: Dict[str, Dict[str, MetricStatistics]]  # category -> metric -> category wide statistics
+    metadata: Dict[str, Any]
+    statistics: Dict[str, Any] = field(repr=False)  # NAV dictionary, accepted by the export and regression helpers
+
+    @property
+    def kernels(self):
+        return self.items.get('Kernel Statistics', {})
+
+    @property
+    def transfers(self):
+        return self.items.get('Transfer Statistics', {})
+
+    @property
+    def communications(self):
+        return self.items.get('Communication Statistics', {})
+
+    @property
+    def mpi_operations(self):
+        return self.items.get('MPI Statistics', {})
+
+    @property
+    def nvtx_kernel_attribution(self):
+        return self.statistics.get(NVTX_ATTRIBUTION, {})
+
+
+def metric_statistics(name, stats):
+    raw_data = stats.get('Raw Data')
+    count = stats.get('Count')
+    if count is None and raw_data is not None:
+        count = len(raw_data)
+    return MetricStatistics(name, count, stats.get('Mean'), stats.get('Median'), stats.get('Minimum'),
+                            stats.get('Maximum'), stats.get('Standard Deviation'), raw_data, stats.get('Buckets'),
+                            stats.get('Distribution'))
+
+
+def metrics_of(statistics):
+    return {metric: metric_statistics(metric, stats) for metric, stats in statistics.items()
+            if isinstance(stats, dict) and 'Mean' in stats}
+
+
+def item_result(category, id, item):
+    return ItemResult(category, id, item.get('Name') or item.get('Type') or str(id), item.get('Time Total'),
+                      item.get('Time Percent'), item.get('Instance'), metrics_of(item), item)
+
+
+def trace_result(source, statistics):
+    items = {}
+    general = {}
+    for category, individual_key in CATEGORY_ITEMS.items():
+        if category not in statistics:
+            continue
+        category_stats = statistics[category]
+        results = [item_result(category, id, item) for id, item in category_stats.get(individual_key, {}).items()]
+        items[category] = {result.name: result for result in results}
+        general[category] = metrics_of(category_stats)
+    return TraceResult(source, statistics.get('Total Duration'), items, general, statistics.get(NAV_METADATA, {}),
+                       statistics)
+
+
+def iter_trace(database_file, options=None):
+    # yields an ItemResult per kernel, transfer kind and NVTX range as soon as it is computed,
+    # the complete TraceResult is the return value of the generator (result = yield from iter_trace(...))
+    from helper.backend import open_trace
+    from helper.extraction import iter_trace_statistics
+
+    options = options or ExtractionOptions()
+    with open_trace(database_file, None, options.time_window, options.nvtx_range) as trace_file:
+        stream = iter_trace_statistics(trace_file, not options.kernels, not options.transfers,
+                                       not options.communications, options.time_window, options.nvtx_range,
+                                       options.sample_cap, options.summary_only, options.chunk_rows,
+                                       histogram_precision=options.histogram_precision,
+                                       outlier_filter=options.outlier_filter,
+                                       nvtx_kernel_attribution=options.nvtx_kernel_attribution,
+                                       no_mpi_metrics=not options.mpi)
+        while True:
+            try:
+                category, id, item = next(stream)
+            except StopIteration as stop:
+                return trace_result(database_file, stop.value)
+            yield item_result(category, id, item)
+
+
+def analyze_trace(database_file, options=None) -> TraceResult:
+    return run_to_completion(iter_trace(database_file, options))
+
+
+def load_nav(nav_file) -> TraceResult:
+    return trace_result(nav_file, import_from_NAV(nav_file))
+
+
+def render_figures(result, title=None) -> Dict[str, bytes]:
+    # PNG bytes per figure file name of an item, or of a NAV category such as trace.statistics['Kernel Statistics']
+    from helper.export_statistics import FIGURE_LOCK, generate_figures
+    from helper.output import outputs_in_memory
+
+    if isinstance(result, ItemResult):
+        statistics, title = result.statistics, title or result.name
+    else:
+        statistics = result
+    with FIGURE_LOCK, outputs_in_memory() as figures:
+        generate_figures(statistics, title or 'NAV', '.')
+    return figures
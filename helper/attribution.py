@@ -0,0 +1,209 @@
+import sqlite3
+
+import numpy as np
+from absl import logging
+
+from helper.scope import scope_query
+
+QUERY_NVTX_THREAD_RANGES = """
+WITH
+    domains AS (
+        SELECT
+            domainId AS id,
+            globalTid AS globalTid,
+            text AS name
+        FROM
+            NVTX_EVENTS
+        WHERE
+            eventType = 75
+        GROUP BY
+            domainId, globalTid, text
+    )
+SELECT
+    ne.globalTid AS thread,
+    ne.start AS range_start,
+    ne.end AS range_end,
+    CASE
+        WHEN d.name IS NOT NULL AND sid.value IS NOT NULL THEN d.name || ':' || sid.value
+        WHEN d.name IS NOT NULL AND sid.value IS NULL THEN d.name || ':' || ne.text
+        WHEN d.name IS NULL AND sid.value IS NOT NULL THEN sid.value
+        ELSE ne.text
+    END AS tag
+FROM
+    NVTX_EVENTS AS ne
+LEFT OUTER JOIN
+    domains AS d
+ON
+    ne.domainId = d.id
+    AND (ne.globalTid & 0x0000FFFFFF000000) = (d.globalTid & 0x0000FFFFFF000000)
+LEFT OUTER JOIN
+    StringIds AS sid
+ON
+    ne.textId = sid.id
+WHERE
+    ne.eventType IN (59, 70)
+    AND ne.end IS NOT NULL
+    AND ne.globalTid IS NOT NULL
+ORDER BY
+    1, 2, 3 DESC
+"""
+
+QUERY_KERNEL_LAUNCHES = """
+SELECT
+    RUNTIME.globalTid AS thread,
+    RUNTIME.start AS launch_time,
+    KERNEL.end - KERNEL.start AS execution_time,
+    coalesce(KERNEL.shortName, KERNEL.demangledName) AS kernel_id
+FROM
+    CUPTI_ACTIVITY_KIND_KERNEL AS KERNEL
+JOIN
+    CUPTI_ACTIVITY_KIND_RUNTIME AS RUNTIME
+ON
+    RUNTIME.correlationId = KERNEL.correlationId
+WHERE
+    RUNTIME.eventClass != 67
+    AND RUNTIME.globalTid IS NOT NULL
+ORDER BY
+    1, 2
+"""
+
+QUERY_STRING_NAMES = "SELECT id, value FROM StringIds WHERE id IN ({ids})"
+
+ATTRIBUTION_REQUIRED_TABLES = ['CUPTI_ACTIVITY_KIND_KERNEL', 'CUPTI_ACTIVITY_KIND_RUNTIME', 'NVTX_EVENTS', 'StringIds']
+
+ATTRIBUTION_METHOD = 'Innermost push/pop NVTX range open at the runtime launch call on the launching thread'
+TOP_KERNELS = 5
+UNATTRIBUTED = 'Unattributed'
+
+
+def range_parents(starts, ends):
+    # ranges of one thread sorted by start (outer first on ties), push/pop ranges nest so a stack sweep finds
+    # the enclosing range of each one in a single pass
+    parents = [-1] * len(starts)
+    stack = []
+    for index, (start, end) in enumerate(zip(starts, ends)):
+        while stack and ends[stack[-1]] <= start:
+            stack.pop()
+        if stack:
+            parents[index] = stack[-1]
+        stack.append(index)
+
+    return np.array(parents, dtype=np.int64)
+
+
+def innermost_ranges(starts, ends, parents, times):
+    # the last range starting at or before a launch either encloses it or is nested in the ranges that do,
+    # so walking up its parents reaches the innermost enclosing one within the nesting depth
+    index = np.searchsorted(starts, times, side='right') - 1
+    pending = np.flatnonzero(index >= 0)
+    while pending.size:
+        pending = pending[ends[index[pending]] <= times[pending]]
+        index[pending] = parents[index[pending]]
+        pending = pending[index[pending] >= 0]
+
+    return index
+
+
+def attribute_launches(range_threads, range_starts, range_ends, launch_threads, launch_times):
+    # global range index of each launch, -1 outside of every range of its thread,
+    # both inputs are sorted by thread and time so each thread is a contiguous slice
+    owners = np.full(len(launch_times), -1, dtype=np.int64)
+    threads, thread_starts = np.unique(range_threads, return_index=True)
+    thread_ends = np.append(thread_starts[1:], len(range_threads))
+
+    for thread, first, last in zip(threads, thread_starts, thread_ends):
+        low, high = np.searchsorted(launch_threads, [thread, thread + 1])
+        if low == high:
+            continue
+        starts, ends = range_starts[first:last], range_ends[first:last]
+        parents = range_parents(starts.tolist(), ends.tolist())
+        index = innermost_ranges(starts, ends, parents, launch_times[low:high])
+        owners[low:high] = np.where(index >= 0, index + first, -1)
+
+    return owners
+
+
+def top_kernels(range_codes, kernel_codes, durations, num_ranges):
+    # (range, kernel) totals sorted by range then descending time, the first TOP_KERNELS of each range are kept
+    pairs, pair_codes = np.unique(np.stack([range_codes, kernel_codes]), axis=1, return_inverse=True)
+    pair_codes = pair_codes.reshape(-1)
+    pair_times = np.bincount(pair_codes, weights=durations, minlength=pairs.shape[1])
+    pair_counts = np.bincount(pair_codes, minlength=pairs.shape[1])
+
+    order = np.lexsort((-pair_times, pairs[0]))
+    tops = [[] for _ in range(num_ranges)]
+    for pair in order:
+        range_code = pairs[0, pair]
+        if len(tops[range_code]) < TOP_KERNELS:
+            tops[range_code].append((int(pairs[1, pair]), int(pair_counts[pair]), float(pair_times[pair])))
+
+    return tops
+
+
+def attribution_entry(name, kernel_count, kernel_time, total_time, tops, kernel_names):
+    return {
+        'Name': name,
+        'Kernel Count': kernel_count,
+        'Kernel Time': kernel_time,
+        'Kernel Time Percent': round(kernel_time * 100 / total_time, 2) if total_time else 0.0,
+        'Top Kernels': [{'Name': kernel_names.get(kernel_id, str(kernel_id)), 'Kernel Count': count,
+                         'Kernel Time': int(time),
+                         'Kernel Time Percent': round(time * 100 / kernel_time, 2) if kernel_time else 0.0}
+                        for kernel_id, count, time in tops]
+    }
+
+
+def kernel_names_of(database_file, kernel_ids):
+    if not kernel_ids:
+        return {}
+    with sqlite3.connect(database_file) as conn:
+        rows = conn.execute(QUERY_STRING_NAMES.format(ids=', '.join(str(int(id)) for id in kernel_ids))).fetchall()
+    return dict(rows)
+
+
+def create_nvtx_kernel_attribution(database_file, scope=None):
+    # kernels are attributed by their launch call, so only the kernels are scoped, the ranges enclosing them
+    # may start before the time window
+    logging.info("Attributing Kernels to their enclosing NVTX ranges")
+    with sqlite3.connect(database_file) as conn:
+        ranges = conn.execute(QUERY_NVTX_THREAD_RANGES).fetchall()
+        launches = conn.execute(scope_query(QUERY_KERNEL_LAUNCHES, scope)).fetchall()
+
+    range_threads, range_starts, range_ends, range_tags = zip(*ranges) if ranges else ([], [], [], [])
+    launch_threads, launch_times, durations, kernel_ids = zip(*launches) if launches else ([], [], [], [])
+    range_threads = np.array(range_threads, dtype=np.int64)
+    launch_threads = np.array(launch_threads, dtype=np.int64)
+    durations = np.array(durations, dtype=float)
+    kernel_ids = np.array(kernel_ids, dtype=np.int64)
+
+    owners = attribute_launches(range_threads, np.array(range_starts, dtype=np.int64),
+                                np.array(range_ends, dtype=np.int64), launch_threads,
+                                np.array(launch_times, dtype=np.int64))
+
+    # ranges are reported by name, launches outside of every range get the code after the last name
+    names, name_codes = np.unique(np.array([str(tag) for tag in range_tags], dtype=object), return_inverse=True)
+    name_codes = name_codes.reshape(-1)
+    num_names = len(names)
+    range_codes = np.where(owners >= 0, name_codes[np.maximum(owners, 0)] if len(name_codes) else 0, num_names)
+    range_instances = np.bincount(name_codes, minlength=num_names + 1)
+    kernel_counts = np.bincount(range_codes, minlength=num_names + 1)
+    kernel_times = np.bincount(range_codes, weights=durations, minlength=num_names + 1)
+    tops = top_kernels(range_codes, kernel_ids, durations, num_names + 1) if len(durations) else \
+        [[] for _ in range(num_names + 1)]
+
+    kernel_names = kernel_names_of(database_file, {kernel_id for top in tops for kernel_id, _, _ in top})
+    total_time = float(kernel_times.sum())
+    entries = []
+    for code in range(num_names):
+        entry = attribution_entry(str(names[code]), int(kernel_counts[code]), int(kernel_times[code]), total_time,
+                                  tops[code], kernel_names)
+        entry['Range Instances'] = int(range_instances[code])
+        entries.append(entry)
+    entries.sort(key=lambda entry: entry['Kernel Time'], reverse=True)
+
+    unattributed = attribution_entry(UNATTRIBUTED, int(kernel_counts[num_names]), int(kernel_times[num_names]),
+                                     total_time, tops[num_names], kernel_names)
+    logging.info(f"Attributed {len(launches) - unattributed['Kernel Count']} of {len(launches)} Kernels to "
+                 f"{sum(entry['Kernel Count'] > 0 for entry in entries)} NVTX ranges")
+
+    return {'Ranges': {entry['Name']: entry for entry in entries}, UNATTRIBUTED: unattributed}
@@ -0,0 +1,183 @@
+import os
+import sqlite3
+import tempfile
+from contextlib import contextmanager
+
+from absl import app, logging
+
+ARROW_SUFFIXES = {'.parquet': 'parquet', '.arrow': 'ipc', '.feather': 'ipc'}
+STAGING_BATCH_ROWS = 65536
+
+# Columns of the nsys export tables read by the NAV queries, everything else stays in the Parquet/Arrow files
+TRACE_COLUMNS = {
+    'CUPTI_ACTIVITY_KIND_KERNEL': ['start', 'end', 'shortName', 'demangledName', 'correlationId'],
+    'CUPTI_ACTIVITY_KIND_RUNTIME': ['start', 'end', 'correlationId', 'eventClass', 'globalTid'],
+    'CUPTI_ACTIVITY_KIND_MEMCPY': ['start', 'end', 'bytes', 'copyKind'],
+    'CUPTI_ACTIVITY_KIND_MEMSET': ['start', 'end', 'bytes'],
+    'NVTX_EVENTS': ['start', 'end', 'text', 'textId', 'domainId', 'globalTid', 'eventType'],
+    'MPI_P2P_EVENTS': ['start', 'end', 'textId', 'size'],
+    'MPI_COLLECTIVES_EVENTS': ['start', 'end', 'textId', 'size', 'recvSize'],
+    'UCP_SUBMIT_EVENTS': ['start', 'end', 'nameId', 'packedSize'],
+    'StringIds': ['id', 'value'],
+    'ANALYSIS_DETAILS': ['duration'],
+}
+
+# Tables filtered on their start column by the time window, with the rows that must be kept regardless (NVTX
+# domain definitions), the SQL scope is still applied on top so the staged rows only need to be a superset
+WINDOWED_TABLES = {
+    'CUPTI_ACTIVITY_KIND_KERNEL': None,
+    'CUPTI_ACTIVITY_KIND_MEMCPY': None,
+    'CUPTI_ACTIVITY_KIND_MEMSET': None,
+    'MPI_P2P_EVENTS': None,
+    'MPI_COLLECTIVES_EVENTS': None,
+    'UCP_SUBMIT_EVENTS': None,
+    'NVTX_EVENTS': ('eventType', 75),
+}
+
+PRIMARY_KEYS = {'StringIds': 'id'}
+
+# Join keys the NAV queries probe, indexed once after staging instead of by an automatic index in every query
+STAGING_INDEXES = {'CUPTI_ACTIVITY_KIND_RUNTIME': ['correlationId']}
+
+
+def split_trace_files(data_file):
+    # .sqlite files and Parquet/Arrow export directories separated by spaces, paths may contain spaces
+    files = []
+    path = ''
+    for token in data_file.split(' '):
+        path = f'{path} {token}' if path else token
+        if path.endswith('.sqlite') or (path.strip() and is_arrow_trace(path.strip())):
+            files.append(path.strip().rstrip(os.sep))
+            path = ''
+    if path.strip():
+        files.append(path.strip().rstrip(os.sep))
+    return files
+
+
+def is_arrow_trace(trace_file):
+    if os.path.isdir(trace_file):
+        return any(os.path.splitext(entry)[1] in ARROW_SUFFIXES for entry in os.listdir(trace_file))
+    return os.path.splitext(trace_file)[1] in ARROW_SUFFIXES
+
+
+def arrow_tables(trace_dir):
+    # nsys export --type parquetdir/arrowdir writes one <table>.parquet/.arrow file (or directory of parts) per table
+    tables = {}
+    for entry in sorted(os.listdir(trace_dir)):
+        name, suffix = os.path.splitext(entry)
+        if suffix in ARROW_SUFFIXES and name in TRACE_COLUMNS:
+            tables[name] = (os.path.join(trace_dir, entry), ARROW_SUFFIXES[suffix])
+    return tables
+
+
+def sqlite_type(arrow_type):
+    import pyarrow.types as types
+
+    if types.is_integer(arrow_type) or types.is_boolean(arrow_type):
+        return 'INTEGER'
+    if types.is_floating(arrow_type):
+        return 'REAL'
+    if types.is_string(arrow_type) or types.is_large_string(arrow_type) or types.is_dictionary(arrow_type):
+        return 'TEXT'
+    return ''
+
+
+def window_filter(table, columns, time_window, nvtx_range):
+    import pyarrow.dataset as ds
+    from helper.scope import parse_time_window
+
+    if not time_window or table not in WINDOWED_TABLES or 'start' not in columns:
+        return None
+    # NVTX ranges starting before the window still scope the activity inside it
+    if table == 'NVTX_EVENTS' and nvtx_range:
+        return None
+
+    window_start, window_end = parse_time_window(time_window)
+    condition = ds.field(columns['start']) >= window_start
+    if window_end is not None:
+        condition = condition & (ds.field(columns['start']) < window_end)
+    keep = WINDOWED_TABLES[table]
+    if keep and keep[0] in columns:
+        condition = condition | (ds.field(columns[keep[0]]) == keep[1])
+    return condition
+
+
+def stage_table(conn, table, path, file_format, time_window=None, nvtx_range=None):
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(path, format=file_format)
+    # SQLite column names are case insensitive, nsys spells some of them differently between versions
+    available = {name.lower(): name for name in dataset.schema.names}
+    columns = {column: available[column.lower()] for column in TRACE_COLUMNS[table] if column.lower() in available}
+    if not columns:
+        return 0
+
+    definitions = []
+    for column, name in columns.items():
+        definition = f'"{name}" {sqlite_type(dataset.schema.field(name).type)}'.strip()
+        if PRIMARY_KEYS.get(table) == column:
+            definition += ' NOT NULL PRIMARY KEY'
+        definitions.append(definition)
+    conn.execute(f'CREATE TABLE "{table}" ({", ".join(definitions)})')
+
+    insert = f'INSERT INTO "{table}" VALUES ({", ".join("?" * len(columns))})'
+    rows = 0
+    # batches come in file order, so the staged rowids follow the export like the .sqlite ones do
+    for batch in dataset.to_batches(columns=list(columns.values()),
+                                    filter=window_filter(table, columns, time_window, nvtx_range),
+                                    batch_size=STAGING_BATCH_ROWS):
+        conn.executemany(insert, zip(*(column.to_pylist() for column in batch.columns)))
+        rows += batch.num_rows
+    for column in STAGING_INDEXES.get(table, []):
+        if column in columns:
+            conn.execute(f'CREATE INDEX "{table}_{column}" ON "{table}" ("{columns[column]}")')
+    return rows
+
+
+@contextmanager
+def sqlite_backend(trace_file, staging_dir=None, time_window=None, nvtx_range=None):
+    yield trace_file
+
+
+@contextmanager
+def arrow_backend(trace_file, staging_dir=None, time_window=None, nvtx_range=None):
+    # the NAV queries run unchanged on a temporary SQLite file holding only the columns they read
+    try:
+        import pyarrow.dataset
+    except ImportError:
+        raise app.UsageError(f"Reading the Parquet/Arrow trace {trace_file} requires pyarrow (pip install pyarrow)")
+
+    if os.path.isdir(trace_file):
+        tables = arrow_tables(trace_file)
+    else:
+        name, suffix = os.path.splitext(os.path.basename(trace_file))
+        tables = {name: (trace_file, ARROW_SUFFIXES[suffix])}
+    if not tables:
+        raise app.UsageError(f"No nsys export tables found in {trace_file}")
+
+    if staging_dir:
+        os.makedirs(staging_dir, exist_ok=True)
+    staging_fd, staging_file = tempfile.mkstemp(prefix='nav-staged-', suffix='.sqlite', dir=staging_dir)
+    os.close(staging_fd)
+    try:
+        conn = sqlite3.connect(staging_file)
+        conn.execute("PRAGMA journal_mode=OFF;")
+        conn.execute("PRAGMA synchronous=OFF;")
+        for table, (path, file_format) in tables.items():
+            rows = stage_table(conn, table, path, file_format, time_window, nvtx_range)
+            logging.info(f"Staged {rows} rows of {table} from {path}")
+        conn.commit()
+        conn.close()
+        yield staging_file
+    finally:
+        os.remove(staging_file)
+
+
+def trace_backend(trace_file):
+    return arrow_backend if is_arrow_trace(trace_file) else sqlite_backend
+
+
+@contextmanager
+def open_trace(trace_file, staging_dir=None, time_window=None, nvtx_range=None):
+    with trace_backend(trace_file)(trace_file, staging_dir, time_window, nvtx_range) as database_file:
+        yield database_file
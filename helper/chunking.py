@@ -0,0 +1,106 @@
+import math
+
+from absl import logging
+
+from helper.general import execute_query_in_thread, merge_bucket_rows, statistics_from_buckets
+from helper.sampling import sample_query, sample_stride
+from helper.scheduler import estimate_query_cost
+from helper.scope import SCOPED_TABLES, scope_condition, shadow_tables
+
+QUERY_ROWID_RANGE = "SELECT min(rowid), max(rowid) FROM main.{table}"
+
+# Tables joined to a chunked one, restricted to the key range of the chunk so SQLite never indexes all of their rows
+CHUNK_JOINED_TABLES = {
+    'CUPTI_ACTIVITY_KIND_RUNTIME': ('CUPTI_ACTIVITY_KIND_KERNEL', 'correlationId'),
+}
+
+CHUNKING_METHOD = 'Base table rowid ranges with merged log bucket statistics'
+
+
+def rowid_ranges(query, database_file):
+    # first and past-the-last rowid of every base table the query reads, both ends of the rowid B-tree
+    ranges = {}
+    for table_name in SCOPED_TABLES:
+        if table_name in query:
+            low, high = execute_query_in_thread((QUERY_ROWID_RANGE.format(table=table_name), None), database_file)[1][0]
+            if low is not None:
+                ranges[table_name] = (low, high + 1)
+    return ranges
+
+
+def chunk_query(query, scope, ranges, index, num_chunks):
+    # the index-th of num_chunks rowid slices of every base table, a rowid range is a seek instead of a full scan
+    conditions = {}
+    for table_name, (low, high) in ranges.items():
+        start = low + (high - low) * index // num_chunks
+        end = low + (high - low) * (index + 1) // num_chunks
+        condition = f"rowid >= {start} AND rowid < {end}"
+        conditions[table_name] = f"{condition} AND {scope_condition(scope)}" if scope else condition
+    for table_name, (chunked_table, key) in CHUNK_JOINED_TABLES.items():
+        if table_name in query and chunked_table in conditions:
+            conditions[table_name] = (f"{key} BETWEEN (SELECT min({key}) FROM {chunked_table}) "
+                                      f"AND (SELECT max({key}) FROM {chunked_table})")
+
+    return shadow_tables(query, conditions)
+
+
+def split_giant_queries(query, scope, queries, costs, ids, statistics, database_file, chunk_rows, parse_function,
+                        sample_cap=None):
+    chunked_queries = []
+    chunked_costs = []
+    chunks = {}
+    ranges = None
+
+    for id, query_params, cost in zip(ids, queries, costs):
+        instances = statistics[id]['Instance']
+        stride = sample_stride(instances, sample_cap) if sample_cap else 1
+        if instances / stride <= chunk_rows:
+            chunked_queries.append(query_params)
+            chunked_costs.append(cost)
+            continue
+
+        if ranges is None:
+            ranges = rowid_ranges(query, database_file)
+        num_chunks = math.ceil(instances / (stride * chunk_rows))
+        chunks[id] = num_chunks
+        statistics[id]['Chunks'] = num_chunks
+        logging.info(f"Splitting {statistics[id].get('Name') or id} ({instances} rows) into {num_chunks} chunks")
+
+        chunk_cost = estimate_query_cost(instances // (stride * num_chunks))
+        for index in range(num_chunks):
+            range_query = chunk_query(query, scope, ranges, index, num_chunks)
+            if sample_cap:
+                chunked_queries.append((sample_query(range_query), (id, stride), parse_function))
+            else:
+                chunked_queries.append((range_query, (id,), parse_function))
+            chunked_costs.append(chunk_cost)
+
+    return chunked_queries, chunked_costs, chunks
+
+
+def merge_chunk_results(partials, labels, precision=0):
+    results_dict = {}
+
+    for label in labels:
+        label_partials = [partial.get(label) for partial in partials]
+        # a metric missing from any chunk is missing for the whole item, as in the unchunked parsers
+        if any(bucket_rows is None for bucket_rows in label_partials):
+            results_dict[label] = None
+            continue
+        bucket_rows = merge_bucket_rows(label_partials)
+        convert_bytes = 'Size' in label or 'Bandwidth' in label
+        results_dict[label] = statistics_from_buckets(bucket_rows, convert_bytes, precision) if bucket_rows else None
+
+    return results_dict
+
+
+def merge_chunked_results(results, chunks, labels, precision=0):
+    partials = {}
+
+    for id, dict in results:
+        if id not in chunks:
+            yield id, dict
+            continue
+        partials.setdefault(id, []).append(dict)
+        if len(partials[id]) == chunks[id]:
+            yield id, merge_chunk_results(partials.pop(id), labels, precision)
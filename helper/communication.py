@@ -1,8 +1,6 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
-
-from absl import logging
-
-from helper.general import generate_statistics, MAX_WORKERS, create_histogram, remove_outliers
+from helper.general import generate_statistics, create_histogram, summary_query, finalize_metric_statistics, \
+    bucket_rows_from_values
+from helper.outliers import remove_metric_outliers, record_outliers
 
 QUERY_COMMUNICATION = """
 WITH
@@ -13,14 +11,14 @@ WITH
             globalTid AS globalTid,
             text AS name
         FROM
-            NVTX_EVENTS
+            main.NVTX_EVENTS
         WHERE
             eventType == 75
         GROUP BY 2, 3
     ),
     maxts AS(
         SELECT max(max(start), max(end)) AS m
-        FROM   NVTX_EVENTS
+        FROM   main.NVTX_EVENTS
     ),
     nvtx AS (
         SELECT
@@ -91,7 +89,7 @@ QUERY_COMMUNICATION_STATS = """
 WITH
     max_times AS (
         SELECT MAX(start) AS max_start, MAX(end) AS max_end
-        FROM NVTX_EVENTS
+        FROM main.NVTX_EVENTS
     ),
     nvtx AS (
         SELECT
@@ -101,7 +99,8 @@ WITH
                 WHEN d.name IS NOT NULL AND sid.value IS NULL THEN d.name || ':' || ne.text
                 WHEN d.name IS NULL AND sid.value IS NOT NULL THEN sid.value
                 ELSE ne.text
-            END AS tag
+            END AS tag,
+            ne.start AS start
         FROM
             NVTX_EVENTS AS ne
         LEFT OUTER JOIN
@@ -112,7 +111,7 @@ WITH
                     globalTid AS globalTid,
                     text AS name
                 FROM
-                    NVTX_EVENTS
+                    main.NVTX_EVENTS
                 WHERE
                     eventType = 75
                 GROUP BY
@@ -130,18 +129,75 @@ WITH
     )
 SELECT
     tag AS "Name",
-    duration AS "Duration:dur_ns"
+    duration AS "Duration:dur_ns",
+    start AS "Start"
 FROM
     nvtx
 WHERE
     name = ?
 """
 
+COMMUNICATION_METRIC_VALUES = """
+WITH
+    max_times AS (
+        SELECT MAX(start) AS max_start, MAX(end) AS max_end
+        FROM main.NVTX_EVENTS
+    ),
+    nvtx AS (
+        SELECT
+            COALESCE(ne.end, (SELECT max_end FROM max_times)) - ne.start AS duration,
+            CASE
+                WHEN d.name IS NOT NULL AND sid.value IS NOT NULL THEN d.name || ':' || sid.value
+                WHEN d.name IS NOT NULL AND sid.value IS NULL THEN d.name || ':' || ne.text
+                WHEN d.name IS NULL AND sid.value IS NOT NULL THEN sid.value
+                ELSE ne.text
+            END AS tag
+        FROM
+            NVTX_EVENTS AS ne
+        LEFT OUTER JOIN
+            (
+                SELECT
+                    MIN(start) AS min_start,
+                    domainId AS id,
+                    globalTid AS globalTid,
+                    text AS name
+                FROM
+                    main.NVTX_EVENTS
+                WHERE
+                    eventType = 75
+                GROUP BY
+                    domainId, globalTid, text
+            ) AS d
+        ON
+            ne.domainId = d.id
+            AND (ne.globalTid & 0x0000FFFFFF000000) = (d.globalTid & 0x0000FFFFFF000000)
+        LEFT OUTER JOIN
+            StringIds AS sid
+        ON
+            ne.textId = sid.id
+        WHERE
+            ne.eventType IN (59, 60, 70, 71)
+    ),
+    metric_values AS (
+        SELECT
+            tag AS id,
+            0 AS metric,
+            duration AS value
+        FROM
+            nvtx
+    )
+"""
+
+QUERY_COMMUNICATION_SUMMARY = summary_query(COMMUNICATION_METRIC_VALUES)
+
+COMMUNICATION_METRICS = ['Execution Duration']
+
 COMM_REQUIRED_TABLES = ['NVTX_EVENTS', 'StringIds']
 
 
-def generate_communicaiton_stats(comm):
-    durations = [dur[1] for dur in comm[1]]
+def generate_communicaiton_stats(comm, outlier_filters=None):
+    dropped = {}
+    durations = remove_metric_outliers([dur[1] for dur in comm[1]], 'Execution Duration', outlier_filters, dropped)
     label = comm[0]
     dict = {}
 
@@ -150,55 +206,18 @@ def generate_communicaiton_stats(comm):
         histogram_data = create_histogram( durations, bins=10, powers_2=False, base=False,
                                            convert_bytes=False, return_bins=False )
         dict[label]['Execution Duration']['Distribution'] = histogram_data
+        record_outliers(dict[label], dropped)
     else:
         dict[label] = None
 
     return label, dict[label]
 
 
-def parallel_parse_communication_data(queries_res):
-    total_tasks = len(queries_res)
-    completed_tasks = 0
-
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-        for data in queries_res:
-            future = executor.submit(generate_communicaiton_stats, data)
-            futures.append(future)
-
-        results = []
-        for future in as_completed(futures):
-            results.append(future.result())
-            completed_tasks += 1
-
-            # Log progress every 10%
-            if int((completed_tasks / total_tasks) * 100 % 10) == 0:
-                logging.info(f"Progress: {(completed_tasks / total_tasks) * 100:.1f}%")
-
-    return results
-
-
-def create_specific_communication_stats(comm_stats, handle_outliers=False):
-    dict = {}
-    cluster_data = []
-    combined_raw_data = []
+def parse_communication_chunk(comm, precision=0):
+    durations = [dur[1] for dur in comm[1]]
 
-    for kernel_id, kernel_info in comm_stats.items():
-        if kernel_info["Execution Duration"]:
-            if kernel_info["Execution Duration"]["Raw Data"]:
-                combined_raw_data.extend(kernel_info["Execution Duration"]["Raw Data"])
-            if kernel_info["Execution Duration"]['Mean'] and kernel_info["Execution Duration"]['Median'] and \
-                    kernel_info[
-                        "Instance"]:
-                cluster_data.append(
-                    [kernel_info["Execution Duration"]['Mean'], kernel_info["Execution Duration"]['Median'],
-                     kernel_info["Instance"]])
+    return comm[0], {'Execution Duration': bucket_rows_from_values(durations, precision)}
 
-    if handle_outliers and cluster_data: cluster_data = remove_outliers(cluster_data)
-    if combined_raw_data:
-        dict.update(generate_statistics(combined_raw_data, "Execution Duration", disable_raw=True))
-        dict["Execution Duration"]['Distribution'] = create_histogram(combined_raw_data)
-    if cluster_data:
-        dict["Execution Duration"]['k-mean'] = {'Raw Data': cluster_data}
 
-    return dict
+def finalize_communication_stats(accumulator):
+    return finalize_metric_statistics(accumulator["Execution Duration"], "Execution Duration")
@@ -0,0 +1,147 @@
+import copy
+import json
+import logging as python_logging
+import os
+import socket
+import threading
+import time
+
+from absl import flags, logging
+
+from helper.general import enable_warm_state, shutdown_worker_pools
+
+DAEMON_BACKLOG = 16
+
+
+class JobLogHandler(python_logging.Handler):
+    # forwards the log records of one job thread to its client
+    def __init__(self, send, thread_id):
+        super().__init__()
+        self.send = send
+        self.thread_id = thread_id
+        self.setFormatter(logging.PythonFormatter())
+
+    def emit(self, record):
+        if record.thread != self.thread_id:
+            return
+        try:
+            self.send({'log': self.format(record)})
+        except OSError:
+            pass
+
+
+def new_daemon_state(max_jobs):
+    return {'Slots': threading.BoundedSemaphore(max_jobs), 'Max Jobs': max_jobs, 'Directory': threading.Condition(),
+            'Cwd': None, 'Running': 0, 'Stop': threading.Event()}
+
+
+def enter_directory(state, cwd):
+    # output paths are relative, so only jobs sharing a working directory run side by side
+    with state['Directory']:
+        state['Directory'].wait_for(lambda: state['Running'] == 0 or state['Cwd'] == cwd)
+        if state['Running'] == 0:
+            os.chdir(cwd)
+            state['Cwd'] = cwd
+        state['Running'] += 1
+
+
+def leave_directory(state):
+    with state['Directory']:
+        state['Running'] -= 1
+        state['Directory'].notify_all()
+
+
+def run_job(request, send, run_function, flag_values, state):
+    job_flags = copy.deepcopy(flag_values)
+    job_flags.unparse_flags()
+    try:
+        job_flags(['main.py'] + list(request.get('argv', [])))
+    except flags.Error as error:
+        send({'log': f"Invalid arguments: {error}"})
+        return 1
+    # the parsed verbosity flag resets the shared absl logger
+    logging.set_verbosity(logging.INFO)
+    if job_flags.serve:
+        send({'log': "A daemon job cannot start another daemon"})
+        return 1
+    if not job_flags.data_file and not job_flags.nav_file and not job_flags.trend_query and not job_flags.rank_files:
+        send({'log': "Must provide path to data base file or already parsed json file"})
+        return 1
+
+    if not state['Slots'].acquire(blocking=False):
+        send({'log': f"Waiting for one of {state['Max Jobs']} job slots"})
+        state['Slots'].acquire()
+
+    handler = JobLogHandler(send, threading.get_ident())
+    logging.get_absl_logger().addHandler(handler)
+    enter_directory(state, request.get('cwd') or os.getcwd())
+    try:
+        status = run_function(job_flags)
+    except Exception as e:
+        logging.exception(f"An error occurred: {e}")
+        status = 1
+    finally:
+        leave_directory(state)
+        logging.get_absl_logger().removeHandler(handler)
+        state['Slots'].release()
+
+    return status or 0
+
+
+def handle_client(connection, run_function, flag_values, state):
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            connection.sendall((json.dumps(message) + '\n').encode())
+
+    start_time = time.time()
+    try:
+        with connection, connection.makefile('r') as reader:
+            request = json.loads(reader.readline() or '{}')
+            if request.get('command') == 'shutdown':
+                state['Stop'].set()
+                send({'status': 0, 'elapsed': 0})
+                return
+            status = run_job(request, send, run_function, flag_values, state)
+            send({'status': status, 'elapsed': time.time() - start_time})
+    except (OSError, ValueError) as error:
+        logging.warning(f"Daemon client failed: {error}")
+
+
+def serve(socket_path, run_function, flag_values, max_jobs=2):
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    enable_warm_state()
+    state = new_daemon_state(max_jobs)
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    # the socket is created owner only, a chmod after bind would leave a window for other users to connect
+    previous_umask = os.umask(0o177)
+    try:
+        server.bind(socket_path)
+    finally:
+        os.umask(previous_umask)
+    server.listen(DAEMON_BACKLOG)
+    server.settimeout(1)
+    logging.info(f"Serving NAV jobs on {socket_path} with {max_jobs} concurrent jobs")
+
+    try:
+        while not state['Stop'].is_set():
+            try:
+                connection, _ = server.accept()
+            except socket.timeout:
+                continue
+            connection.settimeout(None)
+            threading.Thread(target=handle_client, args=(connection, run_function, flag_values, state),
+                             daemon=True).start()
+    finally:
+        server.close()
+        logging.info("Stopping daemon, waiting for running jobs")
+        for _ in range(max_jobs):
+            state['Slots'].acquire()
+        shutdown_worker_pools()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+    return 0
@@ -1,25 +1,32 @@
 import os
+import threading
 import warnings
-from concurrent.futures import ProcessPoolExecutor
 
 from absl import logging
 
 from helper.figures import create_and_plot_k_mean_statistics, plot_bandwidth_distribution, plot_frequency_distribution, \
     plot_combined_data, plot_combined_overall_bandwidth_distribution, plot_binned_bandwidth_distribution, \
     plot_combined_frequency_distribution
-from helper.general import MAX_WORKERS
+from helper.general import MAX_WORKERS, NAV_METADATA, NON_CATEGORY_KEYS, NVTX_ATTRIBUTION, acquire_worker_pool, release_worker_pool, call_in_directory, \
+    bucket_rows_from_values, merge_bucket_rows
+from helper.output import call_with_outputs, write_outputs, writes_to_disk, archive_outputs
+from helper.planner import item_samples, plan_rendering, planning_enabled, record_render_costs, timed_call
 from helper.tables import export_single_general_stat_to_latex, export_single_general_stat_to_CSV, \
     export_summary_stat_to_latex, export_summary_stat_to_CSV, export_overall_summary_stat_to_latex, \
     export_summary_summary_stat_to_CSV, export_combined_summary_stat_to_CSV, export_combined_summary_stat_to_latex, \
     export_combined_overall_summary_stat_to_CSV, export_combined_overall_summary_stat_to_latex, \
     export_combined_overall_component_summary_stat_to_CSV, export_combined_overall_component_summary_stat_to_latex, \
-    export_combined_overall_duration_summary_stat_to_latex, export_combined_overall_duration_summary_stat_to_CSV
+    export_combined_overall_duration_summary_stat_to_latex, export_combined_overall_duration_summary_stat_to_CSV, \
+    export_other_summary_to_CSV, export_other_summary_to_latex, export_nvtx_attribution_to_CSV, \
+    export_nvtx_attribution_to_latex, export_rank_imbalance_to_CSV, export_rank_imbalance_to_latex
 
 # Ignore Future warnings
 warnings.filterwarnings ( 'ignore', category=FutureWarning )
 
+FIGURE_LOCK = threading.Lock()  # pyplot state is global, jobs of the analysis daemon export one at a time
 
-def base_generate_tables_and_figures(data_dict, parent_dir, summary_combined_tables=False):
+
+def base_generate_tables_and_figures(data_dict, parent_dir, summary_combined_tables=False, violin_method='histogram'):
     if 'Individual Kernels' in parent_dir:
         title = data_dict['Name']
     else:
@@ -44,56 +51,101 @@ def base_generate_tables_and_figures(data_dict, parent_dir, summary_combined_tab
                 export_summary_stat_to_CSV ( individual_items, parent_dir, title, stat )
                 export_summary_stat_to_latex ( individual_items, parent_dir, title, stat )
 
+    generate_figures ( data_dict, title, parent_dir, violin_method )
+
+    return None
+
+
+def generate_figures(data_dict, title, parent_dir, violin_method='histogram'):
+    # the k-mean figures of every metric share their file names, only those of the last metric are kept
+    k_mean = None
     for metric, stats in data_dict.items ():
         if metric == 'Bandwidth Distribution' and isinstance ( stats, dict ):
             temp_title = title + " " + metric
-            plot_bandwidth_distribution ( stats, temp_title, parent_dir )
+            plot_bandwidth_distribution ( stats, temp_title, parent_dir, violin_method )
         elif isinstance ( stats, dict ) and 'Individual' not in metric:
             for sub_metric, sub_stats in stats.items ():
                 temp_title = title + ": " + metric + " " + sub_metric
                 if sub_metric == 'Distribution' and isinstance ( sub_stats, dict ):
                     if 'Duration' in metric or 'Slack' in metric or 'Overhead' in metric:
                         units = ' (us)'
+                    elif 'Bandwidth' in metric:
+                        units = ' (B/s)'
                     else:
                         units = ''
                     xlabel = metric + units
                     plot_frequency_distribution ( sub_stats, temp_title, xlabel, parent_dir )
                 elif 'k-mean' == sub_metric and isinstance ( sub_stats, dict ):
                     if sub_stats['Raw Data']:
-                        create_and_plot_k_mean_statistics ( sub_stats, temp_title, parent_dir )
-
+                        k_mean = (sub_stats, temp_title)
+
+    if k_mean:
+        create_and_plot_k_mean_statistics ( k_mean[0], k_mean[1], parent_dir )
+
+
+def comparison_source(stats_list, raw_limit=None):
+    # Raw Data of the items while all of them have it and together hold at most raw_limit samples, otherwise the
+    # merged bucket counts, which NAV files without Raw Data (summary only, chunked, histogram mode) always store
+    stats_list = [stats for stats in stats_list if isinstance ( stats, dict )]
+    raw_data = [stats.get ( 'Raw Data' ) for stats in stats_list]
+    if stats_list and all ( raw_data ) and (raw_limit is None or sum ( len ( raw ) for raw in raw_data ) <= raw_limit):
+        return (raw_data[0] if len ( raw_data ) == 1 else [value for raw in raw_data for value in raw]), None
+
+    bucket_rows = [stats['Buckets'] if stats.get ( 'Buckets' ) else bucket_rows_from_values ( raw )
+                   for stats, raw in zip ( stats_list, raw_data ) if stats.get ( 'Buckets' ) or raw]
+    return (None, merge_bucket_rows ( bucket_rows )) if bucket_rows else None
+
+
+def comparison_sources(stats_by_trace, raw_limit=None):
+    sources = {}
+    for label, stats_list in stats_by_trace.items ():
+        source = comparison_source ( stats_list, raw_limit )
+        if source is not None:
+            sources[label] = source
+    return sources
+
+
+def bandwidth_pairs(distributions, raw_limit=None):
+    # (transfer size, bandwidth) pairs, an evenly strided subset once they exceed raw_limit
+    pairs = [distribution['Raw Data'] for distribution in distributions
+             if isinstance ( distribution, dict ) and distribution.get ( 'Raw Data' )]
+    samples = sum ( len ( item_pairs ) for item_pairs in pairs )
+    stride = -(-samples // raw_limit) if raw_limit and samples > raw_limit else 1
+    return [pair for item_pairs in pairs for pair in item_pairs[::stride]]
+
+
+def bandwidth_stats(item):
+    # per transfer bandwidth statistics, summary extraction stores them as Transfer Bandwidth
+    if isinstance ( item.get ( 'Transfer Bandwidth' ), dict ):
+        return item['Transfer Bandwidth']
+    distribution = item.get ( 'Bandwidth Distribution' )
+    if isinstance ( distribution, dict ) and distribution.get ( 'Raw Data' ):
+        return {'Raw Data': [bandwidth for _, bandwidth in distribution['Raw Data']]}
     return None
 
 
-def base_generate_combined_tables_and_figures(data_dict, parent_dir, combined_info=None, kernels=False):
+def base_generate_combined_tables_and_figures(data_dict, parent_dir, combined_info=None, kernels=False, raw_limit=None, violin_method='histogram'):
 
     if combined_info is not None:
         item_name = combined_info[0]
         labels = combined_info[1:]
-
-        if kernels:
-            keys = {label: next ( key for key, value in data_dict[label].items () if value.get ( 'Name' ) == item_name )
-                    for label in labels}
-
-        item_dicts = {label: data_dict[label][keys[label]] if kernels else data_dict[label][item_name] for label in
-                      labels}
+        item_dicts = common_item_dicts ( data_dict, combined_info, kernels )
 
         for sub_metric, sub_dict in item_dicts[labels[0]].items ():
             if isinstance ( sub_dict, dict ) and 'Individual' not in sub_metric and 'Bandwidth Distribution' != sub_metric:
                 name = item_name
-                plot_combined_data ( item_dicts, name, sub_metric, parent_dir )
+                sources = comparison_sources ( {label: [item_dicts[label].get ( sub_metric )] for label in labels}, raw_limit )
+                plot_combined_data ( sources, name, sub_metric, parent_dir, violin_method )
                 export_combined_summary_stat_to_CSV ( item_dicts, parent_dir, name, sub_metric )
                 export_combined_summary_stat_to_latex ( item_dicts, parent_dir, name, sub_metric )
             elif 'Bandwidth Distribution' == sub_metric:
                 raw_bandwidth_data = {}
                 for label in labels:
-                    data = []
-                    if item_dicts[label]['Bandwidth Distribution'] is not None and item_dicts[label]['Bandwidth Distribution']['Raw Data'] is not None:
-                            data.extend ( item_dicts[label]['Bandwidth Distribution']['Raw Data'])
+                    data = bandwidth_pairs ( [item_dicts[label]['Bandwidth Distribution']], raw_limit )
                     if len(data) > 0:
                         raw_bandwidth_data[label] = data
                 if len(raw_bandwidth_data) > 1:
-                    plot_binned_bandwidth_distribution ( raw_bandwidth_data, name, parent_dir )
+                    plot_binned_bandwidth_distribution ( raw_bandwidth_data, item_name, parent_dir, violin_method )
 
     else:
         labels = list(data_dict.keys())
@@ -101,46 +153,65 @@ def base_generate_combined_tables_and_figures(data_dict, parent_dir, combined_in
         individual = next((item for item in item_name if 'Individual' in item), None)
         item_name = [item for item in item_name if isinstance(data_dict[next(iter(data_dict))][item], dict) and 'Individual' not in item]
         name = parent_dir.split ( '/' )[-1]
-        raw_individual_data = {}
-        item_dicts = {}
 
         for metric in item_name:
+            item_dicts = {}
+            stats_by_trace = {}
             for label in labels:
-                data = []
                 if label in data_dict and individual in data_dict[label]:
-                    keys = data_dict[label][individual].keys()
-                    for key in keys:
-                        if key in data_dict[label][individual] and isinstance(data_dict[label][individual][key], dict):
-                            if metric in data_dict[label][individual][key] and isinstance(
-                                    data_dict[label][individual][key][metric], dict):
-                                metric_data = data_dict[label][individual][key][metric]
-                                if 'Raw Data' in metric_data:
-                                    raw_data = metric_data['Raw Data']
-                                    if raw_data is not None:
-                                        data.extend(raw_data)
-
-                if data:
-                    raw_individual_data[label] = data
+                    stats_by_trace[label] = [item.get ( metric ) for item in data_dict[label][individual].values ()
+                                             if isinstance ( item, dict )]
 
                 if metric in data_dict[label] and isinstance(data_dict[label][metric], dict):
                     item_dicts[label] = data_dict[label][metric]
 
-            plot_combined_data ( raw_individual_data, name, metric, parent_dir, raw_provided=True)
-            plot_combined_frequency_distribution( raw_individual_data, name, metric, parent_dir)
+            sources = comparison_sources ( stats_by_trace, raw_limit )
+            plot_combined_data ( sources, name, metric, parent_dir, violin_method )
+            plot_combined_frequency_distribution( sources, name, metric, parent_dir)
             export_combined_overall_summary_stat_to_CSV ( item_dicts, parent_dir, name, metric )
             export_combined_overall_summary_stat_to_latex ( item_dicts, parent_dir, name, metric )
 
-        if name == 'Transfer Statistics':
+        if name in ('Transfer Statistics', 'MPI Statistics'):
             raw_bandwidth_data = {}
+            bandwidth_by_trace = {}
             for label in labels:
-                data = []
-                keys = data_dict[label][individual].keys()
-                for key in keys:
-                    if data_dict[label][individual][key]['Bandwidth Distribution'] is not None and data_dict[label][individual][key]['Bandwidth Distribution']['Raw Data'] is not None:
-                        data.extend ( data_dict[label][individual][key]['Bandwidth Distribution']['Raw Data'] )
-                raw_bandwidth_data[label] = data
-            plot_combined_overall_bandwidth_distribution ( raw_bandwidth_data, name, parent_dir )
-            plot_binned_bandwidth_distribution ( raw_bandwidth_data, name, parent_dir )
+                items = data_dict[label][individual].values ()
+                data = bandwidth_pairs ( [item.get ( 'Bandwidth Distribution' ) for item in items], raw_limit )
+                if data:
+                    raw_bandwidth_data[label] = data
+                bandwidth_by_trace[label] = [bandwidth_stats ( item ) for item in items]
+            plot_combined_overall_bandwidth_distribution ( comparison_sources ( bandwidth_by_trace, raw_limit ), name, parent_dir, violin_method )
+            if len ( raw_bandwidth_data ) == len ( labels ):
+                plot_binned_bandwidth_distribution ( raw_bandwidth_data, name, parent_dir, violin_method )
+            else:
+                logging.info ( f"\"{name}: Bandwidth Distribution by Transfer Size\" needs the (size, bandwidth) Raw Data of every trace, No figure generated" )
+
+
+def common_item_dicts(data_dict, combined_info, kernels=False):
+    item_name = combined_info[0]
+    labels = combined_info[1:]
+
+    if kernels:
+        keys = {label: next ( key for key, value in data_dict[label].items () if value.get ( 'Name' ) == item_name )
+                for label in labels}
+
+    return {label: data_dict[label][keys[label]] if kernels else data_dict[label][item_name] for label in labels}
+
+
+def other_summary_rows(item_dicts_by_trace):
+    # one row per item left out of the detailed export, followed by the aggregate of each trace
+    rows = []
+    totals = {}
+    for name, trace, item in item_dicts_by_trace:
+        rows.append ( [name, trace, item.get ( 'Time Percent' ), item.get ( 'Time Total' ), item.get ( 'Instance' )] )
+        total = totals.setdefault ( trace, [0, 0, 0, 0] )
+        total[0] += 1
+        total[1] += item.get ( 'Time Percent' ) or 0
+        total[2] += item.get ( 'Time Total' ) or 0
+        total[3] += item.get ( 'Instance' ) or 0
+    for trace, (count, time_percent, time_total, instances) in totals.items ():
+        rows.append ( [f"Other ({count} items)", trace, round ( time_percent, 2 ), time_total, instances] )
+    return rows
 
 
 def find_common_keys_or_names(data_dict, kernels=False):
@@ -165,37 +236,65 @@ def find_common_keys_or_names(data_dict, kernels=False):
     return common_items
 
 
-def generate_specific_tables_and_figures(data_dict, parent_dir, combined=False):
+def generate_specific_tables_and_figures(data_dict, parent_dir, combined=False, render_limits=None):
     logging.info ( f"Starting Individual kernel/type Summary Figure and Table Generation" )
-    with ProcessPoolExecutor ( max_workers=MAX_WORKERS ) as executor:
-        futures = []
+    executor = acquire_worker_pool ( 'Export', MAX_WORKERS )
+    directory = os.getcwd ()
+    # with an archive sink workers hand their tables and figures back as in-memory buffers
+    collect = not writes_to_disk ()
+    title = parent_dir.split ( '/' )[-1]
+    violin_method = (render_limits or {}).get ( 'Violin Method' ) or 'histogram'
+    try:
+        futures = {}
         if not combined:
-            for sub_dir, sub_dict in data_dict.items ():
+            kind = 'Individual'
+            candidates = [(sub_dir, sub_dict.get ( 'Time Total' ), item_samples ( sub_dict )) for sub_dir, sub_dict in data_dict.items ()]
+            detailed, other = plan_rendering ( candidates, kind, render_limits, MAX_WORKERS )
+            for sub_dir in detailed:
                 temp_parent_dir = parent_dir + '/' + str ( sub_dir )
-                os.makedirs ( temp_parent_dir, exist_ok=True )
-                futures.append ( executor.submit ( base_generate_tables_and_figures, sub_dict, temp_parent_dir ) )
+                futures[executor.submit ( call_in_directory, directory, timed_call, call_with_outputs, collect, base_generate_tables_and_figures, data_dict[sub_dir], temp_parent_dir, violin_method=violin_method )] = item_samples ( data_dict[sub_dir] )
+            other_items = [(data_dict[sub_dir].get ( 'Name' ) or sub_dir, '', data_dict[sub_dir]) for sub_dir in other]
         else:
+            kind = 'Combined'
+            raw_limit = (render_limits or {}).get ( 'Comparison Samples' )
             kernels = True if 'Kernels' in parent_dir else False
             common_items = find_common_keys_or_names ( data_dict, kernels=kernels )
-            for common_item in common_items:
+            common_dicts = [common_item_dicts ( data_dict, common_item, kernels ) for common_item in common_items]
+            candidates = [(index, sum ( item.get ( 'Time Total' ) or 0 for item in item_dicts.values () ),
+                           sum ( item_samples ( item ) for item in item_dicts.values () )) for index, item_dicts in enumerate ( common_dicts )]
+            detailed, other = plan_rendering ( candidates, kind, render_limits, MAX_WORKERS )
+            for index in detailed:
+                common_item = common_items[index]
                 temp_parent_dir = parent_dir + '/' + str ( common_item[0] )
-                os.makedirs ( temp_parent_dir, exist_ok=True )
-                futures.append ( executor.submit ( base_generate_combined_tables_and_figures, data_dict, temp_parent_dir, common_item, kernels=kernels) )
+                futures[executor.submit ( call_in_directory, directory, timed_call, call_with_outputs, collect, base_generate_combined_tables_and_figures, data_dict, temp_parent_dir, common_item, kernels=kernels, raw_limit=raw_limit, violin_method=violin_method)] = candidates[index][2]
+            other_items = [(common_items[index][0], label, item) for index in other for label, item in common_dicts[index].items ()]
 
         # Wait for all tasks to complete
-        for future in futures:
-            future.result ()
+        measurements = []
+        for future, samples in futures.items ():
+            outputs, elapsed = future.result ()
+            write_outputs ( outputs )
+            measurements.append ( (samples, elapsed) )
+    finally:
+        release_worker_pool ( executor )
+
+    # the cost model only learns while rendering is planned, plain exports leave no cache file behind
+    if planning_enabled ( render_limits ):
+        record_render_costs ( kind, measurements )
+    if other_items:
+        rows = other_summary_rows ( other_items )
+        export_other_summary_to_CSV ( rows, parent_dir, title )
+        export_other_summary_to_latex ( rows, parent_dir, title )
 
     return None
 
 
-def generate_general_tables_and_figures(data_dict, parent_dir, no_specific=False, no_individual=False, combined=False):
+def generate_general_tables_and_figures(data_dict, parent_dir, no_specific=False, no_individual=False, combined=False, render_limits=None):
     if not combined:
         for sub_dir, sub_dict in data_dict.items ():
             if ('Individual' in sub_dir and not no_individual):
                 temp_parent_dir = parent_dir + '/' + sub_dir
-                os.makedirs ( temp_parent_dir, exist_ok=True )
-                generate_specific_tables_and_figures ( sub_dict, temp_parent_dir )
+                generate_specific_tables_and_figures ( sub_dict, temp_parent_dir, render_limits=render_limits )
     else:
         configs = list(data_dict.keys ())
         stats = list(data_dict[configs[0]].keys())
@@ -203,16 +302,15 @@ def generate_general_tables_and_figures(data_dict, parent_dir, no_specific=False
             if ('Individual' in stat):
                 temp_dict = {config: data_dict[config][stat] for config in configs}
                 temp_parent_dir = parent_dir + '/' + stat
-                os.makedirs ( temp_parent_dir, exist_ok=True )
-                generate_specific_tables_and_figures ( temp_dict, temp_parent_dir, combined=True )
+                generate_specific_tables_and_figures ( temp_dict, temp_parent_dir, combined=True, render_limits=render_limits )
 
     if not no_specific and combined:
         logging.info ( f"Starting Specific Metric Summary Figure and Table Generation" )
         kernels = True if 'Kernels' in parent_dir else False
-        base_generate_combined_tables_and_figures ( data_dict, parent_dir, kernels=kernels)
+        base_generate_combined_tables_and_figures ( data_dict, parent_dir, kernels=kernels, raw_limit=(render_limits or {}).get ( 'Comparison Samples' ), violin_method=(render_limits or {}).get ( 'Violin Method' ) or 'histogram' )
     elif not no_specific:
         logging.info ( f"Starting Specific Metric Summary Figure and Table Generation" )
-        base_generate_tables_and_figures ( data_dict, parent_dir, summary_combined_tables=True )
+        base_generate_tables_and_figures ( data_dict, parent_dir, summary_combined_tables=True, violin_method=(render_limits or {}).get ( 'Violin Method' ) or 'histogram' )
 
     return None
 
@@ -222,7 +320,7 @@ def export_overall_summary_tables(data_dict, parent_dir):
     total_time = 0
 
     for stats_names, sub_dict in data_dict.items ():
-        if isinstance(sub_dict, dict):
+        if isinstance(sub_dict, dict) and stats_names not in NON_CATEGORY_KEYS:
             summary_stats[stats_names] = {'Time Total': 0, 'Instance': 0}
             for metric, stats in sub_dict.items ():
                 if 'Individual' in metric:
@@ -243,7 +341,7 @@ def export_overall_summary_tables(data_dict, parent_dir):
 def export_combined_overall_summary_tables(data_dict, parent_dir):
     configs = list(data_dict.keys())
     stats = list(data_dict[configs[0]].keys())
-    stats = [stat for stat in stats if isinstance(data_dict[configs[0]][stat], dict)]
+    stats = [stat for stat in stats if isinstance(data_dict[configs[0]][stat], dict) and stat not in NON_CATEGORY_KEYS]
     summary_stats = {}
 
     for stat in stats:
@@ -266,39 +364,58 @@ def export_combined_overall_summary_tables(data_dict, parent_dir):
     export_combined_overall_duration_summary_stat_to_latex(data_dict, parent_dir)
 
 
-def extract_general_dict(data_dict, parent_dir, no_general=False, no_specific=False, no_individual=False, combined=False):
+def extract_general_dict(data_dict, parent_dir, no_general=False, no_specific=False, no_individual=False, combined=False, render_limits=None):
 
     if not combined:
         for sub_dir, sub_dict in data_dict.items ():
-            if isinstance(sub_dict,dict):
+            if isinstance(sub_dict,dict) and sub_dir not in NON_CATEGORY_KEYS:
                 temp_parent_dir = parent_dir + '/' + sub_dir
-                os.makedirs ( temp_parent_dir, exist_ok=True )
-                generate_general_tables_and_figures ( sub_dict, temp_parent_dir, no_specific, no_individual )
+                generate_general_tables_and_figures ( sub_dict, temp_parent_dir, no_specific, no_individual, render_limits=render_limits )
     else:
         configs = list(data_dict.keys ())
         stats = list(data_dict[configs[0]].keys())
         for stat in stats:
-            if 'Total Duration' != stat:
+            if 'Total Duration' != stat and stat not in NON_CATEGORY_KEYS:
                 temp_dict = {config: data_dict[config].get(stat) for config in configs}
                 temp_dict = {k: v for k, v in temp_dict.items() if v is not None and isinstance(v, dict)}
                 temp_parent_dir = parent_dir + '/' + stat
                 if len(temp_dict) >= 2:
-                    os.makedirs ( temp_parent_dir, exist_ok=True )
-                    generate_general_tables_and_figures ( temp_dict, temp_parent_dir, combined=True)
+                    generate_general_tables_and_figures ( temp_dict, temp_parent_dir, combined=True, render_limits=render_limits )
 
     if not no_general and not combined:
         logging.info ( f"Starting Overall Summary Figure and Table Generation" )
         export_overall_summary_tables ( data_dict, parent_dir )
+        if data_dict.get ( NVTX_ATTRIBUTION ):
+            temp_parent_dir = parent_dir + '/' + NVTX_ATTRIBUTION
+            export_nvtx_attribution_to_CSV ( data_dict[NVTX_ATTRIBUTION], temp_parent_dir )
+            export_nvtx_attribution_to_latex ( data_dict[NVTX_ATTRIBUTION], temp_parent_dir )
+        if data_dict.get ( NAV_METADATA, {} ).get ( 'Rank Aggregation' ):
+            for sub_dir, sub_dict in data_dict.items ():
+                if isinstance ( sub_dict, dict ) and sub_dir not in NON_CATEGORY_KEYS:
+                    items = next ( (stats for key, stats in sub_dict.items () if 'Individual' in key), {} )
+                    export_rank_imbalance_to_CSV ( items, parent_dir + '/' + sub_dir, sub_dir )
+                    export_rank_imbalance_to_latex ( items, parent_dir + '/' + sub_dir, sub_dir )
     if not no_general and combined:
         logging.info ( f"Starting Combined Overall Summary Figure and Table Generation" )
         export_combined_overall_summary_tables ( data_dict, parent_dir )
 
 
-def generation_tables_and_figures(data_dict, no_comparison, no_general, no_specific, no_individual, num_files, output_dir):
+def generation_tables_and_figures(data_dict, no_comparison, no_general, no_specific, no_individual, num_files, output_dir, output_archive=None, render_limits=None):
     logging.info("Starting Figure and Table Generation")
 
+    with FIGURE_LOCK:
+        if output_archive:
+            with archive_outputs ( output_archive ):
+                generate_all_tables_and_figures ( data_dict, no_comparison, no_general, no_specific, no_individual, num_files, output_dir, render_limits )
+        else:
+            generate_all_tables_and_figures ( data_dict, no_comparison, no_general, no_specific, no_individual, num_files, output_dir, render_limits )
+
+    return None
+
+
+def generate_all_tables_and_figures(data_dict, no_comparison, no_general, no_specific, no_individual, num_files, output_dir, render_limits=None):
     if num_files < 2:
-        extract_general_dict ( data_dict, output_dir, no_general, no_specific, no_individual)
+        extract_general_dict ( data_dict, output_dir, no_general, no_specific, no_individual, render_limits=render_limits )
     else:
         for i, (sub_dir, sub_dict) in enumerate(data_dict.items ()):
             logging.info ( f"Starting Individual Figure and Table Generation for {sub_dir}" )
@@ -306,14 +423,11 @@ def generation_tables_and_figures(data_dict, no_comparison, no_general, no_speci
                 temp_parent_dir = output_dir[i] + '/' + sub_dir
             else:
                 temp_parent_dir = output_dir[i]
-            os.makedirs ( temp_parent_dir, exist_ok=True )
-            extract_general_dict ( sub_dict, temp_parent_dir, no_general, no_specific, no_individual )
+            extract_general_dict ( sub_dict, temp_parent_dir, no_general, no_specific, no_individual, render_limits=render_limits )
 
     if not no_comparison and num_files > 1:
         logging.info ( f"Starting Comparison Figure and Table Generation" )
         temp_parent_dir = './' + output_dir[-1] + '/Combined Statistics'
-        os.makedirs ( temp_parent_dir, exist_ok=True )
-        extract_general_dict(data_dict, temp_parent_dir, combined=True)
-
+        extract_general_dict(data_dict, temp_parent_dir, combined=True, render_limits=render_limits)
 
     return None
@@ -1,19 +1,39 @@
 import json
 from collections import OrderedDict
+from functools import partial
 from absl import logging
 
-from helper.communication import parallel_parse_communication_data, COMM_REQUIRED_TABLES, QUERY_COMMUNICATION, \
-    QUERY_COMMUNICATION_STATS, create_specific_communication_stats
-from helper.general import execute_query_in_thread, execute_queries_parallel, mutiple_table_exists, \
-    DURATION_REQUIRED_TABLE, QUERY_TOTAL_DURATION
-from helper.kernel import parallel_parse_kernel_data, KERNEL_REQUIRED_TABLES, QUERY_KERNEL, QUERY_KERNEL_STATS, \
-    parallel_create_general_kernel_stats
-from helper.transfer import parallel_parse_transfer_data, TRANSFER_REQUIRED_TABLES, QUERY_TRANSFERS, \
-    QUERY_TRANSFERS_STATS, create_specific_transfer_stats
+from helper.attribution import create_nvtx_kernel_attribution, ATTRIBUTION_REQUIRED_TABLES, ATTRIBUTION_METHOD, \
+    TOP_KERNELS
+from helper.backend import open_trace
+from helper.chunking import split_giant_queries, merge_chunked_results, CHUNKING_METHOD
+from helper.communication import generate_communicaiton_stats, COMM_REQUIRED_TABLES, QUERY_COMMUNICATION, \
+    QUERY_COMMUNICATION_STATS, finalize_communication_stats, QUERY_COMMUNICATION_SUMMARY, \
+    COMMUNICATION_METRICS, parse_communication_chunk, COMMUNICATION_METRIC_VALUES
+from helper.general import execute_query_in_thread, mutiple_table_exists, \
+    DURATION_REQUIRED_TABLE, QUERY_TOTAL_DURATION, NAV_METADATA, parse_summary_rows, generate_summary_statistics, \
+    new_metric_accumulator, fold_metric_statistics, compact_metric_accumulator, run_to_completion, summary_query, \
+    apply_log_histograms, NVTX_ATTRIBUTION
+from helper.kernel import parse_kernel_data, KERNEL_REQUIRED_TABLES, QUERY_KERNEL, QUERY_KERNEL_STATS, \
+    parallel_finalize_kernel_stats, QUERY_KERNEL_SUMMARY, KERNEL_METRICS, parse_kernel_chunk, \
+    KERNEL_METRIC_VALUES
+from helper.outliers import parse_outlier_filters
+from helper.mpi import mpi_tables, generate_mpi_queries, group_operations, MPI_STATISTICS, MPI_ITEMS
+from helper.memory import new_memory_budget, over_spill_threshold, spill_item, write_nav, release_memory_budget
+from helper.sampling import generate_sampled_queries, sample_groups, apply_exact_statistics, SAMPLING_METHOD
+from helper.transfer import generate_transfer_stats, TRANSFER_REQUIRED_TABLES, QUERY_TRANSFERS, \
+    QUERY_TRANSFERS_STATS, finalize_transfer_stats, QUERY_TRANSFERS_SUMMARY, TRANSFER_SUMMARY_METRICS, \
+    parse_transfer_chunk, TRANSFER_METRIC_VALUES, TRANSFER_METRICS
+from helper.scheduler import stream_parsed_queries, stream_parsed_groups, estimate_query_cost
+from helper.scope import build_scope, scope_query
 
 KERNEL_STATS = 0
 TRANSFER_STATS = 1
 COMMUNICATION_STATS = 2
+MPI_STATS = 3
+
+# metrics with per item Raw Data, Execution Duration is shared by kernels and communications
+OUTLIER_METRICS = list(dict.fromkeys(KERNEL_METRICS + TRANSFER_METRICS + COMMUNICATION_METRICS))
 
 
 def generate_queries(qurey, id_list):
@@ -25,17 +45,42 @@ def generate_queries(qurey, id_list):
     return queries
 
 
-def create_statistics(database_file, first_query, raw_data_query, metric_type, sort_metric='Time Total'):
+def iter_statistics(database_file, first_query, raw_data_query, metric_type, sort_metric='Time Total', scope=None,
+                    summary_query=None, sample_cap=None, summary_only=False, chunk_rows=None, memory_budget=None,
+                    histogram_precision=None, outlier_filters=None):
+    # yields (category, id, item) as each item completes and returns (statistics, general statistics)
     ids = []
     statistics = {}
     name_stats = ''
+    metric_labels = []
 
     if metric_type is KERNEL_STATS:
         name_stats = 'Kernel'
+        metric_labels = KERNEL_METRICS
+        parse_function = parse_kernel_data
+        chunk_parse_function = parse_kernel_chunk
+        finalize_function = parallel_finalize_kernel_stats
     elif metric_type is TRANSFER_STATS:
         name_stats = 'Transfer'
+        metric_labels = TRANSFER_SUMMARY_METRICS
+        parse_function = generate_transfer_stats
+        chunk_parse_function = parse_transfer_chunk
+        finalize_function = finalize_transfer_stats
     elif metric_type is COMMUNICATION_STATS:
         name_stats = 'Communication'
+        metric_labels = COMMUNICATION_METRICS
+        parse_function = generate_communicaiton_stats
+        chunk_parse_function = parse_communication_chunk
+        finalize_function = finalize_communication_stats
+    elif metric_type is MPI_STATS:
+        # messages have a size and duration like transfers and share their statistics and figures
+        name_stats = 'MPI'
+        metric_labels = TRANSFER_SUMMARY_METRICS
+        parse_function = generate_transfer_stats
+        chunk_parse_function = parse_transfer_chunk
+        finalize_function = finalize_transfer_stats
+
+    first_query = scope_query(first_query, scope)
 
     logging.info(f"Getting General {name_stats} Information")
     res = execute_query_in_thread((first_query, None), database_file)
@@ -56,71 +101,222 @@ def create_statistics(database_file, first_query, raw_data_query, metric_type, s
             ids.append(name)
             statistics[name] = {'Name': name, 'Time Percent': time_percent, 'Time Total': time_total,
                                 'Instance': instance}
+    elif metric_type is MPI_STATS:
+        for name, time_percent, time_total, mem_total, instance in res[1]:
+            ids.append(name)
+            statistics[name] = {'Name': name, 'Time Percent': time_percent, 'Time Total': time_total,
+                                'Memory Total': mem_total,
+                                'Instance': instance}
     else:
         logging.error('Unknown metric type')
 
-    if metric_type is KERNEL_STATS:
-        logging.info(
-            f"Getting RAW Data for each specific {name_stats} (RAW kernel extraction will take a while for large sqlite files, ~1h)")
-    else:
-        logging.info(f"Getting RAW Data for each specific {name_stats}")
+    precision = histogram_precision or 0
+    if precision:
+        chunk_parse_function = partial(chunk_parse_function, precision=precision)
+    outlier_filters = {label: rule for label, rule in (outlier_filters or {}).items() if label in metric_labels}
+    if outlier_filters:
+        parse_function = partial(parse_function, outlier_filters=outlier_filters)
+        if summary_only:
+            logging.warning(f"Outlier filters need RAW Data, summary only {name_stats} Statistics are not filtered")
+    outliers_removed = {label: 0 for label in outlier_filters}
+    accumulator = new_metric_accumulator(metric_labels, histogram_precision)
+    summaries = {}
 
-    queries = generate_queries(raw_data_query, ids)
-    queries_res = execute_queries_parallel(queries, database_file)
+    if summary_only or (sample_cap and summary_query):
+        if summary_only:
+            logging.info(f"Computing {name_stats} Statistics inside SQLite (summary only, no RAW Data)")
+        else:
+            logging.info(f"Getting exact {name_stats} Count, Mean, Minimum, Maximum and Standard Deviation")
+        res = execute_query_in_thread((scope_query(summary_query, scope), None), database_file)
+        summaries = parse_summary_rows(res[1], metric_labels)
 
-    logging.info(f"Parsing RAW Data and generating Statistics for {name_stats}")
-    if metric_type is KERNEL_STATS:
-        results = parallel_parse_kernel_data(queries_res)
-    elif metric_type is TRANSFER_STATS:
-        results = parallel_parse_transfer_data(queries_res)
-    elif metric_type is COMMUNICATION_STATS:
-        results = parallel_parse_communication_data(queries_res)
+    if summary_only:
+        results = generate_summary_statistics(summaries, ids, metric_labels, precision)
+    else:
+        if metric_type is KERNEL_STATS:
+            logging.info(
+                f"Getting RAW Data for each specific {name_stats} (RAW kernel extraction will take a while for large sqlite files, ~1h)")
+        else:
+            logging.info(f"Getting RAW Data for each specific {name_stats} and generating Statistics")
+
+        if metric_type is MPI_STATS:
+            # one pass over every operations table instead of a query per operation, nothing is left to chunk
+            res = execute_query_in_thread((scope_query(raw_data_query, scope), None), database_file)
+            groups = group_operations(res[1])
+            if sample_cap:
+                groups = sample_groups(groups, statistics, sample_cap)
+            results = stream_parsed_groups(groups, parse_function)
+        else:
+            if sample_cap:
+                queries = generate_sampled_queries(scope_query(raw_data_query, scope), ids, statistics, sample_cap)
+            else:
+                queries = generate_queries(scope_query(raw_data_query, scope), ids)
+            costs = [estimate_query_cost(statistics[id]['Instance'], sample_cap) for id in ids]
+            chunks = {}
+            if chunk_rows:
+                queries, costs, chunks = split_giant_queries(raw_data_query, scope, queries, costs, ids, statistics,
+                                                             database_file, chunk_rows, chunk_parse_function,
+                                                             sample_cap)
+            if chunks and outlier_filters:
+                logging.warning(f"{len(chunks)} chunked {name_stats}s are merged from buckets and not outlier filtered")
+            results = stream_parsed_queries(queries, database_file, parse_function, costs, memory_budget=memory_budget)
+            results = merge_chunked_results(results, chunks, metric_labels, precision)
 
     for id, dict in results:
+        if metric_type in (TRANSFER_STATS, MPI_STATS) and 'Bandwidth Distribution' not in dict:
+            dict['Bandwidth Distribution'] = None
         statistics[id].update(dict)
+        # exact SQLite statistics include the outliers, filtered metrics keep the ones of their RAW Data
+        summary = {label: rows for label, rows in summaries.get(id, {}).items() if label not in outlier_filters}
+        if sample_cap and summary:
+            apply_exact_statistics(statistics[id], summary, metric_labels)
+        if histogram_precision is not None:
+            apply_log_histograms(statistics[id], metric_labels, histogram_precision, summary)
+        for label in outliers_removed:
+            if statistics[id].get(label):
+                outliers_removed[label] += statistics[id][label].get('Outliers Removed', 0)
+        sampled = statistics[id].get('Sample Rate', 1) < 1
+        fold_metric_statistics(accumulator, statistics[id], summary if sampled else None)
+        yield f"{name_stats} Statistics", id, statistics[id]
+        if over_spill_threshold(memory_budget):
+            compact_metric_accumulator(accumulator)
+            spill_item(memory_budget, statistics[id], dict.keys())
+
+    logging.info(f"Generating General {name_stats} Statistics")
+    general_statistics = finalize_function(accumulator)
+    for label, removed in outliers_removed.items():
+        if general_statistics.get(label):
+            general_statistics[label]['Outliers Removed'] = removed
 
     statistics = OrderedDict(
         sorted(statistics.items(), key=lambda item: item[1][sort_metric], reverse=True))
 
-    return statistics
+    return statistics, general_statistics
 
 
-def create_statistics_from_file(database_file, output_dir, FLAGS):
+def create_statistics(*args, **kwargs):
+    return run_to_completion(iter_statistics(*args, **kwargs))
+
+
+def iter_trace_statistics(database_file, no_kernel_metrics=False, no_transfer_metrics=False,
+                          no_communication_metrics=False, time_window=None, nvtx_range=None, sample_cap=None,
+                          summary_only=False, chunk_rows=None, memory_budget=None, histogram_precision=None,
+                          outlier_filter=None, nvtx_kernel_attribution=False, no_mpi_metrics=False):
+    # yields (category, id, item) as each item completes and returns the full NAV statistics
     full_statistics = {}
+    outlier_filters = parse_outlier_filters(outlier_filter, OUTLIER_METRICS)
+    precision = histogram_precision or 0
+    kernel_summary = summary_query(KERNEL_METRIC_VALUES, precision) if precision else QUERY_KERNEL_SUMMARY
+    transfer_summary = summary_query(TRANSFER_METRIC_VALUES, precision) if precision else QUERY_TRANSFERS_SUMMARY
+    comm_summary = summary_query(COMMUNICATION_METRIC_VALUES, precision) if precision else QUERY_COMMUNICATION_SUMMARY
 
     logging.info(f"Starting extraction and creation of statistics from {database_file}")
+    scope = build_scope(database_file, time_window, nvtx_range)
 
-    if not FLAGS.no_kernel_metrics:
+    if not no_kernel_metrics:
         logging.info("Starting Kernel Statistics")
         if mutiple_table_exists(database_file, KERNEL_REQUIRED_TABLES):
-            kernel_statistics = create_statistics(database_file, QUERY_KERNEL, QUERY_KERNEL_STATS,
-                                                  metric_type=KERNEL_STATS)
+            kernel_statistics, general_kernel_statistics = yield from iter_statistics(
+                database_file, QUERY_KERNEL, QUERY_KERNEL_STATS, metric_type=KERNEL_STATS, scope=scope,
+                summary_query=kernel_summary, sample_cap=sample_cap, summary_only=summary_only,
+                chunk_rows=chunk_rows, memory_budget=memory_budget, histogram_precision=histogram_precision,
+                outlier_filters=outlier_filters)
             full_statistics['Kernel Statistics'] = {'Individual Kernels': kernel_statistics}
-            full_statistics['Kernel Statistics'].update(parallel_create_general_kernel_stats(kernel_statistics))
+            full_statistics['Kernel Statistics'].update(general_kernel_statistics)
 
-    if not FLAGS.no_transfer_metrics:
+    if not no_transfer_metrics:
         logging.info("Starting Transfer Statistics")
         if mutiple_table_exists(database_file, TRANSFER_REQUIRED_TABLES):
-            transfer_statistics = create_statistics(database_file, QUERY_TRANSFERS, QUERY_TRANSFERS_STATS,
-                                                    metric_type=TRANSFER_STATS)
+            transfer_statistics, general_transfer_statistics = yield from iter_statistics(
+                database_file, QUERY_TRANSFERS, QUERY_TRANSFERS_STATS, metric_type=TRANSFER_STATS, scope=scope,
+                summary_query=transfer_summary, sample_cap=sample_cap, summary_only=summary_only,
+                chunk_rows=chunk_rows, memory_budget=memory_budget, histogram_precision=histogram_precision,
+                outlier_filters=outlier_filters)
             full_statistics['Transfer Statistics'] = {'Individual Transfers': transfer_statistics}
-            full_statistics['Transfer Statistics'].update(create_specific_transfer_stats(transfer_statistics))
+            full_statistics['Transfer Statistics'].update(general_transfer_statistics)
 
-    if not FLAGS.no_communication_metrics:
+    if not no_communication_metrics:
         logging.info("Starting Communication Statistics")
         if mutiple_table_exists(database_file, COMM_REQUIRED_TABLES):
-            comm_statistics = create_statistics(database_file, QUERY_COMMUNICATION, QUERY_COMMUNICATION_STATS,
-                                                metric_type=COMMUNICATION_STATS)
+            comm_statistics, general_comm_statistics = yield from iter_statistics(
+                database_file, QUERY_COMMUNICATION, QUERY_COMMUNICATION_STATS, metric_type=COMMUNICATION_STATS,
+                scope=scope, summary_query=comm_summary, sample_cap=sample_cap, summary_only=summary_only,
+                chunk_rows=chunk_rows, memory_budget=memory_budget, histogram_precision=histogram_precision,
+                outlier_filters=outlier_filters)
             full_statistics['Communication Statistics'] = {'Individual Communications': comm_statistics}
-            full_statistics['Communication Statistics'].update(create_specific_communication_stats(comm_statistics))
+            full_statistics['Communication Statistics'].update(general_comm_statistics)
+
+    if not no_mpi_metrics:
+        tables = mpi_tables(database_file)
+        if tables:
+            logging.info(f"Starting MPI Statistics from {', '.join(tables)}")
+            query_mpi, query_mpi_stats, mpi_summary = generate_mpi_queries(tables, precision)
+            mpi_statistics, general_mpi_statistics = yield from iter_statistics(
+                database_file, query_mpi, query_mpi_stats, metric_type=MPI_STATS, scope=scope,
+                summary_query=mpi_summary, sample_cap=sample_cap, summary_only=summary_only,
+                chunk_rows=chunk_rows, memory_budget=memory_budget, histogram_precision=histogram_precision,
+                outlier_filters=outlier_filters)
+            full_statistics[MPI_STATISTICS] = {MPI_ITEMS: mpi_statistics}
+            full_statistics[MPI_STATISTICS].update(general_mpi_statistics)
+
+    if nvtx_kernel_attribution:
+        if mutiple_table_exists(database_file, ATTRIBUTION_REQUIRED_TABLES):
+            full_statistics[NVTX_ATTRIBUTION] = create_nvtx_kernel_attribution(database_file, scope)
+        else:
+            logging.warning("NVTX kernel attribution needs kernels, runtime calls and NVTX_EVENTS in the trace")
 
     if mutiple_table_exists(database_file, DURATION_REQUIRED_TABLE):
         full_statistics['Total Duration'] = execute_query_in_thread((QUERY_TOTAL_DURATION, None), database_file)[1][0][0]
 
+    metadata = {}
+    if scope:
+        full_statistics['Total Duration'] = scope['Covered Duration']
+        metadata['Scope'] = scope
+    if summary_only:
+        metadata['Summary Only'] = {'Histogram Buckets': 'Power of 2' if not precision else
+                                    f'{2 ** precision} per Power of 2'}
+    elif sample_cap:
+        metadata['Sampling'] = {'Sample Cap': sample_cap, 'Method': SAMPLING_METHOD}
+    chunked = [item for category in full_statistics.values() if isinstance(category, dict)
+               for key, items in category.items() if key.startswith('Individual')
+               for item in items.values() if 'Chunks' in item]
+    if chunked:
+        metadata['Chunking'] = {'Chunk Rows': chunk_rows, 'Method': CHUNKING_METHOD}
+    if outlier_filters and not summary_only:
+        metadata['Outlier Filters'] = {label: {'Method': method, 'Threshold': threshold}
+                                       for label, (method, threshold) in outlier_filters.items()}
+    if NVTX_ATTRIBUTION in full_statistics:
+        metadata['NVTX Kernel Attribution'] = {'Method': ATTRIBUTION_METHOD, 'Top Kernels': TOP_KERNELS}
+    if histogram_precision is not None:
+        metadata['Log Histograms'] = {'Precision': histogram_precision, 'Buckets per Power of 2': 2 ** precision,
+                                      'Relative Bucket Width': 2 ** -precision}
+    if metadata:
+        full_statistics[NAV_METADATA] = metadata
+
+    return full_statistics
+
+
+def create_statistics_from_file(database_file, output_dir, FLAGS):
+    memory_budget = new_memory_budget(FLAGS.memory_budget, output_dir)
+    with open_trace(database_file, output_dir, FLAGS.time_window, FLAGS.nvtx_range) as trace_file:
+        full_statistics = run_to_completion(iter_trace_statistics(
+            trace_file, FLAGS.no_kernel_metrics, FLAGS.no_transfer_metrics, FLAGS.no_communication_metrics,
+            FLAGS.time_window, FLAGS.nvtx_range, FLAGS.sample_cap, FLAGS.summary_only, FLAGS.chunk_rows, memory_budget,
+            FLAGS.histogram_precision, FLAGS.outlier_filter, FLAGS.nvtx_kernel_attribution,
+            FLAGS.no_mpi_metrics))
+
     if not FLAGS.no_save_data and full_statistics:
         database_file_NAV = output_dir + database_file.split('.')[0] + '_parsed_stats.nav'
         logging.info(f"Saving Extracted Statistics of {database_file} to {database_file_NAV}")
-        with open(database_file_NAV, 'w') as NAV_file:
-            json.dump(full_statistics, NAV_file, indent=4)
+        if memory_budget:
+            write_nav(full_statistics, database_file_NAV)
+        else:
+            with open(database_file_NAV, 'w') as NAV_file:
+                json.dump(full_statistics, NAV_file, indent=4)
+
+    if memory_budget:
+        # trend ingest, the tidy export and the regression check read every item in process, metrics output or not
+        restore = not FLAGS.no_metrics_output or FLAGS.trend_ingest or FLAGS.tidy_export or FLAGS.regression_check
+        release_memory_budget(memory_budget, full_statistics, restore=restore)
 
     return full_statistics
@@ -1,11 +1,14 @@
+import io
 import os
+from datetime import datetime
+
 import numpy as np
 from absl import logging
-from matplotlib import pyplot as plt, ticker
+from matplotlib import cbook, mlab, pyplot as plt, ticker
 from matplotlib.ticker import ScalarFormatter
-from sklearn.cluster import KMeans
 
-from helper.general import convert_size, convert_duration
+from helper.general import convert_size, convert_duration, moments_from_buckets, quantile_from_buckets
+from helper.output import write_output
 
 plt.rcParams.update({
     'font.size': 16,           # Default font size for all text
@@ -15,6 +18,11 @@ plt.rcParams.update({
     'ytick.labelsize': 16,     # Y-axis tick label font size
 })
 
+def save_figure(fig, file):
+    buffer = io.BytesIO ()
+    fig.savefig ( buffer, format='png', bbox_inches='tight' )
+    write_output ( file, buffer.getvalue () )
+
 
 def format_power_2_ticks(value, _):
     if value >= 2 ** 50:
@@ -46,7 +54,107 @@ def format_power_10_ticks(value, _):
         return f'{value:.2f}'
 
 
+VIOLIN_POINTS = 100  # density points of each violin, as in ax.violinplot
+BUCKET_POINTS = 16  # points per bucket row when bucket counts are binned
+VIOLIN_METHODS = ['histogram', 'kde']  # histogram: smoothed histogram densities, kde: exact Gaussian KDE
+SMOOTHING_KERNEL = np.array ( [1, 4, 6, 4, 1] ) / 16
+
+
+def kde_density(values, coords):
+    values = np.asarray ( values, dtype=float )
+    if np.all ( values == values[0] ):
+        return (coords == values[0]).astype ( float )
+    return mlab.GaussianKDE ( values ).evaluate ( coords )
+
+
+def bucket_density(bucket_rows, edges):
+    # the count of a bucket is spread evenly between the smallest and largest value observed in it
+    mass = np.zeros ( len ( edges ) - 1 )
+    for _, count, _, _, minimum, maximum in bucket_rows:
+        if maximum > minimum:
+            overlap = np.minimum ( edges[1:], maximum ) - np.maximum ( edges[:-1], minimum )
+            mass += count * np.clip ( overlap, 0, None ) / (maximum - minimum)
+        else:
+            mass[min ( max ( np.searchsorted ( edges, minimum, side='right' ) - 1, 0 ), len ( mass ) - 1 )] += count
+    return mass
+
+
+def histogram_density(values, edges):
+    # sample counts between the violin points smoothed with a short binomial kernel, a single O(n) pass where the
+    # KDE evaluates every sample at every point
+    if edges[-1] <= edges[0]:
+        return np.ones ( len ( edges ) - 1 )
+    mass = np.histogram ( values, bins=edges )[0].astype ( float )
+    return np.convolve ( mass, SMOOTHING_KERNEL, mode='same' )
+
+
+def violin_edges(minimum, maximum, log_scale=False):
+    if log_scale and minimum > 0:
+        edges = np.geomspace ( minimum, maximum, VIOLIN_POINTS + 1 )
+        return edges, np.sqrt ( edges[:-1] * edges[1:] )
+    edges = np.linspace ( minimum, maximum, VIOLIN_POINTS + 1 )
+    return edges, (edges[:-1] + edges[1:]) / 2
+
+
+def violin_stats(source, log_scale=False, violin_method='histogram'):
+    # a source is (Raw Data, None) or (None, bucket rows), only the kde method grows with samples times points
+    values, bucket_rows = source
+    if values is not None and violin_method == 'kde':
+        return cbook.violin_stats ( [values], kde_density, points=VIOLIN_POINTS )[0]
+
+    if values is not None:
+        values = np.asarray ( values, dtype=float )
+        minimum, maximum = values.min (), values.max ()
+        edges, coords = violin_edges ( minimum, maximum, log_scale )
+        return {'coords': coords, 'vals': histogram_density ( values, edges ), 'mean': values.mean (),
+                'median': np.median ( values ), 'min': minimum, 'max': maximum}
+
+    count, total, _, minimum, maximum = moments_from_buckets ( bucket_rows )
+    edges, coords = violin_edges ( minimum, maximum, log_scale )
+    return {'coords': coords, 'vals': bucket_density ( bucket_rows, edges ), 'mean': total / count,
+            'median': quantile_from_buckets ( bucket_rows, 0.5 ), 'min': minimum, 'max': maximum}
+
+
+def source_range(source):
+    values, bucket_rows = source
+    if values is not None:
+        return np.min ( values ), np.max ( values )
+    return bucket_rows[0][4], bucket_rows[-1][5]
+
+
+def source_points(source):
+    # (values, counts, totals), the count of a bucket is spread over evenly spaced points between its smallest
+    # and largest value
+    values, bucket_rows = source
+    if values is not None:
+        values = np.asarray ( values, dtype=float )
+        return values, np.ones ( len ( values ) ), values
+    rows = np.asarray ( bucket_rows, dtype=float )
+    points = (rows[:, 4:5] + (rows[:, 5:6] - rows[:, 4:5]) * np.linspace ( 0, 1, BUCKET_POINTS )).ravel ()
+    counts = np.repeat ( rows[:, 1] / BUCKET_POINTS, BUCKET_POINTS )
+    return points, counts, points * counts
+
+
+def weighted_quantiles(points, counts, quantiles):
+    # np.quantile (linear) when every count is 1
+    order = np.argsort ( points, kind='stable' )
+    points, counts = points[order], counts[order]
+    ranks = np.cumsum ( counts ) - counts
+    return np.interp ( np.asarray ( quantiles ) * max ( counts.sum () - 1, 1 ), ranks, points )
+
+
+def binned_means(points, counts, totals, bin_edges):
+    # mean value per bin, values on the last edge and empty bins count as 0 like the per value comprehension did
+    bins = np.searchsorted ( bin_edges, points, side='right' ) - 1
+    inside = (bins >= 0) & (bins < len ( bin_edges ) - 1)
+    bin_counts = np.bincount ( bins[inside], weights=counts[inside], minlength=len ( bin_edges ) - 1 )
+    bin_totals = np.bincount ( bins[inside], weights=totals[inside], minlength=len ( bin_edges ) - 1 )
+    return np.divide ( bin_totals, bin_counts, out=np.zeros ( len ( bin_counts ) ), where=bin_counts > 0 )
+
+
 def create_and_plot_k_mean_statistics(cluster_data, title, parent_dir):
+    from sklearn.cluster import KMeans  # loaded on first use, sklearn takes longer to import than most extractions
+
     X = np.array ( cluster_data['Raw Data'] )
 
     wcss_values = []
@@ -65,11 +173,10 @@ def create_and_plot_k_mean_statistics(cluster_data, title, parent_dir):
     fig.tight_layout ()
     fig.subplots_adjust ( top=0.95 )
     file = parent_dir + "/" + title.split ( " " )[0].replace ( '-', '_' ) + '_elbow_method.png'
-    fig.savefig ( file, bbox_inches='tight' )
+    save_figure ( fig, file )
     plt.close ( fig )
 
     cluster_dir = parent_dir + '/Cluster Options'
-    os.makedirs ( cluster_dir, exist_ok=True )
 
     for n_clusters in range ( 1, max_clusters + 1 ):
         kmeans = KMeans ( n_clusters=n_clusters, random_state=42 )
@@ -92,37 +199,25 @@ def create_and_plot_k_mean_statistics(cluster_data, title, parent_dir):
         fig.tight_layout ()
         fig.subplots_adjust ( top=0.95 )
         file = cluster_dir + "/" + title.split ( " " )[0].replace ( ' ', '_' ) + f'_k_{n_clusters}_mean_cluster.png'
-        fig.savefig ( file, bbox_inches='tight' )
+        save_figure ( fig, file )
         plt.close ( fig )
 
 
-def plot_combined_data(combined_data, title, metric, parent_dir, raw_provided=False):
-    data = []
-    labels = []
-
-    if not raw_provided:
-        for name, sub_dict in combined_data.items ():
-            if sub_dict[metric]:
-                if sub_dict[metric]["Raw Data"] and metric == 'Bandwidth Distribution':
-                    labels.append ( name )
-                    temp = []
-                    for transfer_size, bandwidth in sub_dict[metric]["Raw Data"]:
-                        temp.append ( bandwidth )
-                    data.append ( temp )
-                elif sub_dict[metric]["Raw Data"]:
-                    labels.append ( name )
-                    data.append ( sub_dict[metric]["Raw Data"] )
-    else:
-        for name, sub_list in combined_data.items ():
-            labels.append ( name )
-            data.append ( sub_list )
+def plot_combined_data(sources, title, metric, parent_dir, violin_method='histogram'):
+    labels = list ( sources )
 
-    if len ( data ) < 2:
-        logging.error ( f'\"{title}: Combined {metric}\" - Only 1 Raw Data found, No figure generated' )
+    if len ( labels ) < 2:
+        logging.error ( f'\"{title}: Combined {metric}\" - Only 1 trace with data found, No figure generated' )
         return None
 
+    ranges = [source_range ( source ) for source in sources.values ()]
+    min_value = min ( low for low, _ in ranges )
+    max_value = max ( high for _, high in ranges )
+    magnitude_diff = np.log10 ( max_value ) - np.log10 ( min_value )
+    vpstats = [violin_stats ( source, magnitude_diff >= 1, violin_method ) for source in sources.values ()]
+
     fig, ax = plt.subplots ( 1, figsize=(10, 8) )
-    parts = ax.violinplot ( data, showmeans=True, showmedians=True )
+    parts = ax.violin ( vpstats, showmeans=True, showmedians=True )
 
     for pc in parts['bodies']:
         pc.set_facecolor ( 'skyblue' )
@@ -142,10 +237,6 @@ def plot_combined_data(combined_data, title, metric, parent_dir, raw_provided=Fa
     ax.tick_params ( axis='x', rotation=25 )
     ax.set_xlabel ( "Trace Name" )
 
-    flat_data = [item for sublist in data for item in sublist]
-    min_value = np.min ( flat_data )
-    max_value = np.max ( flat_data )
-    magnitude_diff = np.log10 ( max_value ) - np.log10 ( min_value )
     if magnitude_diff >= 1:
         ax.set_yscale ( 'log', base=10 )
     ax.grid ( axis='y', linestyle='--', linewidth=0.5, color='gray', alpha=0.5 )
@@ -163,23 +254,20 @@ def plot_combined_data(combined_data, title, metric, parent_dir, raw_provided=Fa
     fig.tight_layout ()
     fig.subplots_adjust ( top=0.95 )
     file = parent_dir + "/" + title.replace ( ' ', '_' ) + '_' + metric.replace ( ' ', '_' ) + '_combined_distribution.png'
-    fig.savefig ( file, bbox_inches='tight' )
+    save_figure ( fig, file )
     plt.close ( fig )
 
 
-def plot_combined_overall_bandwidth_distribution(combined_data, title, parent_dir):
-    data = []
-    labels = []
+def plot_combined_overall_bandwidth_distribution(sources, title, parent_dir, violin_method='histogram'):
+    labels = list ( sources )
 
-    for name, sub_list in combined_data.items ():
-        labels.append(name)
-        temp = []
-        for _, bandwidth in sub_list:
-            temp.append (bandwidth)
-        data.append ( temp )
+    if len ( labels ) < 2:
+        logging.error ( f'\"{title}: Overall Combined Bandwidth\" - Only 1 trace with data found, No figure generated' )
+        return None
 
     fig, ax = plt.subplots ( 1, figsize=(10, 8) )
-    parts = ax.violinplot ( data, showmeans=True, showmedians=True )
+    parts = ax.violin ( [violin_stats ( source, True, violin_method ) for source in sources.values ()], showmeans=True,
+                        showmedians=True )
 
     for pc in parts['bodies']:
         pc.set_facecolor ( 'skyblue' )
@@ -194,7 +282,7 @@ def plot_combined_overall_bandwidth_distribution(combined_data, title, parent_di
     parts['cmaxes'].set_linestyle ( '--' )
     parts['cbars'].set_color ( 'black' )
 
-    min_value = min ( min ( sublist ) for sublist in data )
+    min_value = min ( source_range ( source )[0] for source in sources.values () )
     ax.grid ( axis='y', linestyle='--', linewidth=0.5, color='gray', alpha=0.5 )
     ax.grid(which='minor', axis='y', linestyle=':', linewidth=0.5, color='lightgray')
     ax.set_title ( f'{title}: Overall Combined Bandwidth Distribution' )
@@ -213,15 +301,13 @@ def plot_combined_overall_bandwidth_distribution(combined_data, title, parent_di
     fig.tight_layout ()
     fig.subplots_adjust ( top=0.95 )
     file = parent_dir + '/Transfer_Statistics_Overall_Combined_Bandwidth_distribution.png'
-    fig.savefig ( file, bbox_inches='tight' )
+    save_figure ( fig, file )
     plt.close ( fig )
 
 
-def plot_binned_bandwidth_distribution(combined_data, title, parent_dir):
-    all_sizes = []
-    for name, sub_list in combined_data.items():
-        sizes, bandwidths = zip(*sub_list)
-        all_sizes.extend(sizes)
+def plot_binned_bandwidth_distribution(combined_data, title, parent_dir, violin_method='histogram'):
+    pairs = {name: np.asarray ( sub_list, dtype=float ) for name, sub_list in combined_data.items ()}
+    all_sizes = np.concatenate ( [sub_pairs[:, 0] for sub_pairs in pairs.values ()] )
 
     quantiles = np.linspace(0, 1, 8)
     bin_edges = np.quantile(all_sizes, quantiles)
@@ -231,21 +317,16 @@ def plot_binned_bandwidth_distribution(combined_data, title, parent_dir):
 
     x = np.arange(len(bin_edges) - 1)  # the label locations
 
-    for i, (name, bandwidths) in enumerate(combined_data.items()):
-        binned_bandwidths = [[] for _ in range(len(bin_edges) - 1)]
-        for j in range(len(bin_edges) - 1):
-            bin_bandwidths = [bw for size, bw in bandwidths if bin_edges[j] <= size < bin_edges[j + 1]]
-            if bin_bandwidths:
-                binned_bandwidths[j] = bin_bandwidths
+    for i, (name, sub_pairs) in enumerate(pairs.items()):
+        # sizes on the last edge fall outside of every bin, empty bins are drawn at 0
+        bins = np.searchsorted ( bin_edges, sub_pairs[:, 0], side='right' ) - 1
+        binned_bandwidths = [sub_pairs[bins == j, 1] for j in range(len(bin_edges) - 1)]
+        binned_bandwidths = [bandwidths if len ( bandwidths ) else np.zeros ( 1 ) for bandwidths in binned_bandwidths]
         if binned_bandwidths:
-            for item in binned_bandwidths:
-                if len(item) == 0:
-                    item.append(0)
-
             offset = (num_configs - 1) / 2
             positions = x + offset + i * width_per_bin
-            parts = ax.violinplot(binned_bandwidths, showmeans=True, showmedians=True,
-                                  positions=positions, widths=width_per_bin)
+            parts = ax.violin([violin_stats ( (bandwidths, None), True, violin_method ) for bandwidths in binned_bandwidths],
+                              positions=positions, widths=width_per_bin, showmeans=True, showmedians=True)
 
             for pc in parts['bodies']:
                 pc.set_facecolor('C' + str(i))
@@ -277,17 +358,18 @@ def plot_binned_bandwidth_distribution(combined_data, title, parent_dir):
     fig.tight_layout()
     fig.subplots_adjust(top=0.9, bottom=0.15)  # Adjust top and bottom margins
     file = parent_dir + '/' + title.replace(' ', '_') + '_Combined_Bandwidth_distribution_By_Size.png'
-    fig.savefig(file, bbox_inches='tight')
+    save_figure(fig, file)
     plt.close(fig)
 
 
-def plot_bandwidth_distribution(histogram_data, title, parent_dir):
+def plot_bandwidth_distribution(histogram_data, title, parent_dir, violin_method='histogram'):
     array_lists = histogram_data['Histogram']
     labels = histogram_data['Bin Labels']
 
     x_values = np.arange ( 1, len ( array_lists ) + 1 )
     fig, ax = plt.subplots ( 1, figsize=(10, 8) )
-    parts = ax.violinplot ( array_lists, showmeans=True, showmedians=True )
+    parts = ax.violin ( [violin_stats ( (values, None), True, violin_method ) for values in array_lists], showmeans=True,
+                        showmedians=True )
 
     for pc in parts['bodies']:
         pc.set_facecolor ( 'skyblue' )
@@ -305,7 +387,7 @@ def plot_bandwidth_distribution(histogram_data, title, parent_dir):
     ax.xaxis.set_ticks ( x_values )
     ax.xaxis.set_ticklabels ( labels )
     ax.tick_params ( axis='x', rotation=25 )
-    min_value = min ( min ( sublist ) for sublist in array_lists )
+    min_value = min ( np.min ( sublist ) for sublist in array_lists )
     ax.grid ( axis='y', linestyle='--', linewidth=0.5, color='gray', alpha=0.5 )
     ax.grid(which='minor', axis='y', linestyle=':', linewidth=0.5, color='lightgray')
     ax.set_title ( title )
@@ -321,7 +403,7 @@ def plot_bandwidth_distribution(histogram_data, title, parent_dir):
     fig.tight_layout ()
     fig.subplots_adjust ( top=0.95 )
     file = parent_dir + "/" + title.split ( " " )[0].replace ( '-', '_' ) + '_bandwidth_distribution.png'
-    fig.savefig ( file, bbox_inches='tight' )
+    save_figure ( fig, file )
     plt.close ( fig )
 
 
@@ -352,37 +434,28 @@ def plot_frequency_distribution(histogram_data, title, xlabel, parent_dir):
         file = parent_dir + "/" + title.split ( " " )[0] + "_" + "_".join (
             xlabel.lower ().split ( " " )[0:2] ) + '_frequency_distribution.png'
 
-    fig.savefig ( file, bbox_inches='tight' )
+    save_figure ( fig, file )
     plt.close ( fig )
 
 
-def plot_combined_frequency_distribution(combined_data, title, metric, parent_dir):
-    all_values = []
-    for name, sub_list in combined_data.items():
-        all_values.extend(sub_list)
+def plot_combined_frequency_distribution(sources, title, metric, parent_dir):
+    if not sources:
+        return None
 
+    points = {name: source_points(source) for name, source in sources.items()}
     quantiles = np.linspace(0, 1, num=9)
-    bin_edges = np.quantile(all_values, quantiles)
+    bin_edges = weighted_quantiles(np.concatenate([values for values, _, _ in points.values()]),
+                                   np.concatenate([counts for _, counts, _ in points.values()]), quantiles)
     fig, ax = plt.subplots(figsize=(10, 8))
-    num_configs = len(combined_data.items())
+    num_configs = len(sources)
     width_per_bin = 0.25
 
     x = np.arange(len(bin_edges) - 1)
 
-    for i, (name, data) in enumerate(combined_data.items()):
-        binned_data = [[] for _ in range(len(bin_edges) - 1)]
-        for j in range(len(bin_edges) - 1):
-            bin_data = [val for val in data if bin_edges[j] <= val < bin_edges[j + 1]]
-            if bin_data:
-                binned_data[j] = bin_data
-        if binned_data:
-            for item in binned_data:
-                if len(item) == 0:
-                    item.append(0)
-
-            offset = (num_configs - 1) / 2
-            positions = x + offset + i * width_per_bin
-            ax.bar(positions, [np.mean(b) for b in binned_data], width_per_bin, alpha=0.7, label=name)
+    for i, (name, (values, counts, totals)) in enumerate(points.items()):
+        offset = (num_configs - 1) / 2
+        positions = x + offset + i * width_per_bin
+        ax.bar(positions, binned_means(values, counts, totals, bin_edges), width_per_bin, alpha=0.7, label=name)
 
     ax.grid(axis='y', linestyle='--', linewidth=0.5, color='gray', alpha=0.5)
     ax.grid(which='minor', axis='y', linestyle=':', linewidth=0.5, color='lightgray')
@@ -408,5 +481,37 @@ def plot_combined_frequency_distribution(combined_data, title, metric, parent_di
     fig.tight_layout()
     fig.subplots_adjust(top=0.9, bottom=0.15)
     file = os.path.join(parent_dir, title.replace(' ', '_') + '_Combined_' + metric.replace(' ', '_') + '_distribution_By_Size.png')
-    fig.savefig(file, bbox_inches='tight')
-    plt.close(fig)
\ No newline at end of file
+    save_figure(fig, file)
+    plt.close(fig)
+
+
+def plot_trend(rows, title, metric, file):
+    run_times = [datetime.fromtimestamp ( row[0] ) for row in rows]
+    columns = list ( zip ( *rows ) )
+    mean, median, q05, q25, q75, q95 = [np.array ( columns[index], dtype=float ) for index in range ( 4, 10 )]
+
+    if 'Duration' in metric or 'Slack' in metric or 'Overhead' in metric:
+        units = ' (us)'
+    elif 'Bandwidth' in metric:
+        units = ' (B/s)'
+    elif 'Size' in metric:
+        units = ' (B)'
+    else:
+        units = ''
+
+    fig, ax = plt.subplots ( 1, figsize=(10, 8) )
+    ax.fill_between ( run_times, q05, q95, alpha=0.15, color='tab:blue', label='5-95%' )
+    ax.fill_between ( run_times, q25, q75, alpha=0.3, color='tab:blue', label='25-75%' )
+    ax.plot ( run_times, median, marker='o', color='tab:blue', label='Median' )
+    ax.plot ( run_times, mean, linestyle='--', color='tab:orange', label='Mean' )
+    ax.grid ( axis='y', linestyle='--', linewidth=0.5, color='gray', alpha=0.5 )
+    ax.tick_params ( axis='x', rotation=25 )
+    ax.set_title ( title )
+    ax.set_xlabel ( "Run Time" )
+    ax.set_ylabel ( metric + units )
+    ax.legend ()
+    fig.tight_layout ()
+    fig.subplots_adjust ( top=0.95 )
+
+    save_figure ( fig, file )
+    plt.close ( fig )
@@ -1,11 +1,16 @@
 import json
+import os
+import pickle
 import sqlite3
+import threading
 from bisect import bisect_left, bisect_right
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 from absl import logging, app
 
+from helper.backend import split_trace_files
+
 MAX_WORKERS = 12
 
 QUERY_TOTAL_DURATION = """
@@ -15,6 +20,18 @@ FROM ANALYSIS_DETAILS;
 
 DURATION_REQUIRED_TABLE = ['ANALYSIS_DETAILS']
 
+NAV_METADATA = 'Metadata'  # NAV key holding extraction settings, never exported as a statistics category
+NVTX_ATTRIBUTION = 'NVTX Kernel Attribution'  # NAV key of kernel time per enclosing NVTX range, exported on its own
+NON_CATEGORY_KEYS = (NAV_METADATA, NVTX_ATTRIBUTION)
+DISPLAY_BINS = 128  # Distribution histograms from buckets merge sub-buckets until they span at most this many bins
+
+# Process pools and parsed NAV files kept warm between jobs of the analysis daemon
+WARM_WORKER_POOLS = {}
+WORKER_POOL_LOCK = threading.Lock()
+KEEP_WORKER_POOLS_WARM = False
+NAV_CACHE = None
+NAV_CACHE_ENTRIES = 16
+
 def file_args_checking(args):
     extract_data = False
     output_data = True
@@ -24,15 +41,14 @@ def file_args_checking(args):
         extract_data = True
 
     if extract_data:
-        num_files = args.data_file.count(".sqlite")
+        files = split_trace_files(args.data_file)
+        num_files = len(files)
     else:
         num_files = args.nav_file.count(".nav")
 
     if num_files > 1:
 
-        if extract_data:
-            files = [f.strip () + ".sqlite" for f in args.data_file.split ( ".sqlite" )]
-        else:
+        if not extract_data:
             files = [f.strip () + ".nav" for f in args.nav_file.split ( ".nav" )]
 
         files = files[0:num_files]
@@ -45,7 +61,7 @@ def file_args_checking(args):
         if len(file_labels) != num_files:
             raise app.UsageError("Must provide labels for each provided files")
     else:
-        files = args.data_file if extract_data else args.nav_file
+        files = files[0] if extract_data else args.nav_file
 
     if args.no_metrics_output:
         output_data = not args.no_metrics_output
@@ -54,12 +70,73 @@ def file_args_checking(args):
 
 
 def import_from_NAV(file):
+    if NAV_CACHE is not None:
+        key = os.path.abspath(file)
+        stat = os.stat(file)
+        cached = NAV_CACHE.pop(key, None)
+        if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            NAV_CACHE[key] = cached
+            # a private copy per job, exports sort Raw Data in place
+            return pickle.loads(cached[1])
+
     with open(file, 'r') as nav_file:
         dict = json.load(nav_file, parse_float=float)
 
+    if NAV_CACHE is not None:
+        NAV_CACHE[key] = ((stat.st_mtime_ns, stat.st_size), pickle.dumps(dict, protocol=pickle.HIGHEST_PROTOCOL))
+        while len(NAV_CACHE) > NAV_CACHE_ENTRIES:
+            NAV_CACHE.pop(next(iter(NAV_CACHE)))
+
     return dict
 
 
+def enable_warm_state():
+    global KEEP_WORKER_POOLS_WARM, NAV_CACHE
+    KEEP_WORKER_POOLS_WARM = True
+    NAV_CACHE = {}
+
+
+def acquire_worker_pool(name, max_workers=MAX_WORKERS):
+    if not KEEP_WORKER_POOLS_WARM:
+        return ProcessPoolExecutor(max_workers=max_workers)
+
+    # a warm pool keeps the size it was created with, so pools of different sizes are kept apart
+    key = (name, max_workers)
+    with WORKER_POOL_LOCK:
+        pool = WARM_WORKER_POOLS.get(key)
+        if pool is None or getattr(pool, '_broken', False):
+            pool = ProcessPoolExecutor(max_workers=max_workers)
+            WARM_WORKER_POOLS[key] = pool
+        return pool
+
+
+def release_worker_pool(pool):
+    if pool not in WARM_WORKER_POOLS.values():
+        pool.shutdown()
+
+
+def shutdown_worker_pools():
+    with WORKER_POOL_LOCK:
+        for pool in WARM_WORKER_POOLS.values():
+            pool.shutdown()
+        WARM_WORKER_POOLS.clear()
+
+
+def run_to_completion(generator):
+    # drains a generator and returns its return value
+    while True:
+        try:
+            next(generator)
+        except StopIteration as stop:
+            return stop.value
+
+
+def call_in_directory(directory, function, *args, **kwargs):
+    # warm pool workers outlive the working directory of the job that submitted the task
+    os.chdir(directory)
+    return function(*args, **kwargs)
+
+
 def table_exists(database_file, table_name):
     try:
         with sqlite3.connect(database_file) as conn:
@@ -89,6 +166,8 @@ def execute_query(conn, query, params=None):
         key = params
         if not isinstance(params, tuple):
             params = (params,)
+        else:
+            key = params[0]  # extra parameters (sampling stride, ranges) never change the result key
         cursor.execute(query, params)
     else:
         key = None
@@ -110,42 +189,6 @@ def execute_query_in_thread(query_params, database_file):
     return result
 
 
-def execute_queries_parallel(queries_with_params, database_file):
-    results = []
-    total_queries = len(queries_with_params)
-    completed_queries = 0
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-        for query_params in queries_with_params:
-            future = executor.submit(execute_query_in_thread, query_params, database_file)
-            futures.append(future)
-        for future in as_completed(futures):
-            results.append(future.result())
-            completed_queries += 1
-            # Check if 10% of total items are completed
-            if int((completed_queries / total_queries) * 100) % 10 == 0:
-                logging.info(f"Progress: {(completed_queries / total_queries) * 100:.1f}%")
-    return results
-
-
-def remove_outliers(data):
-    # Calculate the first and third quartiles
-    Q1 = np.percentile(data, 25)
-    Q3 = np.percentile(data, 75)
-
-    # Calculate the interquartile range (IQR)
-    IQR = Q3 - Q1
-
-    # Define the lower and upper bounds for outliers
-    lower_bound = Q1 - 1.5 * IQR
-    upper_bound = Q3 + 1.5 * IQR
-
-    # Remove outliers
-    clean_data = [x for x in data if np.all((x >= lower_bound) & (x <= upper_bound))]
-
-    return clean_data
-
-
 def generate_statistics(data, label, disable_raw=False):
     kernel_data = {}
     data = [float(x) for x in data]
@@ -187,6 +230,275 @@ def generate_statistics(data, label, disable_raw=False):
     return kernel_data
 
 
+def power_2_bucket(column, low=-1, high=62):
+    # floor(log2(column)) as a balanced CASE tree, values below 1 fall into bucket -1 ([0, 1))
+    if low == high:
+        return str(low)
+    middle = (low + high + 1) // 2
+    return f"CASE WHEN {column} < {2 ** middle} THEN {power_2_bucket(column, low, middle - 1)} " \
+           f"ELSE {power_2_bucket(column, middle, high)} END"
+
+
+def log_bucket(column, exponent, precision=0):
+    # HDR style index exponent * 2^precision + linear sub-bucket inside [2^exponent, 2^(exponent + 1)),
+    # precision 0 keeps the power-of-2 buckets
+    if not precision:
+        return exponent
+    sub_buckets = 2 ** precision
+    return f"CASE WHEN {exponent} < 0 THEN -1 ELSE {exponent} * {sub_buckets} + " \
+           f"CAST(({column} * 1.0 / (1 << {exponent}) - 1) * {sub_buckets} AS INTEGER) END"
+
+
+def summary_query(metric_values_query, precision=0):
+    return f"""
+{metric_values_query}
+SELECT
+    id,
+    metric,
+    bucket,
+    count(value),
+    total(value),
+    total(value * 1.0 * value),
+    min(value),
+    max(value)
+FROM (
+    SELECT
+        id,
+        metric,
+        value,
+        {log_bucket('value', 'exponent', precision)} AS bucket
+    FROM (
+        SELECT
+            id,
+            metric,
+            value,
+            {power_2_bucket('value')} AS exponent
+        FROM
+            metric_values
+        WHERE
+            value IS NOT NULL
+    )
+)
+GROUP BY 1, 2, 3
+"""
+
+
+def parse_summary_rows(rows, labels):
+    summaries = {}
+    for id, metric, bucket, count, total, sum_squares, minimum, maximum in rows:
+        summaries.setdefault(id, {}).setdefault(labels[metric], []).append(
+            [bucket, count, total, sum_squares, minimum, maximum])
+
+    for id, metrics in summaries.items():
+        for label, bucket_rows in metrics.items():
+            bucket_rows.sort()
+
+    return summaries
+
+
+def bucket_rows_from_values(values, precision=0):
+    # same buckets as log_bucket, frexp keeps floor(log2) and the sub-bucket exact at powers of 2
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return []
+    mantissas, exponents = np.frexp(np.maximum(values, 1))
+    sub_buckets = 2 ** precision
+    buckets = np.where(values < 1, -1, (exponents - 1) * sub_buckets + np.floor((mantissas * 2 - 1) * sub_buckets))
+
+    bucket_rows = []
+    for bucket in np.unique(buckets):
+        bucket_values = values[buckets == bucket]
+        bucket_rows.append([int(bucket), int(len(bucket_values)), float(bucket_values.sum()),
+                            float(np.square(bucket_values).sum()), float(bucket_values.min()),
+                            float(bucket_values.max())])
+
+    return bucket_rows
+
+
+def merge_bucket_rows(bucket_rows_list):
+    merged = {}
+    for bucket_rows in bucket_rows_list:
+        for bucket, count, total, sum_squares, minimum, maximum in bucket_rows:
+            if bucket in merged:
+                row = merged[bucket]
+                row[1] += count
+                row[2] += total
+                row[3] += sum_squares
+                row[4] = min(row[4], minimum)
+                row[5] = max(row[5], maximum)
+            else:
+                merged[bucket] = [bucket, count, total, sum_squares, minimum, maximum]
+
+    return [merged[bucket] for bucket in sorted(merged)]
+
+
+def moments_from_buckets(bucket_rows):
+    count = sum(row[1] for row in bucket_rows)
+    total = sum(row[2] for row in bucket_rows)
+    sum_squares = sum(row[3] for row in bucket_rows)
+    minimum = min(row[4] for row in bucket_rows)
+    maximum = max(row[5] for row in bucket_rows)
+    return count, total, sum_squares, minimum, maximum
+
+
+def quantile_from_buckets(bucket_rows, quantile):
+    count = sum(row[1] for row in bucket_rows)
+    rank = quantile * (count - 1)
+    seen = 0
+
+    for bucket, bucket_count, _, _, minimum, maximum in bucket_rows:
+        if rank < seen + bucket_count:
+            # interpolate between the smallest and largest value observed in the bucket
+            fraction = (rank - seen) / (bucket_count - 1) if bucket_count > 1 else 0.5
+            return minimum + (maximum - minimum) * fraction
+        seen += bucket_count
+
+    return bucket_rows[-1][5]
+
+
+def log_bucket_edges(bucket, precision=0):
+    if bucket < 0:
+        return 0, 1
+    exponent, sub_bucket = divmod(bucket, 2 ** precision)
+    return 2 ** exponent * (1 + sub_bucket / 2 ** precision), 2 ** exponent * (1 + (sub_bucket + 1) / 2 ** precision)
+
+
+def histogram_from_buckets(bucket_rows, convert_bytes=False, precision=0):
+    # halving the precision merges sub-bucket pairs, the sparse Buckets stay on the full grid for merging
+    counts = {row[0]: row[1] for row in bucket_rows}
+    while precision > 0 and max(counts) - min(counts) >= DISPLAY_BINS:
+        coarse_counts = {}
+        for bucket, count in counts.items():
+            coarse_counts[bucket // 2] = coarse_counts.get(bucket // 2, 0) + count
+        counts, precision = coarse_counts, precision - 1
+    buckets = range(min(counts), max(counts) + 1)
+    edges = [log_bucket_edges(bucket, precision) for bucket in buckets]
+    convert = convert_size if convert_bytes else convert_duration
+
+    return {
+        "Bin Centers": [(left + right) / 2 for left, right in edges],
+        "Histogram": [counts.get(bucket, 0) for bucket in buckets],
+        "Bin Width": [right - left for left, right in edges],
+        "Bin Labels": [f'{convert(left)}-{convert(right)}' for left, right in edges]
+    }
+
+
+def statistics_from_buckets(bucket_rows, convert_bytes=False, precision=0):
+    # quantiles are interpolated inside one bucket, at most 2^-precision of the value off for values from 1
+    statistics = statistics_from_moments(*moments_from_buckets(bucket_rows))
+    statistics['Median'] = round(float(quantile_from_buckets(bucket_rows, 0.5)), 6)
+    statistics['Distribution'] = histogram_from_buckets(bucket_rows, convert_bytes, precision)
+    statistics['Buckets'] = bucket_rows
+    return statistics
+
+
+def statistics_from_moments(count, total, sum_squares, minimum, maximum):
+    mean = total / count
+    variance = max(sum_squares / count - mean * mean, 0.0)
+
+    return {
+        'Count': count,
+        'Mean': round(mean, 6),
+        'Minimum': round(float(minimum), 6),
+        'Maximum': round(float(maximum), 6),
+        'Standard Deviation': round(float(np.sqrt(variance)), 6)
+    }
+
+
+def generate_summary_statistics(summaries, ids, labels, precision=0):
+    results = []
+    for id in ids:
+        summary = summaries.get(id, {})
+        results_dict = {}
+        for label in labels:
+            if summary.get(label):
+                convert_bytes = 'Size' in label or 'Bandwidth' in label
+                results_dict[label] = statistics_from_buckets(summary[label], convert_bytes, precision)
+            else:
+                results_dict[label] = None
+        results.append((id, results_dict))
+
+    return results
+
+
+def apply_log_histograms(item, labels, precision, summary=None):
+    # histogram mode, Raw Data items get sparse buckets on the same grid as chunked and summary items,
+    # exact SQLite buckets are used when sampling left only part of the Raw Data
+    for label in labels:
+        stats = item.get(label)
+        if not isinstance(stats, dict) or 'Buckets' in stats:
+            continue
+        bucket_rows = (summary or {}).get(label)
+        if not bucket_rows and stats.get('Raw Data'):
+            bucket_rows = bucket_rows_from_values(stats['Raw Data'], precision)
+        if bucket_rows:
+            convert_bytes = 'Size' in label or 'Bandwidth' in label
+            stats['Buckets'] = bucket_rows
+            stats['Distribution'] = histogram_from_buckets(bucket_rows, convert_bytes, precision)
+
+    return item
+
+
+def new_metric_accumulator(labels, precision=None):
+    # precision None keeps quantile histograms for Raw Data, buckets are then power-of-2
+    return {label: {'Raw Data': [], 'Buckets': [], 'Cluster Data': [], 'Precision': precision} for label in labels}
+
+
+def fold_metric_statistics(accumulator, item_info, exact_buckets=None):
+    # exact_buckets replace the Raw Data of sampled items so the general statistics stay unbiased
+    for label, label_accumulator in accumulator.items():
+        stats = item_info.get(label)
+        if stats:
+            if exact_buckets and exact_buckets.get(label):
+                label_accumulator['Buckets'].append(exact_buckets[label])
+            elif stats.get("Raw Data"):
+                label_accumulator['Raw Data'].extend(stats["Raw Data"])
+            elif stats.get("Buckets"):
+                label_accumulator['Buckets'].append(stats["Buckets"])
+            if stats['Mean'] and stats['Median'] and item_info["Instance"]:
+                label_accumulator['Cluster Data'].append([stats['Mean'], stats['Median'], item_info["Instance"]])
+
+    return accumulator
+
+
+def compact_metric_accumulator(accumulator):
+    # trade the combined Raw Data for mergeable buckets, general statistics then keep exact moments only
+    for label, label_accumulator in accumulator.items():
+        if label_accumulator['Raw Data']:
+            label_accumulator['Buckets'].append(bucket_rows_from_values(label_accumulator['Raw Data'],
+                                                                        label_accumulator['Precision'] or 0))
+            label_accumulator['Raw Data'] = []
+
+    return accumulator
+
+
+def finalize_metric_statistics(label_accumulator, label, convert_bytes=False):
+    dict = {}
+    cluster_data = label_accumulator['Cluster Data']
+    combined_raw_data = label_accumulator['Raw Data']
+    precision = label_accumulator.get('Precision')
+
+    if combined_raw_data and label_accumulator['Buckets']:
+        bucket_rows = merge_bucket_rows(label_accumulator['Buckets'] +
+                                        [bucket_rows_from_values(combined_raw_data, precision or 0)])
+        dict[label] = statistics_from_buckets(bucket_rows, convert_bytes, precision or 0)
+    elif combined_raw_data:
+        dict.update(generate_statistics(combined_raw_data, label, disable_raw=True))
+        if precision is None:
+            dict[label]['Distribution'] = create_histogram(combined_raw_data)
+        else:
+            bucket_rows = bucket_rows_from_values(combined_raw_data, precision)
+            dict[label]['Distribution'] = histogram_from_buckets(bucket_rows, convert_bytes, precision)
+            dict[label]['Buckets'] = bucket_rows
+    elif label_accumulator['Buckets']:
+        dict[label] = statistics_from_buckets(merge_bucket_rows(label_accumulator['Buckets']), convert_bytes,
+                                              precision or 0)
+    if cluster_data and label in dict:
+        dict[label]['k-mean'] = {'Raw Data': cluster_data}
+
+    return dict
+
+
 def convert_size(size_bytes):
     if size_bytes == 0:
         return "0B"
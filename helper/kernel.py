@@ -1,8 +1,8 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import as_completed
 
-from absl import logging
-
-from helper.general import remove_outliers, generate_statistics, MAX_WORKERS, create_histogram
+from helper.general import generate_statistics, MAX_WORKERS, create_histogram, summary_query, \
+    finalize_metric_statistics, bucket_rows_from_values, acquire_worker_pool, release_worker_pool
+from helper.outliers import remove_metric_outliers, record_outliers
 
 QUERY_KERNEL = """ 
 WITH
@@ -64,7 +64,8 @@ SELECT
     KS.kernel_id AS "ID",
     KS.execution_time AS "Execution time",
     RS.launch_overhead AS "Launch overhead",
-    KS.kernel_start - RS.runtime_end AS "Slack"
+    KS.kernel_start - RS.runtime_end AS "Slack",
+    KS.kernel_start AS "Start"
 FROM
     kernel_summary AS KS
 LEFT JOIN
@@ -73,25 +74,74 @@ ON
     RS.correlationId = KS.correlation_id
 """
 
-KERNEL_REQUIRED_TABLES = ['CUPTI_ACTIVITY_KIND_KERNEL', 'CUPTI_ACTIVITY_KIND_RUNTIME', 'StringIds']
-
+KERNEL_METRIC_VALUES = """
+WITH
+    kernel_summary AS (
+        SELECT
+            KERNEL.shortname AS kernel_id,
+            KERNEL.end - KERNEL.start AS execution_time,
+            KERNEL.start as kernel_start,
+            KERNEL.correlationId as correlation_id
+        FROM
+            CUPTI_ACTIVITY_KIND_KERNEL AS KERNEL
+        JOIN
+            StringIds AS StringIds
+        ON
+            KERNEL.shortName = StringIds.id
+    ),
+    runtime_summary AS (
+        SELECT
+            correlationId,
+            end - start AS launch_overhead,
+            end AS runtime_end
+        FROM
+            CUPTI_ACTIVITY_KIND_RUNTIME
+        WHERE
+            eventClass != 67
+    ),
+    metrics AS (
+        SELECT
+            KS.kernel_id AS kernel_id,
+            CASE WHEN KS.execution_time > 0 THEN KS.execution_time END AS duration,
+            CASE WHEN RS.launch_overhead > 0 THEN RS.launch_overhead END AS overhead,
+            CASE WHEN KS.kernel_start - RS.runtime_end > 0 THEN KS.kernel_start - RS.runtime_end END AS slack
+        FROM
+            kernel_summary AS KS
+        LEFT JOIN
+            runtime_summary AS RS
+        ON
+            RS.correlationId = KS.correlation_id
+    ),
+    metric_values AS (
+        SELECT
+            M.kernel_id AS id,
+            metric_index.metric AS metric,
+            CASE metric_index.metric
+                WHEN 0 THEN M.duration
+                WHEN 1 THEN M.overhead
+                ELSE M.slack
+            END AS value
+        FROM
+            metrics AS M
+        CROSS JOIN
+            (SELECT 0 AS metric UNION ALL SELECT 1 UNION ALL SELECT 2) AS metric_index
+    )
+"""
 
-def generate_kernel_queries(kernel_ids):
-    queries = []
+QUERY_KERNEL_SUMMARY = summary_query(KERNEL_METRIC_VALUES)
 
-    for kernel_id in kernel_ids:
-        queries.append((QUERY_KERNEL_STATS, kernel_id))
+KERNEL_METRICS = ['Execution Duration', 'Launch Overhead', 'Slack']
 
-    return queries
+KERNEL_REQUIRED_TABLES = ['CUPTI_ACTIVITY_KIND_KERNEL', 'CUPTI_ACTIVITY_KIND_RUNTIME', 'StringIds']
 
 
-def parse_kernel_data(data):
+def parse_kernel_data(data, outlier_filters=None):
     raw_duration_data = []
     raw_overhead_data = []
     raw_slack_data = []
     runtime_values = True
 
-    for id, duration, overhead, slack in data[1]:
+    for id, duration, overhead, slack, *_ in data[1]:
         raw_duration_data.append(duration) if duration > 0 else 0
 
         if overhead is None or slack is None:
@@ -100,11 +150,11 @@ def parse_kernel_data(data):
             raw_overhead_data.append(overhead) if overhead > 0 else 0
             raw_slack_data.append(slack) if slack > 0 else 0
 
+    dropped = {}
+    raw_duration_data = remove_metric_outliers(raw_duration_data, 'Execution Duration', outlier_filters, dropped)
     if runtime_values:
-        if raw_overhead_data:
-            remove_outliers(raw_overhead_data)
-        if raw_slack_data:
-            remove_outliers(raw_slack_data)
+        raw_overhead_data = remove_metric_outliers(raw_overhead_data, 'Launch Overhead', outlier_filters, dropped)
+        raw_slack_data = remove_metric_outliers(raw_slack_data, 'Slack', outlier_filters, dropped)
 
     results_dict = {}
 
@@ -132,63 +182,43 @@ def parse_kernel_data(data):
     else:
         results_dict['Slack'] = None
 
-    return id, results_dict
-
-
-def parallel_parse_kernel_data(queries_res):
-    total_tasks = len(queries_res)
-    completed_tasks = 0
-
-    with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = []
-        for data in queries_res:
-            future = executor.submit(parse_kernel_data, data)
-            futures.append(future)
-
-        results = []
-        for future in as_completed(futures):
-            results.append(future.result())
-            completed_tasks += 1
-
-            if int((completed_tasks / total_tasks) * 100) % 10 == 0:
-                logging.info(f"Progress: {(completed_tasks / total_tasks) * 100:.1f}%")
+    return id, record_outliers(results_dict, dropped)
 
-    return results
 
+def parse_kernel_chunk(data, precision=0):
+    raw_duration_data = []
+    raw_overhead_data = []
+    raw_slack_data = []
+    runtime_values = True
 
-def create_specific_kernel_stats(kernel_stats, label, handle_outliers=False):
-    dict = {}
-    cluster_data = []
-    combined_raw_data = []
-
-    for kernel_id, kernel_info in kernel_stats.items():
-        if kernel_info[label]:
-            if kernel_info[label]["Raw Data"]:
-                combined_raw_data.extend(kernel_info[label]["Raw Data"])
-            if kernel_info[label]['Mean'] and kernel_info[label]['Median'] and kernel_info[
-                "Instance"]:
-                cluster_data.append([kernel_info[label]['Mean'], kernel_info[label]['Median'],
-                                     kernel_info["Instance"]])
+    for id, duration, overhead, slack, *_ in data[1]:
+        raw_duration_data.append(duration) if duration > 0 else 0
 
-    if handle_outliers and cluster_data: cluster_data = remove_outliers(cluster_data)
-    if combined_raw_data:
-        dict.update(generate_statistics(combined_raw_data, label, disable_raw=True))
-        dict[label]['Distribution'] = create_histogram(combined_raw_data)
-    if cluster_data:
-        dict[label]['k-mean'] = {'Raw Data': cluster_data}
+        if overhead is None or slack is None:
+            runtime_values = False
+        else:
+            raw_overhead_data.append(overhead) if overhead > 0 else 0
+            raw_slack_data.append(slack) if slack > 0 else 0
 
-    return dict
+    return data[0], {
+        'Execution Duration': bucket_rows_from_values(raw_duration_data, precision),
+        'Launch Overhead': bucket_rows_from_values(raw_overhead_data, precision) if runtime_values else None,
+        'Slack': bucket_rows_from_values(raw_slack_data, precision) if runtime_values else None
+    }
 
 
-def parallel_create_general_kernel_stats(kernel_stats):
+def parallel_finalize_kernel_stats(accumulator):
     general_stats = {}
-    tasks = ['Execution Duration', 'Launch Overhead', 'Slack']
+    tasks = KERNEL_METRICS
 
-    with ProcessPoolExecutor(max_workers=len(tasks) if MAX_WORKERS > len(tasks) else MAX_WORKERS) as executor:
-        futures = {executor.submit(create_specific_kernel_stats, kernel_stats, task): task for task in tasks}
+    executor = acquire_worker_pool('Parse', len(tasks) if MAX_WORKERS > len(tasks) else MAX_WORKERS)
+    try:
+        futures = {executor.submit(finalize_metric_statistics, accumulator[task], task): task for task in tasks}
 
         for future in as_completed(futures):
             result = future.result()
             general_stats.update(result)
+    finally:
+        release_worker_pool(executor)
 
     return general_stats
@@ -0,0 +1,142 @@
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from absl import logging
+
+RESULT_BYTES_PER_ROW = 256  # raw row tuple in the query worker, its pickle, and the parsed Raw Data floats
+IN_FLIGHT_FRACTION = 0.25  # share of the budget estimated in-flight results may take
+SPILL_FRACTION = 0.75  # observed RSS above this share of the budget spills completed results to disk
+RSS_POLL_INTERVAL = 0.5  # seconds an observed RSS reading is reused
+SPILL_KEY = 'Spilled To'
+
+
+def read_rss(pid='self'):
+    # proportional set size so pages shared between the workers are counted once, VmRSS on older kernels
+    for file_name, field in [(f'/proc/{pid}/smaps_rollup', 'Pss:'), (f'/proc/{pid}/status', 'VmRSS:')]:
+        try:
+            with open(file_name) as status_file:
+                for line in status_file:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+    return 0
+
+
+def child_pids(pid='self'):
+    pids = []
+    task_dir = f'/proc/{pid}/task'
+    try:
+        for task in os.listdir(task_dir):
+            with open(f'{task_dir}/{task}/children') as children_file:
+                pids.extend(children_file.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def observed_rss(memory_budget):
+    # extraction process plus its query and parse workers
+    now = time.time()
+    if now - memory_budget['Last Poll'] >= RSS_POLL_INTERVAL:
+        memory_budget['RSS'] = read_rss() + sum(read_rss(pid) for pid in child_pids())
+        memory_budget['Peak RSS'] = max(memory_budget['Peak RSS'], memory_budget['RSS'])
+        memory_budget['Last Poll'] = now
+    return memory_budget['RSS']
+
+
+def new_memory_budget(budget_gb, output_dir):
+    if not budget_gb:
+        return None
+
+    logging.info(f"Limiting extraction to a memory budget of {budget_gb} GB")
+    return {'Budget': int(budget_gb * 1024 ** 3), 'Output Dir': output_dir, 'Spill Dir': None, 'Spilled': 0,
+            'RSS': 0, 'Peak RSS': 0, 'Last Poll': 0}
+
+
+def estimate_result_bytes(cost):
+    return cost * RESULT_BYTES_PER_ROW
+
+
+def in_flight_allowed(memory_budget, in_flight_bytes, task_bytes):
+    # with nothing in flight a task always starts, so oversized items still make progress
+    if memory_budget is None or in_flight_bytes == 0:
+        return True
+    if in_flight_bytes + task_bytes > memory_budget['Budget'] * IN_FLIGHT_FRACTION:
+        return False
+    return observed_rss(memory_budget) < memory_budget['Budget']
+
+
+def over_spill_threshold(memory_budget):
+    return memory_budget is not None and observed_rss(memory_budget) > memory_budget['Budget'] * SPILL_FRACTION
+
+
+def spill_item(memory_budget, item, keys):
+    if memory_budget['Spill Dir'] is None:
+        os.makedirs(memory_budget['Output Dir'], exist_ok=True)
+        memory_budget['Spill Dir'] = tempfile.mkdtemp(prefix='.spill_', dir=memory_budget['Output Dir'])
+        logging.warning(f"Memory budget exceeded, spilling completed results to {memory_budget['Spill Dir']}")
+
+    spill_file = os.path.join(memory_budget['Spill Dir'], f"{memory_budget['Spilled']}.pkl")
+    payload = {key: item.pop(key) for key in list(keys) if key in item}
+    with open(spill_file, 'wb') as spill:
+        pickle.dump(payload, spill, protocol=pickle.HIGHEST_PROTOCOL)
+    item[SPILL_KEY] = spill_file
+    memory_budget['Spilled'] += 1
+
+    return item
+
+
+def load_spilled_item(item):
+    if not isinstance(item, dict) or SPILL_KEY not in item:
+        return item
+
+    with open(item[SPILL_KEY], 'rb') as spill:
+        payload = pickle.load(spill)
+    loaded_item = {key: value for key, value in item.items() if key != SPILL_KEY}
+    loaded_item.update(payload)
+    return loaded_item
+
+
+def iter_nav_json(obj, level=0, indent=4):
+    # same text as json.dump(obj, indent=indent), spilled items are loaded one at a time while writing
+    obj = load_spilled_item(obj)
+    if not isinstance(obj, dict) or not obj:
+        yield json.dumps(obj, indent=indent).replace('\n', '\n' + ' ' * indent * level)
+        return
+
+    yield '{'
+    for index, (key, value) in enumerate(obj.items()):
+        key = key if isinstance(key, str) else json.dumps(key)
+        yield (',' if index else '') + '\n' + ' ' * indent * (level + 1) + json.dumps(key) + ': '
+        yield from iter_nav_json(value, level + 1, indent)
+    yield '\n' + ' ' * indent * level + '}'
+
+
+def write_nav(full_statistics, nav_file_name):
+    with open(nav_file_name, 'w') as NAV_file:
+        for text in iter_nav_json(full_statistics):
+            NAV_file.write(text)
+
+
+def release_memory_budget(memory_budget, full_statistics, restore=True):
+    if memory_budget['Spill Dir'] is not None:
+        if restore:
+            logging.warning(f"Loading {memory_budget['Spilled']} spilled results back for export, "
+                            f"exports are not covered by the memory budget")
+            for category in full_statistics.values():
+                if not isinstance(category, dict):
+                    continue
+                for key, items in category.items():
+                    if key.startswith('Individual'):
+                        for id, item in items.items():
+                            items[id] = load_spilled_item(item)
+        shutil.rmtree(memory_budget['Spill Dir'], ignore_errors=True)
+        memory_budget['Spill Dir'] = None
+
+    logging.info(f"Peak observed RSS {memory_budget['Peak RSS'] / 1024 ** 3:.2f} GB of "
+                 f"{memory_budget['Budget'] / 1024 ** 3:.2f} GB budget, {memory_budget['Spilled']} results spilled")
@@ -0,0 +1,120 @@
+import sqlite3
+
+from helper.general import summary_query
+from helper.transfer import CONVERSION_TO_SECONDS
+
+MPI_STATISTICS = 'MPI Statistics'
+MPI_ITEMS = 'Individual MPI Operations'
+
+# nsys --trace=mpi,ucx tables with a message size, the StringIds column naming the operation and the bytes moved
+# (collectives count the larger of the sent and received buffers)
+MPI_TABLES = {
+    'MPI_P2P_EVENTS': ('textId', 'E.size'),
+    'MPI_COLLECTIVES_EVENTS': ('textId', 'max(coalesce(E.size, 0), coalesce(E.recvSize, 0))'),
+    'UCP_SUBMIT_EVENTS': ('nameId', 'E.packedSize'),
+}
+
+OPERATIONS = """
+        SELECT
+            sid.value AS name,
+            E.end - E.start AS duration,
+            coalesce({size}, 0) AS size,
+            E.start AS start
+        FROM
+            {table} AS E
+        JOIN
+            StringIds AS sid
+        ON
+            sid.id = E.{name_column}
+        WHERE
+            E.end > E.start"""
+
+QUERY_MPI = """
+WITH
+    operations AS ({operations}
+    ),
+    summary AS (
+        SELECT
+            name AS name,
+            sum(duration) AS time_total,
+            sum(size) AS mem_total,
+            count(*) AS num
+        FROM
+            operations
+        GROUP BY 1
+    ),
+    totals AS (
+        SELECT sum(time_total) AS time_total FROM summary
+    )
+SELECT
+    summary.name AS "Operation",
+    round(summary.time_total * 100.0 / (SELECT time_total FROM totals), 1) AS "Time:ratio_%",
+    summary.time_total AS "Total Time:dur_ns",
+    summary.mem_total AS "Total:mem_B",
+    summary.num AS "Count"
+FROM
+    summary
+ORDER BY 2 DESC
+"""
+
+QUERY_MPI_STATS = """
+WITH
+    operations AS ({operations}
+    )
+SELECT
+    name AS "Name",
+    duration AS "Duration",
+    size AS "Size",
+    start AS "Start"
+FROM
+    operations
+"""
+
+QUERY_TABLE_NAMES = "SELECT name FROM sqlite_master WHERE type = 'table'"
+
+MPI_METRIC_VALUES = f"""
+WITH
+    operations AS ({{operations}}
+    ),
+    metric_values AS (
+        SELECT
+            O.name AS id,
+            metric_index.metric AS metric,
+            CASE metric_index.metric
+                WHEN 0 THEN O.size
+                WHEN 1 THEN O.duration
+                ELSE O.size / (O.duration * {CONVERSION_TO_SECONDS})
+            END AS value
+        FROM
+            operations AS O
+        CROSS JOIN
+            (SELECT 0 AS metric UNION ALL SELECT 1 UNION ALL SELECT 2) AS metric_index
+    )
+"""
+
+
+def mpi_tables(database_file):
+    # the tables only exist when MPI or UCX was traced, the missing ones are skipped without an error
+    with sqlite3.connect(database_file) as conn:
+        names = {name for name, in conn.execute(QUERY_TABLE_NAMES)}
+    return [table for table in MPI_TABLES if table in names and 'StringIds' in names]
+
+
+def operations_query(tables):
+    return "\n        UNION ALL".join(OPERATIONS.format(table=table, name_column=MPI_TABLES[table][0],
+                                                      size=MPI_TABLES[table][1]) for table in tables)
+
+
+def generate_mpi_queries(tables, precision=0):
+    # the first query, the RAW Data query of all operations and the summary query over the tables in the trace
+    operations = operations_query(tables)
+    return (QUERY_MPI.format(operations=operations), QUERY_MPI_STATS.format(operations=operations),
+            summary_query(MPI_METRIC_VALUES.format(operations=operations), precision))
+
+
+def group_operations(rows):
+    # every table is read once and its operations grouped by name here, as the summary query does in its GROUP BY
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[0], []).append(row)
+    return groups
@@ -0,0 +1,87 @@
+import numpy as np
+from absl import app
+
+OUTLIER_METHODS = ['iqr', 'mad', 'percentile']
+# iqr: Tukey fences at threshold * IQR, mad: modified z-score above threshold, percentile: trim threshold % per side
+DEFAULT_THRESHOLDS = {'iqr': 1.5, 'mad': 3.5, 'percentile': 1.0}
+MAD_SCALE = 0.6745  # MAD of a normal distribution in standard deviations
+ALL_METRICS = '*'
+
+
+def parse_outlier_filters(outlier_filter, metrics):
+    # "method[:threshold]" for every metric or "Metric=method[:threshold],..." per metric
+    if not outlier_filter:
+        return {}
+
+    filters = {}
+    for entry in outlier_filter.split(','):
+        metric, _, rule = entry.rpartition('=')
+        method, _, threshold = rule.strip().partition(':')
+        metric = metric.strip() or ALL_METRICS
+        method = method.strip().lower()
+        if method not in OUTLIER_METHODS:
+            raise app.UsageError(f"Unknown outlier method {method}, must be one of {', '.join(OUTLIER_METHODS)}")
+        if metric != ALL_METRICS and metric not in metrics:
+            raise app.UsageError(f"Unknown outlier metric {metric}, must be one of {', '.join(metrics)}")
+        try:
+            threshold = float(threshold) if threshold.strip() else DEFAULT_THRESHOLDS[method]
+        except ValueError:
+            raise app.UsageError(f"Outlier threshold of {entry.strip()} must be a number")
+        if threshold < 0 or (method == 'percentile' and threshold >= 50):
+            raise app.UsageError(f"Outlier threshold of {entry.strip()} is out of range")
+        filters[metric] = (method, threshold)
+
+    # per metric entries take precedence over the one for every metric
+    default = filters.pop(ALL_METRICS, None)
+    if default:
+        filters = {metric: filters.get(metric, default) for metric in metrics}
+    return filters
+
+
+def outlier_bounds(values, method, threshold):
+    # bounds per column, a single partial sort per column for the quantiles
+    if method == 'iqr':
+        q1, q3 = np.percentile(values, [25, 75], axis=0)
+        return q1 - threshold * (q3 - q1), q3 + threshold * (q3 - q1)
+    if method == 'mad':
+        median = np.median(values, axis=0)
+        mad = np.median(np.abs(values - median), axis=0)
+        # more than half of the samples are equal, nothing is an outlier on a zero scale
+        spread = np.where(mad > 0, threshold * mad / MAD_SCALE, np.inf)
+        return median - spread, median + spread
+    return tuple(np.percentile(values, [threshold, 100 - threshold], axis=0))
+
+
+def outlier_mask(values, method='iqr', threshold=None):
+    # True for the samples kept, rows of 2D data are kept when every column is inside its bounds
+    values = np.asarray(values, dtype=float)
+    if not values.size:
+        return np.ones(len(values), dtype=bool)
+    lower, upper = outlier_bounds(values, method, DEFAULT_THRESHOLDS[method] if threshold is None else threshold)
+    keep = (values >= lower) & (values <= upper)
+    return keep.all(axis=1) if keep.ndim > 1 else keep
+
+
+def metric_outlier_mask(values, label, outlier_filters):
+    if not outlier_filters or label not in outlier_filters or not len(values):
+        return None
+    return outlier_mask(values, *outlier_filters[label])
+
+
+def apply_outlier_mask(values, keep, label, dropped):
+    if keep is None:
+        return values
+    dropped[label] = int(keep.size - np.count_nonzero(keep))
+    return np.asarray(values)[keep].tolist()
+
+
+def remove_metric_outliers(values, label, outlier_filters, dropped):
+    return apply_outlier_mask(values, metric_outlier_mask(values, label, outlier_filters), label, dropped)
+
+
+def record_outliers(results_dict, dropped):
+    for label, count in dropped.items():
+        if isinstance(results_dict.get(label), dict):
+            results_dict[label]['Outliers Removed'] = count
+
+    return results_dict
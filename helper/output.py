@@ -0,0 +1,134 @@
+import io
+import os
+import queue
+import tarfile
+import threading
+import time
+import zipfile
+from contextlib import contextmanager
+
+from absl import logging
+
+ARCHIVE_QUEUE_SIZE = 256  # buffers waiting for the archive writer before exports block
+ARCHIVE_SUFFIXES = ['.zip', '.tar', '.tar.gz', '.tgz']
+STORED_SUFFIXES = ('.png',)  # already compressed, stored as is in zip archives
+
+
+def write_to_disk(file, data):
+    # parent directories are only created when the first write into them fails
+    mode = 'wb' if isinstance(data, bytes) else 'w'
+    try:
+        output_file = open(file, mode) if mode == 'wb' else open(file, mode, newline='')
+    except FileNotFoundError:
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        output_file = open(file, mode) if mode == 'wb' else open(file, mode, newline='')
+    with output_file:
+        output_file.write(data)
+
+
+OUTPUT_SINK = write_to_disk  # callable (file, str or bytes) every table and figure writer goes through
+
+
+def write_output(file, data):
+    OUTPUT_SINK(os.path.normpath(file), data)
+
+
+def writes_to_disk():
+    return OUTPUT_SINK is write_to_disk
+
+
+@contextmanager
+def output_sink(sink):
+    global OUTPUT_SINK
+    previous = OUTPUT_SINK
+    OUTPUT_SINK = sink
+    try:
+        yield sink
+    finally:
+        OUTPUT_SINK = previous
+
+
+@contextmanager
+def open_output(file):
+    buffer = io.StringIO()
+    yield buffer
+    write_output(file, buffer.getvalue())
+
+
+@contextmanager
+def outputs_in_memory():
+    buffers = {}
+    with output_sink(buffers.__setitem__):
+        yield buffers
+
+
+def call_with_outputs(collect, function, *args, **kwargs):
+    # runs in an export worker, collected buffers are returned to the process owning the sink
+    if not collect:
+        with output_sink(write_to_disk):
+            function(*args, **kwargs)
+        return None
+    with outputs_in_memory() as buffers:
+        function(*args, **kwargs)
+    return buffers
+
+
+def write_outputs(buffers):
+    for file, data in (buffers or {}).items():
+        write_output(file, data)
+
+
+def archive_path(file):
+    return file.replace(os.sep, '/').lstrip('/')
+
+
+def archive_writer(archive_file, buffers, state):
+    try:
+        if archive_file.endswith('.zip'):
+            with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+                while (buffer := buffers.get()) is not None:
+                    file, data = buffer
+                    archive.writestr(archive_path(file), data, zipfile.ZIP_STORED if file.endswith(STORED_SUFFIXES)
+                                     else zipfile.ZIP_DEFLATED)
+                    state['Files'] += 1
+        else:
+            mode = 'w:gz' if archive_file.endswith(('.tar.gz', '.tgz')) else 'w'
+            with tarfile.open(archive_file, mode) as archive:
+                while (buffer := buffers.get()) is not None:
+                    file, data = buffer
+                    data = data if isinstance(data, bytes) else data.encode()
+                    info = tarfile.TarInfo(archive_path(file))
+                    info.size = len(data)
+                    info.mtime = time.time()
+                    archive.addfile(info, io.BytesIO(data))
+                    state['Files'] += 1
+    except Exception as error:
+        state['Error'] = error
+        # keep draining so exports never block on a full queue
+        while buffers.get() is not None:
+            pass
+
+
+@contextmanager
+def archive_outputs(archive_file):
+    if not archive_file.endswith(tuple(ARCHIVE_SUFFIXES)):
+        raise ValueError(f"Output archive must end with one of {', '.join(ARCHIVE_SUFFIXES)}")
+    if os.path.dirname(archive_file):
+        os.makedirs(os.path.dirname(archive_file), exist_ok=True)
+
+    buffers = queue.Queue(maxsize=ARCHIVE_QUEUE_SIZE)
+    state = {'Files': 0, 'Error': None}
+    writer = threading.Thread(target=archive_writer, args=(archive_file, buffers, state), daemon=True)
+    writer.start()
+    logging.info(f"Writing Tables and Figures into {archive_file}")
+
+    try:
+        with output_sink(lambda file, data: buffers.put((file, data))):
+            yield archive_file
+    finally:
+        buffers.put(None)
+        writer.join()
+
+    if state['Error'] is not None:
+        raise state['Error']
+    logging.info(f"Wrote {state['Files']} Tables and Figures into {archive_file}")
@@ -0,0 +1,114 @@
+import json
+import os
+import tempfile
+import time
+
+from absl import logging
+
+RENDER_COST_FILE = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'nav',
+                                'render_costs.json')
+DEFAULT_TASK_SECONDS = 0.5  # fixed cost of rendering one item before any run was recorded
+DEFAULT_SAMPLE_SECONDS = 2e-6  # cost per Raw Data sample (sorting, histograms) before any run was recorded
+MAX_HISTORY = 5000  # recorded tasks per model, older runs are down-weighted beyond this
+
+
+def item_samples(item):
+    samples = 0
+    for stats in item.values():
+        if isinstance(stats, dict) and 'Mean' in stats:
+            samples += len(stats['Raw Data']) if stats.get('Raw Data') else stats.get('Count') or 0
+    return samples
+
+
+def load_render_costs():
+    try:
+        with open(RENDER_COST_FILE) as cost_file:
+            return json.load(cost_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_render_costs(costs):
+    try:
+        os.makedirs(os.path.dirname(RENDER_COST_FILE), exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(RENDER_COST_FILE), delete=False) as cost_file:
+            json.dump(costs, cost_file)
+        os.replace(cost_file.name, RENDER_COST_FILE)
+    except OSError as error:
+        logging.warning(f"Could not record rendering costs in {RENDER_COST_FILE}: {error}")
+
+
+def fit_render_cost(model):
+    # least squares seconds = task + samples * per sample over the recorded tasks
+    if not model or model['N'] < 2:
+        return DEFAULT_TASK_SECONDS, DEFAULT_SAMPLE_SECONDS
+    n, sum_x, sum_y, sum_xx, sum_xy = model['N'], model['X'], model['Y'], model['XX'], model['XY']
+    variance = n * sum_xx - sum_x ** 2
+    if variance <= 0:
+        return sum_y / n, 0.0
+    per_sample = max(0.0, (n * sum_xy - sum_x * sum_y) / variance)
+    return max(0.0, (sum_y - per_sample * sum_x) / n), per_sample
+
+
+def estimate_render_seconds(model, samples):
+    task_seconds, sample_seconds = fit_render_cost(model)
+    return task_seconds + sample_seconds * samples
+
+
+def record_render_costs(kind, measurements):
+    if not measurements:
+        return
+    costs = load_render_costs()
+    model = costs.get(kind) or {'N': 0, 'X': 0.0, 'Y': 0.0, 'XX': 0.0, 'XY': 0.0}
+    if model['N'] + len(measurements) > MAX_HISTORY:
+        model = {key: value / 2 for key, value in model.items()}
+    for samples, seconds in measurements:
+        model['N'] += 1
+        model['X'] += samples
+        model['Y'] += seconds
+        model['XX'] += samples * samples
+        model['XY'] += samples * seconds
+    costs[kind] = model
+    save_render_costs(costs)
+
+
+def planning_enabled(render_limits):
+    return (render_limits or {}).get('Coverage') is not None or (render_limits or {}).get('Budget') is not None
+
+
+def plan_rendering(candidates, kind, render_limits, num_workers):
+    # candidates are (key, time total, samples), the largest Time Total first are rendered in detail until the
+    # coverage target is met or the estimated wall-clock time of the workers reaches the budget
+    coverage = (render_limits or {}).get('Coverage')
+    budget = (render_limits or {}).get('Budget')
+    if not planning_enabled(render_limits) or not candidates:
+        return [key for key, _, _ in candidates], []
+
+    model = load_render_costs().get(kind)
+    candidates = sorted(candidates, key=lambda candidate: candidate[1] or 0, reverse=True)
+    total_time = sum(time_total or 0 for _, time_total, _ in candidates)
+
+    detailed = []
+    covered_time = 0
+    estimated_seconds = 0
+    for key, time_total, samples in candidates:
+        if coverage is not None and detailed and covered_time >= coverage * total_time:
+            break
+        seconds = estimate_render_seconds(model, samples)
+        if budget is not None and detailed and (estimated_seconds + seconds) / num_workers > budget:
+            break
+        detailed.append(key)
+        covered_time += time_total or 0
+        estimated_seconds += seconds
+
+    other = [key for key, _, _ in candidates[len(detailed):]]
+    logging.info(f"Rendering {len(detailed)} of {len(candidates)} items in detail "
+                 f"({covered_time / total_time * 100 if total_time else 100:.1f}% of Time Total, estimated "
+                 f"{estimated_seconds / num_workers:.1f} s), {len(other)} summarized in the Other table")
+    return detailed, other
+
+
+def timed_call(function, *args, **kwargs):
+    start_time = time.time()
+    result = function(*args, **kwargs)
+    return result, time.time() - start_time
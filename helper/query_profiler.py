@@ -0,0 +1,256 @@
+import json
+import os
+import re
+import sqlite3
+import time
+
+from absl import logging
+
+from helper.attribution import QUERY_NVTX_THREAD_RANGES, QUERY_KERNEL_LAUNCHES, ATTRIBUTION_REQUIRED_TABLES
+from helper.chunking import chunk_query, rowid_ranges
+from helper.communication import QUERY_COMMUNICATION, QUERY_COMMUNICATION_STATS, COMM_REQUIRED_TABLES, \
+    QUERY_COMMUNICATION_SUMMARY
+from helper.general import mutiple_table_exists, QUERY_TOTAL_DURATION, DURATION_REQUIRED_TABLE
+from helper.kernel import QUERY_KERNEL, QUERY_KERNEL_STATS, KERNEL_REQUIRED_TABLES, QUERY_KERNEL_SUMMARY
+from helper.mpi import mpi_tables, generate_mpi_queries
+from helper.scope import build_scope, scope_query
+from helper.transfer import QUERY_TRANSFERS, QUERY_TRANSFERS_STATS, TRANSFER_REQUIRED_TABLES, \
+    QUERY_TRANSFERS_SUMMARY
+
+PROGRESS_STEPS = 100000  # SQLite VM instructions between progress handler calls
+PROGRESS_LOG_INTERVAL = 10  # seconds between progress log lines
+FETCH_SIZE = 10000
+PROFILED_CHUNKS = 8  # chunked per-item queries are profiled on the first of this many rowid chunks
+
+# (name, query, required tables, summary query providing the parameter of a per-item query)
+PROFILED_QUERIES = [
+    ('QUERY_TOTAL_DURATION', QUERY_TOTAL_DURATION, DURATION_REQUIRED_TABLE, None),
+    ('QUERY_KERNEL', QUERY_KERNEL, KERNEL_REQUIRED_TABLES, None),
+    ('QUERY_KERNEL_STATS', QUERY_KERNEL_STATS, KERNEL_REQUIRED_TABLES, QUERY_KERNEL),
+    ('QUERY_KERNEL_SUMMARY', QUERY_KERNEL_SUMMARY, KERNEL_REQUIRED_TABLES, None),
+    ('QUERY_TRANSFERS', QUERY_TRANSFERS, TRANSFER_REQUIRED_TABLES, None),
+    ('QUERY_TRANSFERS_STATS', QUERY_TRANSFERS_STATS, TRANSFER_REQUIRED_TABLES, QUERY_TRANSFERS),
+    ('QUERY_TRANSFERS_SUMMARY', QUERY_TRANSFERS_SUMMARY, TRANSFER_REQUIRED_TABLES, None),
+    ('QUERY_COMMUNICATION', QUERY_COMMUNICATION, COMM_REQUIRED_TABLES, None),
+    ('QUERY_COMMUNICATION_STATS', QUERY_COMMUNICATION_STATS, COMM_REQUIRED_TABLES, QUERY_COMMUNICATION),
+    ('QUERY_COMMUNICATION_SUMMARY', QUERY_COMMUNICATION_SUMMARY, COMM_REQUIRED_TABLES, None),
+    ('QUERY_NVTX_THREAD_RANGES', QUERY_NVTX_THREAD_RANGES, ATTRIBUTION_REQUIRED_TABLES, None),
+    ('QUERY_KERNEL_LAUNCHES', QUERY_KERNEL_LAUNCHES, ATTRIBUTION_REQUIRED_TABLES, None),
+]
+
+# per-item queries that --chunk_rows splits into rowid chunks
+CHUNKED_QUERIES = ['QUERY_KERNEL_STATS', 'QUERY_TRANSFERS_STATS', 'QUERY_COMMUNICATION_STATS']
+
+# the attribution matches kernels against every range, extraction never scopes its range query
+UNSCOPED_QUERIES = ['QUERY_NVTX_THREAD_RANGES']
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+def get_table_names(conn):
+    rows = conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
+    return {name for name, in rows}
+
+
+def get_table_row_count(conn, table_name, row_counts):
+    if table_name not in row_counts:
+        row_counts[table_name] = conn.execute(f'SELECT count(*) FROM "{table_name}";').fetchone()[0]
+    return row_counts[table_name]
+
+
+def get_table_aliases(query, table_names):
+    aliases = {}
+    for table_name, alias in re.findall(r'(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)', query, flags=re.IGNORECASE):
+        if table_name in table_names:
+            aliases[alias] = table_name
+    return aliases
+
+
+def parse_plan_table(detail, aliases):
+    # "SCAN KERNEL" (SQLite >= 3.36, alias only) or "SCAN TABLE CUPTI_ACTIVITY_KIND_KERNEL AS KERNEL"
+    words = detail.split()
+    if len(words) < 2:
+        return None
+    name = words[2] if words[1] == 'TABLE' and len(words) > 2 else words[1]
+    if name.startswith('main.'):
+        return name[len('main.'):]
+    return aliases.get(name, name)
+
+
+def explain_query(conn, query, params, table_names, row_counts):
+    plan = conn.execute("EXPLAIN QUERY PLAN " + query, params).fetchall()
+    steps = []
+    full_scans = []
+    temp_btrees = []
+    automatic_indexes = []
+    estimated_rows_scanned = 0
+    aliases = get_table_aliases(query, table_names)
+    # scoped and chunked queries shadow base tables with a filtered CTE, only the scan of main.<table> reads rows
+    shadowed = {table_name for table_name in table_names
+                if f"{table_name} AS (SELECT * FROM main.{table_name}" in query}
+
+    for _, _, _, detail in plan:
+        steps.append(detail)
+        if detail.startswith('SCAN'):
+            table_name = parse_plan_table(detail, aliases)
+            if table_name in table_names and (table_name not in shadowed or ' main.' in detail):
+                rows = get_table_row_count(conn, table_name, row_counts)
+                estimated_rows_scanned += rows
+                full_scans.append({'Table': table_name, 'Rows': rows, 'Detail': detail})
+        if 'TEMP B-TREE' in detail:
+            temp_btrees.append(detail)
+        if 'AUTOMATIC' in detail and 'INDEX' in detail:
+            automatic_indexes.append(detail)
+
+    return {
+        'Plan': steps,
+        'Full Scans': full_scans,
+        'Temp B-Trees': temp_btrees,
+        'Automatic Indexes': automatic_indexes,
+        'Estimated Rows Scanned': estimated_rows_scanned
+    }
+
+
+def timed_execute(conn, name, query, params, timeout=None, cancel_event=None):
+    state = {'steps': 0, 'rows': 0, 'last_log': time.time(), 'timed_out': False}
+    start_time = time.time()
+
+    def progress_handler():
+        now = time.time()
+        state['steps'] += PROGRESS_STEPS
+        if now - state['last_log'] >= PROGRESS_LOG_INTERVAL:
+            state['last_log'] = now
+            logging.info(f"{name}: {now - start_time:.1f}s elapsed, {state['steps']} VM steps, "
+                         f"{state['rows']} rows returned")
+        if timeout is not None and now - start_time > timeout:
+            state['timed_out'] = True
+            return 1
+        if cancel_event is not None and cancel_event.is_set():
+            return 1
+        return 0
+
+    conn.set_progress_handler(progress_handler, PROGRESS_STEPS)
+    try:
+        cursor = conn.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(FETCH_SIZE)
+            if not rows:
+                break
+            state['rows'] += len(rows)
+    except sqlite3.OperationalError as error:
+        if state['timed_out']:
+            raise QueryTimeout(f"{name} exceeded timeout of {timeout}s")
+        raise error
+    finally:
+        conn.set_progress_handler(None, 0)
+
+    return time.time() - start_time, state['steps'], state['rows']
+
+
+def profile_query(conn, name, query, params, table_names, row_counts, timeout=None, cancel_event=None):
+    report = {'Name': name, 'Parameters': list(params)}
+    report.update(explain_query(conn, query, params, table_names, row_counts))
+
+    try:
+        elapsed, steps, rows_returned = timed_execute(conn, name, query, params, timeout, cancel_event)
+        report['Status'] = 'Completed'
+    except QueryTimeout as error:
+        logging.warning(str(error))
+        elapsed, steps, rows_returned = timeout, None, None
+        report['Status'] = 'Timed Out'
+    except sqlite3.OperationalError as error:
+        logging.warning(f"{name} interrupted: {error}")
+        elapsed, steps, rows_returned = None, None, None
+        report['Status'] = 'Cancelled'
+
+    report['Execution Time (s)'] = round(elapsed, 6) if elapsed is not None else None
+    report['VM Steps'] = steps
+    report['Rows Returned'] = rows_returned
+    if rows_returned:
+        report['Estimated Scan Ratio'] = round(report['Estimated Rows Scanned'] / rows_returned, 2)
+    else:
+        report['Estimated Scan Ratio'] = None
+
+    return report
+
+
+def generate_profiled_queries(database_file, scope=None):
+    # every query in the form extraction runs it, with the scope pushed down, plus the first chunk of the
+    # chunked per-item queries and the MPI queries of the traced MPI and UCX tables
+    profiled_queries = []
+    for name, query, required_tables, summary_query in PROFILED_QUERIES:
+        scoped_query = query if name in UNSCOPED_QUERIES else scope_query(query, scope)
+        if summary_query is not None:
+            summary_query = scope_query(summary_query, scope)
+        profiled_queries.append((name, scoped_query, required_tables, summary_query))
+        if name in CHUNKED_QUERIES and mutiple_table_exists(database_file, required_tables):
+            range_query = chunk_query(query, scope, rowid_ranges(query, database_file), 0, PROFILED_CHUNKS)
+            profiled_queries.append((f"{name} (chunk 1 of {PROFILED_CHUNKS})", range_query, required_tables,
+                                     summary_query))
+
+    tables = mpi_tables(database_file)
+    if tables:
+        first_query, raw_data_query, summary_query = generate_mpi_queries(tables)
+        required_tables = tables + ['StringIds']
+        profiled_queries += [('QUERY_MPI', scope_query(first_query, scope), required_tables, None),
+                             ('QUERY_MPI_STATS', scope_query(raw_data_query, scope), required_tables, None),
+                             ('QUERY_MPI_SUMMARY', scope_query(summary_query, scope), required_tables, None)]
+
+    return profiled_queries
+
+
+def profile_queries(database_file, output_dir, timeout=None, cancel_event=None, time_window=None, nvtx_range=None):
+    logging.info(f"Profiling NAV queries against {database_file}")
+    scope = build_scope(database_file, time_window, nvtx_range)
+    reports = []
+    row_counts = {}
+    summary_first_ids = {}
+
+    conn = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+    try:
+        conn.execute("PRAGMA cache_size=-64000;")
+        conn.execute("PRAGMA temp_store=MEMORY;")
+        table_names = get_table_names(conn)
+
+        for name, query, required_tables, summary_query in generate_profiled_queries(database_file, scope):
+            if cancel_event is not None and cancel_event.is_set():
+                break
+            if not mutiple_table_exists(database_file, required_tables):
+                continue
+
+            params = ()
+            if summary_query is not None:
+                if summary_query not in summary_first_ids:
+                    first_row = conn.execute(summary_query).fetchone()
+                    summary_first_ids[summary_query] = first_row[0] if first_row else None
+                if summary_first_ids[summary_query] is None:
+                    continue
+                params = (summary_first_ids[summary_query],)
+
+            report = profile_query(conn, name, query, params, table_names, row_counts, timeout, cancel_event)
+            reports.append(report)
+
+            flags = []
+            if report['Full Scans']:
+                flags.append("full scan of " + ", ".join(scan['Table'] for scan in report['Full Scans']))
+            if report['Temp B-Trees']:
+                flags.append(f"{len(report['Temp B-Trees'])} temp B-tree(s)")
+            if report['Automatic Indexes']:
+                flags.append(f"{len(report['Automatic Indexes'])} automatic index(es)")
+            logging.info(f"{name}: {report['Status']} in {report['Execution Time (s)']}s, "
+                         f"~{report['Estimated Rows Scanned']} rows scanned (estimated from full scans), "
+                         f"{report['Rows Returned']} returned"
+                         + (" [" + "; ".join(flags) + "]" if flags else ""))
+    finally:
+        conn.close()
+
+    os.makedirs(output_dir, exist_ok=True)
+    report_file = os.path.join(output_dir, 'query_profile.json')
+    logging.info(f"Saving Query Profile of {database_file} to {report_file}")
+    with open(report_file, 'w') as profile_file:
+        json.dump({'Database': database_file, 'Table Rows': row_counts, 'Scope': scope, 'Queries': reports},
+                  profile_file, indent=4)
+
+    return reports
@@ -0,0 +1,259 @@
+import glob
+import json
+import os
+import sqlite3
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import numpy as np
+from absl import app, logging
+
+from helper.backend import open_trace, split_trace_files
+from helper.communication import QUERY_COMMUNICATION, COMMUNICATION_METRIC_VALUES, COMMUNICATION_METRICS, \
+    COMM_REQUIRED_TABLES
+from helper.general import execute_query_in_thread, acquire_worker_pool, release_worker_pool, summary_query, \
+    parse_summary_rows, merge_bucket_rows, generate_summary_statistics, new_metric_accumulator, \
+    fold_metric_statistics, finalize_metric_statistics, QUERY_TOTAL_DURATION, DURATION_REQUIRED_TABLE, NAV_METADATA, \
+    MAX_WORKERS
+from helper.kernel import QUERY_KERNEL, KERNEL_METRIC_VALUES, KERNEL_METRICS, KERNEL_REQUIRED_TABLES
+from helper.mpi import mpi_tables, generate_mpi_queries, MPI_STATISTICS, MPI_ITEMS, QUERY_TABLE_NAMES
+from helper.scope import build_scope, scope_query
+from helper.transfer import QUERY_TRANSFERS, TRANSFER_METRIC_VALUES, TRANSFER_SUMMARY_METRICS, \
+    TRANSFER_REQUIRED_TABLES
+
+RANK_AGGREGATE = 'rank_aggregate'
+RANK_AGGREGATION_METHOD = 'SQLite bucket summaries per rank merged pairwise in a tree, no Raw Data'
+LOAD_IMBALANCE = 'Maximum / mean Time Total over all ranks, ranks without the item count as 0'
+SLOWEST_RANKS = 5
+
+# category, individual key, tables the queries need, first query, metric values of the summary query, metrics
+RANK_CATEGORIES = [
+    ('Kernel Statistics', 'Individual Kernels', KERNEL_REQUIRED_TABLES, QUERY_KERNEL, KERNEL_METRIC_VALUES,
+     KERNEL_METRICS),
+    ('Transfer Statistics', 'Individual Transfers', TRANSFER_REQUIRED_TABLES, QUERY_TRANSFERS, TRANSFER_METRIC_VALUES,
+     TRANSFER_SUMMARY_METRICS),
+    ('Communication Statistics', 'Individual Communications', COMM_REQUIRED_TABLES, QUERY_COMMUNICATION,
+     COMMUNICATION_METRIC_VALUES, COMMUNICATION_METRICS),
+]
+
+
+def rank_files_of(rank_files):
+    # glob patterns and/or .sqlite files and export directories separated by spaces, labelled by file name
+    files = []
+    for entry in split_trace_files(rank_files):
+        matches = sorted(glob.glob(entry)) if glob.has_magic(entry) else [entry]
+        files.extend(path.rstrip(os.sep) for path in matches if path.rstrip(os.sep) not in files)
+    if not files:
+        raise app.UsageError(f"No rank traces match {rank_files}")
+
+    labels = [os.path.splitext(os.path.basename(path))[0] for path in files]
+    if len(set(labels)) != len(labels):
+        labels = [os.path.splitext(path)[0] for path in files]
+    return list(zip(labels, files))
+
+
+def trace_tables(database_file):
+    with sqlite3.connect(database_file) as conn:
+        return {name for name, in conn.execute(QUERY_TABLE_NAMES)}
+
+
+def rank_queries(database_file, precision=0, no_kernel_metrics=False, no_transfer_metrics=False,
+                 no_communication_metrics=False, no_mpi_metrics=False):
+    # (category, individual key, first query, summary query, metrics) for the tables in this rank's trace,
+    # ranks missing a table simply do not contribute to its category
+    tables = trace_tables(database_file)
+    skipped = (no_kernel_metrics, no_transfer_metrics, no_communication_metrics)
+    queries = [(category, individual_key, first_query, summary_query(metric_values, precision), labels)
+               for (category, individual_key, required, first_query, metric_values, labels), skip
+               in zip(RANK_CATEGORIES, skipped) if not skip and all(table in tables for table in required)]
+    if not no_mpi_metrics:
+        operations = mpi_tables(database_file)
+        if operations:
+            query_mpi, _, mpi_summary = generate_mpi_queries(operations, precision)
+            queries.append((MPI_STATISTICS, MPI_ITEMS, query_mpi, mpi_summary, TRANSFER_SUMMARY_METRICS))
+    return queries, tables
+
+
+def item_row(category, row):
+    # (id, name, time total, instances, memory total) of a first query row
+    if category == 'Kernel Statistics':
+        id, _, time_total, instance, name = row
+        return id, name, time_total, instance, None
+    if len(row) == 5:
+        name, _, time_total, memory_total, instance = row
+        return name, name, time_total, instance, memory_total
+    name, _, time_total, instance = row
+    return name, name, time_total, instance, None
+
+
+def rank_summary(label, trace_file, precision=0, time_window=None, nvtx_range=None, no_kernel_metrics=False,
+                 no_transfer_metrics=False, no_communication_metrics=False, no_mpi_metrics=False):
+    # bucket rows and totals of every item of one rank, keyed by name since StringIds differ between ranks
+    summary = {'Ranks': [label], 'Total Duration': {}, 'Categories': {}}
+    with open_trace(trace_file, None, time_window, nvtx_range) as database_file:
+        scope = build_scope(database_file, time_window, nvtx_range)
+        queries, tables = rank_queries(database_file, precision, no_kernel_metrics, no_transfer_metrics,
+                                       no_communication_metrics, no_mpi_metrics)
+        for category, individual_key, first_query, summary_query, labels in queries:
+            rows = execute_query_in_thread((scope_query(first_query, scope), None), database_file)[1]
+            summaries = parse_summary_rows(
+                execute_query_in_thread((scope_query(summary_query, scope), None), database_file)[1], labels)
+            items = summary['Categories'].setdefault(category, {})
+            for row in rows:
+                id, name, time_total, instance, memory_total = item_row(category, row)
+                items[name] = {'Times': {label: time_total}, 'Instance': instance, 'Memory Total': memory_total,
+                               'Buckets': summaries.get(id, {})}
+
+        if scope:
+            summary['Total Duration'][label] = scope['Covered Duration']
+        elif all(table in tables for table in DURATION_REQUIRED_TABLE):
+            summary['Total Duration'][label] = execute_query_in_thread((QUERY_TOTAL_DURATION, None),
+                                                                       database_file)[1][0][0]
+
+    return summary
+
+
+def merge_rank_summaries(first, second):
+    # bucket rows merge by addition, so the tree shape does not change the result
+    merged = {'Ranks': first['Ranks'] + second['Ranks'],
+              'Total Duration': {**first['Total Duration'], **second['Total Duration']},
+              'Categories': first['Categories']}
+    for category, items in second['Categories'].items():
+        merged_items = merged['Categories'].setdefault(category, {})
+        for name, item in items.items():
+            if name not in merged_items:
+                merged_items[name] = item
+                continue
+            target = merged_items[name]
+            target['Times'].update(item['Times'])
+            target['Instance'] += item['Instance']
+            if item['Memory Total'] is not None:
+                target['Memory Total'] = (target['Memory Total'] or 0) + item['Memory Total']
+            for metric, bucket_rows in item['Buckets'].items():
+                target['Buckets'][metric] = merge_bucket_rows([target['Buckets'].get(metric, []), bucket_rows])
+
+    return merged
+
+
+def tree_merge_rank_summaries(rank_files, max_workers=MAX_WORKERS, **options):
+    # at most max_workers ranks are extracted at a time and finished summaries are merged pairwise in the same pool,
+    # so only the summaries in flight and the partial merges are ever held
+    executor = acquire_worker_pool('Rank', max_workers)
+    try:
+        pending_files = list(reversed(rank_files))
+        extracting = {executor.submit(rank_summary, *pending_files.pop(), **options)
+                      for _ in range(min(max_workers, len(pending_files)))}
+        merging = set()
+        ready = []
+        completed = 0
+
+        while extracting or merging:
+            done, _ = wait(extracting | merging, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in extracting:
+                    extracting.discard(future)
+                    completed += 1
+                    if pending_files:
+                        extracting.add(executor.submit(rank_summary, *pending_files.pop(), **options))
+                    if int((completed / len(rank_files)) * 100) % 10 == 0:
+                        logging.info(f"Progress: {completed} of {len(rank_files)} ranks extracted")
+                else:
+                    merging.discard(future)
+                ready.append(future.result())
+            while len(ready) >= 2:
+                merging.add(executor.submit(merge_rank_summaries, ready.pop(), ready.pop()))
+    finally:
+        release_worker_pool(executor)
+
+    return ready[0]
+
+
+def rank_spread(times, ranks):
+    # Time Total of every rank, the ranks without the item spent no time in it
+    values = np.array([times.get(rank, 0) for rank in ranks], dtype=float)
+    mean = values.mean()
+    slowest = sorted(times.items(), key=lambda rank_time: rank_time[1], reverse=True)[:SLOWEST_RANKS]
+    return {
+        'Ranks': len(times),
+        'Rank Time Minimum': float(values.min()),
+        'Rank Time Median': float(np.median(values)),
+        'Rank Time Maximum': float(values.max()),
+        'Load Imbalance': round(float(values.max() / mean), 6) if mean else None,
+        'Slowest Ranks': [[rank, time] for rank, time in slowest],
+    }
+
+
+def rank_statistics(aggregate, precision=0):
+    # NAV statistics of the job in the summary only layout, so every export reads them like a single trace
+    ranks = aggregate['Ranks']
+    full_statistics = {}
+    categories = [(category, individual_key, labels) for category, individual_key, _, _, _, labels in RANK_CATEGORIES]
+    categories.append((MPI_STATISTICS, MPI_ITEMS, TRANSFER_SUMMARY_METRICS))
+
+    for category, individual_key, labels in categories:
+        items = aggregate['Categories'].get(category)
+        if items is None:
+            continue
+        names = list(items)
+        summaries = {name: items[name]['Buckets'] for name in names}
+        category_total = sum(sum(item['Times'].values()) for item in items.values())
+        accumulator = new_metric_accumulator(labels, precision)
+
+        statistics = {}
+        for name, metrics in generate_summary_statistics(summaries, names, labels, precision):
+            item = items[name]
+            time_total = sum(item['Times'].values())
+            statistics[name] = {'Type' if category == 'Transfer Statistics' else 'Name': name,
+                                'Time Percent': round(time_total * 100 / category_total, 1) if category_total else 0.0,
+                                'Time Total': time_total, 'Instance': item['Instance']}
+            if item['Memory Total'] is not None:
+                statistics[name]['Memory Total'] = item['Memory Total']
+            statistics[name].update(metrics)
+            if category in ('Transfer Statistics', MPI_STATISTICS):
+                statistics[name]['Bandwidth Distribution'] = None
+            statistics[name].update(rank_spread(item['Times'], ranks))
+            fold_metric_statistics(accumulator, statistics[name])
+
+        full_statistics[category] = {individual_key: dict(
+            sorted(statistics.items(), key=lambda entry: entry[1]['Time Total'], reverse=True))}
+        for label in labels:
+            convert_bytes = 'Size' in label or 'Bandwidth' in label
+            full_statistics[category].update(finalize_metric_statistics(accumulator[label], label,
+                                                                        convert_bytes=convert_bytes))
+
+    if aggregate['Total Duration']:
+        # ranks run concurrently, the job lasts as long as its longest rank
+        full_statistics['Total Duration'] = max(aggregate['Total Duration'].values())
+    full_statistics[NAV_METADATA] = {
+        'Rank Aggregation': {'Ranks': len(ranks), 'Method': RANK_AGGREGATION_METHOD,
+                             'Load Imbalance': LOAD_IMBALANCE, 'Slowest Ranks': SLOWEST_RANKS},
+        'Summary Only': {'Histogram Buckets': 'Power of 2' if not precision else f'{2 ** precision} per Power of 2'},
+    }
+    return full_statistics
+
+
+def create_rank_statistics(rank_files, output_dir, FLAGS):
+    rank_files = rank_files_of(rank_files)
+    precision = FLAGS.histogram_precision or 0
+    # the pool keeps one size across jobs in daemon mode, the number of ranks only limits what is submitted
+    max_workers = FLAGS.max_workers or MAX_WORKERS
+    logging.info(f"Aggregating {len(rank_files)} rank traces with {min(max_workers, len(rank_files))} workers")
+    if FLAGS.sample_cap or FLAGS.outlier_filter:
+        logging.warning("Rank aggregation only keeps bucket summaries, sampling and outlier filters are not applied")
+
+    aggregate = tree_merge_rank_summaries(
+        rank_files, max_workers, precision=precision, time_window=FLAGS.time_window, nvtx_range=FLAGS.nvtx_range,
+        no_kernel_metrics=FLAGS.no_kernel_metrics, no_transfer_metrics=FLAGS.no_transfer_metrics,
+        no_communication_metrics=FLAGS.no_communication_metrics, no_mpi_metrics=FLAGS.no_mpi_metrics)
+    full_statistics = rank_statistics(aggregate, precision)
+    if FLAGS.histogram_precision is not None:
+        full_statistics[NAV_METADATA]['Log Histograms'] = {'Precision': precision,
+                                                          'Buckets per Power of 2': 2 ** precision,
+                                                          'Relative Bucket Width': 2 ** -precision}
+
+    if not FLAGS.no_save_data:
+        database_file_NAV = output_dir + RANK_AGGREGATE + '_parsed_stats.nav'
+        logging.info(f"Saving Aggregated Statistics of {len(rank_files)} ranks to {database_file_NAV}")
+        with open(database_file_NAV, 'w') as NAV_file:
+            json.dump(full_statistics, NAV_file, indent=4)
+
+    return full_statistics
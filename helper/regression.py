@@ -0,0 +1,215 @@
+import json
+import os
+
+import numpy as np
+from absl import logging
+
+from helper.general import NAV_METADATA, bucket_rows_from_values
+
+# (individual items key, metric tested) for each statistics category
+REGRESSION_METRICS = {
+    'Kernel Statistics': ('Individual Kernels', 'Execution Duration'),
+    'Transfer Statistics': ('Individual Transfers', 'Transfer Durations'),
+    'Communication Statistics': ('Individual Communications', 'Execution Duration'),
+    'MPI Statistics': ('Individual MPI Operations', 'Transfer Durations'),
+}
+
+MIN_SAMPLES = 8  # fewer samples than this on either side are not tested
+REGRESSION_EXIT_CODE = 3
+CORRECTION_METHODS = ['bh', 'bonferroni', 'none']
+
+
+def item_name(id, item):
+    # kernel ids are StringIds rows and differ between traces, names do not
+    return item.get('Name') or item.get('Type') or str(id)
+
+
+def items_by_name(statistics, category):
+    individual_key, _ = REGRESSION_METRICS[category]
+    items = statistics.get(category, {}).get(individual_key, {})
+    return {item_name(id, item): item for id, item in items.items()}
+
+
+def histogram_precision_of(statistics):
+    # summary only and chunked items without histogram mode are on the power-of-2 grid
+    return (statistics.get(NAV_METADATA, {}).get('Log Histograms') or {}).get('Precision') or 0
+
+
+def bucket_counts(stats, precision, common_precision):
+    # counts per bucket of the coarser grid of both traces, a finer bucket lies inside exactly one coarser one
+    bucket_rows = stats.get('Buckets') or bucket_rows_from_values(stats.get('Raw Data') or [], common_precision)
+    if not stats.get('Buckets'):
+        precision = common_precision
+    counts = {}
+    for bucket, count, *_ in bucket_rows:
+        bucket = bucket // 2 ** (precision - common_precision)
+        counts[bucket] = counts.get(bucket, 0) + count
+    return counts
+
+
+def grouped_mannwhitneyu(candidate_counts, baseline_counts):
+    # Mann-Whitney U with every bucket as one group of ties, normal approximation with tie and continuity correction
+    from scipy.stats import norm
+    buckets = sorted(set(candidate_counts) | set(baseline_counts))
+    candidate = np.array([candidate_counts.get(bucket, 0) for bucket in buckets], dtype=float)
+    baseline = np.array([baseline_counts.get(bucket, 0) for bucket in buckets], dtype=float)
+    candidate_size, baseline_size = candidate.sum(), baseline.sum()
+    size = candidate_size + baseline_size
+
+    u_statistic = float(np.sum(candidate * (np.cumsum(baseline) - baseline / 2)))
+    ties = candidate + baseline
+    variance = candidate_size * baseline_size / 12 * (size + 1 - np.sum(ties ** 3 - ties) / (size * (size - 1)))
+    if variance <= 0:
+        return u_statistic, 1.0
+    z = max(abs(u_statistic - candidate_size * baseline_size / 2) - 0.5, 0) / np.sqrt(variance)
+    return u_statistic, float(min(2 * norm.sf(z), 1.0))
+
+
+def relative_change(baseline, candidate):
+    if baseline is None or candidate is None or baseline == 0:
+        return None
+    return round((candidate - baseline) / abs(baseline), 6)
+
+
+def adjust_p_values(p_values, correction='bh'):
+    p_values = np.asarray(p_values, dtype=float)
+    if not len(p_values) or correction == 'none':
+        return p_values
+    if correction == 'bonferroni':
+        return np.minimum(p_values * len(p_values), 1.0)
+
+    # Benjamini-Hochberg step-up, monotone from the largest p-value down
+    order = np.argsort(p_values)
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    adjusted = np.minimum.accumulate(ranked[::-1])[::-1]
+    result = np.empty_like(adjusted)
+    result[order] = np.minimum(adjusted, 1.0)
+    return result
+
+
+def compare_item(category, name, baseline_item, candidate_item, label, precisions=(0, 0)):
+    from scipy.stats import mannwhitneyu
+    baseline_stats = baseline_item.get(label)
+    candidate_stats = candidate_item.get(label)
+    comparison = {
+        'Category': category,
+        'Name': name,
+        'Metric': label,
+        'Baseline Median': baseline_stats.get('Median') if isinstance(baseline_stats, dict) else None,
+        'Candidate Median': candidate_stats.get('Median') if isinstance(candidate_stats, dict) else None,
+        'Baseline Time Total': baseline_item.get('Time Total'),
+        'Candidate Time Total': candidate_item.get('Time Total'),
+        'Baseline Instances': baseline_item.get('Instance'),
+        'Candidate Instances': candidate_item.get('Instance'),
+    }
+    comparison['Median Change'] = relative_change(comparison['Baseline Median'], comparison['Candidate Median'])
+    comparison['Time Total Change'] = relative_change(comparison['Baseline Time Total'],
+                                                      comparison['Candidate Time Total'])
+
+    baseline_raw = baseline_stats.get('Raw Data') if isinstance(baseline_stats, dict) else None
+    candidate_raw = candidate_stats.get('Raw Data') if isinstance(candidate_stats, dict) else None
+    if baseline_raw and candidate_raw:
+        if min(len(baseline_raw), len(candidate_raw)) < MIN_SAMPLES:
+            comparison['Reason'] = f'Fewer than {MIN_SAMPLES} samples'
+            return comparison
+        u_statistic, p_value = mannwhitneyu(candidate_raw, baseline_raw, alternative='two-sided')
+        comparison['Test Data'] = 'Raw Data'
+        sizes = len(candidate_raw), len(baseline_raw)
+    else:
+        # summary only, chunked and sampled-out items are tested on their log bucket counts
+        if not all(isinstance(stats, dict) and (stats.get('Raw Data') or stats.get('Buckets'))
+                   for stats in (baseline_stats, candidate_stats)):
+            comparison['Reason'] = 'No Raw Data or Buckets'
+            return comparison
+        common_precision = min(precisions)
+        baseline_counts = bucket_counts(baseline_stats, precisions[0], common_precision)
+        candidate_counts = bucket_counts(candidate_stats, precisions[1], common_precision)
+        sizes = sum(candidate_counts.values()), sum(baseline_counts.values())
+        if min(sizes) < MIN_SAMPLES:
+            comparison['Reason'] = f'Fewer than {MIN_SAMPLES} samples'
+            return comparison
+        u_statistic, p_value = grouped_mannwhitneyu(candidate_counts, baseline_counts)
+        comparison['Test Data'] = 'Buckets'
+
+    comparison['U Statistic'] = float(u_statistic)
+    comparison['P Value'] = float(p_value)
+    # probability a candidate sample is slower than a baseline sample, 0.5 means no shift
+    comparison['Probability Candidate Slower'] = round(float(u_statistic) / (sizes[0] * sizes[1]), 6)
+
+    return comparison
+
+
+def regression_check(baseline, candidate, labels, output_dir, alpha=0.05, threshold=0.05, correction='bh'):
+    logging.info(f"Checking {labels[1]} (candidate) against {labels[0]} (baseline) for regressions")
+    tested = []
+    skipped = []
+    added = []
+    removed = []
+    precisions = histogram_precision_of(baseline), histogram_precision_of(candidate)
+
+    for category, (_, label) in REGRESSION_METRICS.items():
+        baseline_items = items_by_name(baseline, category)
+        candidate_items = items_by_name(candidate, category)
+
+        for name, baseline_item in baseline_items.items():
+            if name not in candidate_items:
+                removed.append({'Category': category, 'Name': name})
+                continue
+            comparison = compare_item(category, name, baseline_item, candidate_items[name], label, precisions)
+            (tested if 'P Value' in comparison else skipped).append(comparison)
+        added.extend({'Category': category, 'Name': name} for name in candidate_items if name not in baseline_items)
+
+    adjusted = adjust_p_values([comparison['P Value'] for comparison in tested], correction)
+    regressions = []
+    improvements = []
+    unchanged = []
+
+    for comparison, adjusted_p_value in zip(tested, adjusted):
+        comparison['Adjusted P Value'] = float(adjusted_p_value)
+        change = comparison['Median Change']
+        significant = adjusted_p_value < alpha and change is not None
+        if significant and change >= threshold:
+            regressions.append(comparison)
+        elif significant and change <= -threshold:
+            improvements.append(comparison)
+        else:
+            unchanged.append(comparison)
+
+    regressions.sort(key=lambda comparison: comparison['Median Change'], reverse=True)
+    improvements.sort(key=lambda comparison: comparison['Median Change'])
+    gate_failed = bool(regressions)
+
+    report = {
+        'Baseline': labels[0],
+        'Candidate': labels[1],
+        'Test': 'Mann-Whitney U (two-sided) on Raw Data, on log bucket counts for items without Raw Data',
+        'Correction': correction,
+        'Alpha': alpha,
+        'Median Change Threshold': threshold,
+        'Gate': 'Failed' if gate_failed else 'Passed',
+        'Regressions': regressions,
+        'Improvements': improvements,
+        'Unchanged': unchanged,
+        'Skipped': skipped,
+        'Added': added,
+        'Removed': removed,
+    }
+
+    os.makedirs(output_dir, exist_ok=True)
+    report_file = os.path.join(output_dir, 'regression_report.json')
+    logging.info(f"Saving Regression Report to {report_file}")
+    with open(report_file, 'w') as regression_file:
+        json.dump(report, regression_file, indent=4)
+
+    for comparison in regressions:
+        logging.warning(f"Regression: {comparison['Category']} {comparison['Name']} median "
+                        f"{comparison['Median Change'] * 100:+.1f}% (adjusted p={comparison['Adjusted P Value']:.3g})")
+    if skipped:
+        logging.warning(f"{len(skipped)} common items could not be tested and are listed under Skipped in {report_file}: "
+                        + ', '.join(f"{comparison['Name']} ({comparison['Reason']})" for comparison in skipped[:10])
+                        + (', ...' if len(skipped) > 10 else ''))
+    logging.info(f"Regression check {report['Gate']}: {len(regressions)} regressions, {len(improvements)} "
+                 f"improvements, {len(unchanged)} unchanged, {len(skipped)} not tested out of "
+                 f"{len(tested) + len(skipped)} common items")
+
+    return gate_failed
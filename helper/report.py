@@ -0,0 +1,216 @@
+import html
+import json
+import os
+
+import numpy as np
+from absl import logging
+
+from helper.general import NAV_METADATA, NON_CATEGORY_KEYS, quantile_from_buckets
+from helper.memory import load_spilled_item
+
+REPORT_QUANTILES = [0.05, 0.25, 0.75, 0.95]
+REPORT_FILE = 'report.html'
+
+REPORT_HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ font-family: sans-serif; margin: 1em 2em; color: #222; }}
+h2 {{ margin-top: 1.5em; border-bottom: 1px solid #ccc; }}
+table {{ border-collapse: collapse; font-size: 13px; margin: 0.5em 0; }}
+th, td {{ padding: 2px 8px; text-align: right; border-bottom: 1px solid #eee; white-space: nowrap; }}
+th {{ cursor: pointer; background: #f4f4f4; position: sticky; top: 0; }}
+td:first-child, th:first-child {{ text-align: left; max-width: 40em; overflow: hidden; text-overflow: ellipsis; }}
+tr.item {{ cursor: pointer; }}
+tr.item:hover {{ background: #eef4ff; }}
+.detail {{ display: flex; flex-wrap: wrap; gap: 1.5em; padding: 0.5em 0 1em 1em; }}
+.metric h4 {{ margin: 0.3em 0; font-size: 13px; }}
+input {{ margin: 0.3em 0; width: 30em; }}
+rect.bar {{ fill: #4c72b0; }}
+rect.box {{ fill: #dd8452; fill-opacity: 0.5; stroke: #dd8452; }}
+line.whisker {{ stroke: #555; }}
+</style>
+</head>
+<body>
+<h1>{title}</h1>
+"""
+
+REPORT_TAIL = """<script>
+const QUANTILES = ['Minimum', 'Q05', 'Q25', 'Median', 'Q75', 'Q95', 'Maximum'];
+function si(value) {
+  if (value === null || value === undefined) return '';
+  const magnitude = Math.abs(value);
+  for (const [scale, suffix] of [[1e12, 'T'], [1e9, 'G'], [1e6, 'M'], [1e3, 'K']])
+    if (magnitude >= scale) return (value / scale).toFixed(2) + suffix;
+  return Number.isInteger(value) ? String(value) : value.toFixed(2);
+}
+function element(tag, attributes, text) {
+  const node = document.createElement(tag);
+  for (const [key, value] of Object.entries(attributes || {})) node.setAttribute(key, value);
+  if (text !== undefined) node.textContent = text;
+  return node;
+}
+function svgElement(tag, attributes) {
+  const node = document.createElementNS('http://www.w3.org/2000/svg', tag);
+  for (const [key, value] of Object.entries(attributes)) node.setAttribute(key, value);
+  return node;
+}
+function histogram(metric) {
+  const width = 320, height = 110, counts = metric.Histogram || [];
+  const svg = svgElement('svg', {width: width, height: height + 20});
+  const maximum = Math.max(1, ...counts), barWidth = width / Math.max(1, counts.length);
+  counts.forEach((count, index) => {
+    const barHeight = height * count / maximum;
+    const bar = svgElement('rect', {class: 'bar', x: index * barWidth + 1, y: height - barHeight,
+                                    width: barWidth - 2, height: barHeight});
+    bar.appendChild(svgElement('title', {})).textContent = (metric['Bin Labels'] || [])[index] + ': ' + count;
+    svg.appendChild(bar);
+  });
+  const q = QUANTILES.map(name => metric[name]);
+  if (q.every(value => value !== null && value !== undefined) && q[6] > q[0]) {
+    const x = value => width * (value - q[0]) / (q[6] - q[0]);
+    svg.appendChild(svgElement('line', {class: 'whisker', x1: x(q[1]), x2: x(q[5]), y1: height + 10, y2: height + 10}));
+    svg.appendChild(svgElement('rect', {class: 'box', x: x(q[2]), y: height + 4, width: Math.max(1, x(q[4]) - x(q[2])), height: 12}));
+    svg.appendChild(svgElement('line', {class: 'whisker', x1: x(q[3]), x2: x(q[3]), y1: height + 2, y2: height + 18}));
+  }
+  return svg;
+}
+function metricDetail(name, metric) {
+  const box = element('div', {class: 'metric'});
+  box.appendChild(element('h4', {}, name));
+  const table = element('table');
+  for (const key of ['Count', 'Mean', 'Standard Deviation'].concat(QUANTILES))
+    if (metric[key] !== undefined && metric[key] !== null) {
+      const row = table.insertRow();
+      row.appendChild(element('td', {}, key));
+      row.appendChild(element('td', {}, si(metric[key])));
+    }
+  box.appendChild(table);
+  box.appendChild(histogram(metric));
+  return box;
+}
+function renderCategory(script) {
+  const data = JSON.parse(script.textContent), section = script.parentNode;
+  const metrics = Object.keys(data.General);
+  const general = element('div', {class: 'detail'});
+  metrics.forEach(metric => general.appendChild(metricDetail(metric, data.General[metric])));
+  section.appendChild(general);
+  if (!data.Items.length) return;
+  const filter = element('input', {placeholder: 'Filter ' + data.Items.length + ' items by name'});
+  section.appendChild(filter);
+  const table = element('table'), head = table.createTHead().insertRow(), body = table.createTBody();
+  const columns = ['Name', 'Time Percent', 'Time Total', 'Instance'].concat(metrics.map(metric => metric + ' Median'));
+  const value = (item, column) => column.endsWith(' Median') && column !== 'Median'
+    ? (item.Metrics[column.slice(0, -7)] || {}).Median : item[column];
+  let order = 1;
+  columns.forEach(column => {
+    const header = element('th', {}, column);
+    header.onclick = () => { order = -order; data.Items.sort((a, b) => ((value(a, column) > value(b, column)) - (value(a, column) < value(b, column))) * order); draw(); };
+    head.appendChild(header);
+  });
+  function draw() {
+    body.replaceChildren();
+    const pattern = filter.value.toLowerCase();
+    for (const item of data.Items) {
+      if (pattern && !String(item.Name).toLowerCase().includes(pattern)) continue;
+      const row = body.insertRow();
+      row.className = 'item';
+      columns.forEach(column => row.appendChild(element('td', {}, column === 'Name' ? item.Name : si(value(item, column)))));
+      row.onclick = () => {
+        if (row.nextSibling && row.nextSibling.className === 'expanded') { row.nextSibling.remove(); return; }
+        const detail = element('tr', {class: 'expanded'}), cell = element('td', {colspan: columns.length});
+        const box = element('div', {class: 'detail'});
+        for (const [metric, stats] of Object.entries(item.Metrics)) box.appendChild(metricDetail(metric, stats));
+        cell.appendChild(box);
+        detail.appendChild(cell);
+        row.after(detail);
+      };
+    }
+  }
+  filter.oninput = draw;
+  draw();
+  section.appendChild(table);
+}
+document.querySelectorAll('script.nav-category').forEach(renderCategory);
+</script>
+</body>
+</html>
+"""
+
+
+def to_json(value):
+    # keeps the embedded data from closing its script element
+    return json.dumps(value, separators=(',', ':')).replace('</', '<\\/')
+
+
+def rounded(value):
+    return round(float(value), 6) if value is not None else None
+
+
+def metric_summary(stats):
+    summary = {'Count': stats.get('Count') or (len(stats['Raw Data']) if stats.get('Raw Data') else None)}
+    for key in ['Mean', 'Standard Deviation', 'Minimum', 'Median', 'Maximum']:
+        summary[key] = rounded(stats.get(key))
+
+    if stats.get('Raw Data'):
+        quantiles = np.quantile(stats['Raw Data'], REPORT_QUANTILES)
+    elif stats.get('Buckets'):
+        quantiles = [quantile_from_buckets(stats['Buckets'], quantile) for quantile in REPORT_QUANTILES]
+    else:
+        quantiles = [None] * len(REPORT_QUANTILES)
+    summary.update({f'Q{int(quantile * 100):02d}': rounded(value) for quantile, value in zip(REPORT_QUANTILES, quantiles)})
+
+    distribution = stats.get('Distribution')
+    if isinstance(distribution, dict):
+        summary['Histogram'] = distribution.get('Histogram')
+        summary['Bin Labels'] = distribution.get('Bin Labels')
+    return summary
+
+
+def metric_summaries(statistics):
+    return {metric: metric_summary(stats) for metric, stats in statistics.items()
+            if isinstance(stats, dict) and 'Mean' in stats}
+
+
+def item_summary(id, item):
+    item = load_spilled_item(item)
+    return {'Name': item.get('Name') or item.get('Type') or str(id), 'Time Percent': item.get('Time Percent'),
+            'Time Total': item.get('Time Total'), 'Instance': item.get('Instance'), 'Metrics': metric_summaries(item)}
+
+
+def write_category(report_file, trace_label, category, category_stats):
+    report_file.write(f'<section>\n<h2>{html.escape(trace_label + category)}</h2>\n')
+    report_file.write('<script type="application/json" class="nav-category">')
+    report_file.write('{"General":' + to_json(metric_summaries(category_stats)) + ',"Items":[')
+
+    items = next((items for key, items in category_stats.items() if key.startswith('Individual')), {})
+    for index, (id, item) in enumerate(items.items()):
+        report_file.write((',' if index else '') + to_json(item_summary(id, item)) + '\n')
+    report_file.write(']}</script>\n</section>\n')
+    return len(items)
+
+
+def write_html_report(data_dict, output_dir, multiple_traces=False, title='NAV Report'):
+    # one pass over the statistics, every item is summarized and written before the next one is read
+    os.makedirs(output_dir, exist_ok=True)
+    report_file_name = os.path.join(output_dir, REPORT_FILE)
+    traces = data_dict.items() if multiple_traces else [('', data_dict)]
+    item_count = 0
+
+    with open(report_file_name, 'w') as report_file:
+        report_file.write(REPORT_HEAD.format(title=html.escape(title)))
+        for label, statistics in traces:
+            trace_label = f'{label}: ' if label else ''
+            if 'Total Duration' in statistics:
+                report_file.write(f'<p>{html.escape(trace_label)}Total Duration {statistics["Total Duration"]} ns'
+                                  + (f', {html.escape(json.dumps(statistics[NAV_METADATA]))}'
+                                     if NAV_METADATA in statistics else '') + '</p>\n')
+            for category, category_stats in statistics.items():
+                if category not in NON_CATEGORY_KEYS and isinstance(category_stats, dict):
+                    item_count += write_category(report_file, trace_label, category, category_stats)
+        report_file.write(REPORT_TAIL)
+
+    logging.info(f"Saved HTML Report of {item_count} items to {report_file_name}")
+    return report_file_name
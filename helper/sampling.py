@@ -0,0 +1,62 @@
+import math
+
+from helper.general import statistics_from_moments, moments_from_buckets
+
+SAMPLE_QUERY = """
+SELECT
+    *
+FROM (
+    SELECT
+        *,
+        ROW_NUMBER() OVER (ORDER BY "Start") AS sample_row
+    FROM ({query})
+)
+WHERE
+    (sample_row - 1) % ? = 0
+"""
+
+SAMPLING_METHOD = 'Systematic row stride per item in start time order'
+
+
+def sample_query(query):
+    return SAMPLE_QUERY.format(query=query)
+
+
+def sample_stride(instances, sample_cap):
+    return max(1, math.ceil(instances / sample_cap))
+
+
+def generate_sampled_queries(query, ids, statistics, sample_cap):
+    queries = []
+    sampled_query = sample_query(query)
+
+    for id in ids:
+        stride = sample_stride(statistics[id]['Instance'], sample_cap)
+        statistics[id]['Sample Rate'] = round(1 / stride, 6)
+        queries.append((sampled_query, (id, stride)))
+
+    return queries
+
+
+def sample_groups(groups, statistics, sample_cap):
+    # the stride of generate_sampled_queries applied to rows already grouped by id, in start order
+    sampled = {}
+    for id, rows in groups.items():
+        stride = sample_stride(statistics[id]['Instance'], sample_cap)
+        statistics[id]['Sample Rate'] = round(1 / stride, 6)
+        sampled[id] = sorted(rows, key=lambda row: row[-1])[::stride]
+
+    return sampled
+
+
+def apply_exact_statistics(item, summary, labels):
+    for label in labels:
+        if isinstance(item.get(label), dict) and summary.get(label):
+            if 'Raw Data' in item[label]:
+                sample_count = len(item[label]['Raw Data'])
+            else:
+                sample_count = item[label]['Count']
+            item[label].update(statistics_from_moments(*moments_from_buckets(summary[label])))
+            item[label]['Sample Count'] = sample_count
+
+    return item
@@ -0,0 +1,190 @@
+import heapq
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED, as_completed
+from pathlib import Path
+
+from absl import logging
+
+from helper.general import MAX_WORKERS, execute_query, acquire_worker_pool, release_worker_pool
+from helper.memory import estimate_result_bytes, in_flight_allowed
+
+TASK_OVERHEAD = 2000  # fixed cost of one task (connection, query planning, IPC) expressed in rows
+BATCHES_PER_WORKER = 8  # tiny items are packed until a batch reaches 1/(workers * BATCHES_PER_WORKER) of the work
+
+WORKER_CONNECTIONS = {}  # read-only trace connections kept open by each query worker
+
+
+def estimate_query_cost(instances, sample_cap=None):
+    rows = min(instances, sample_cap) if sample_cap else instances
+    return TASK_OVERHEAD + rows
+
+
+def simulate_makespan(task_costs, num_workers):
+    workers = [0] * num_workers
+    for cost in task_costs:
+        heapq.heappush(workers, heapq.heappop(workers) + cost)
+    return max(workers)
+
+
+def schedule_queries(queries_with_params, costs, num_workers=MAX_WORKERS):
+    total_cost = sum(costs)
+    batch_target = max(total_cost / (num_workers * BATCHES_PER_WORKER), 2 * TASK_OVERHEAD)
+
+    tasks = []
+    batch = []
+    batch_cost = 0
+    for cost, query_params in sorted(zip(costs, queries_with_params), key=lambda task: task[0], reverse=True):
+        if cost >= batch_target:
+            tasks.append((cost, [query_params]))
+            continue
+        batch.append(query_params)
+        batch_cost += cost
+        if batch_cost >= batch_target:
+            tasks.append((batch_cost, batch))
+            batch = []
+            batch_cost = 0
+    if batch:
+        tasks.append((batch_cost, batch))
+
+    # Longest processing time first
+    tasks.sort(key=lambda task: task[0], reverse=True)
+
+    if tasks:
+        makespan = simulate_makespan([cost for cost, _ in tasks], num_workers)
+        ideal = total_cost / num_workers
+        logging.info(f"Scheduled {len(queries_with_params)} queries as {len(tasks)} tasks largest first, "
+                     f"planned load balance {ideal / makespan * 100:.1f}%")
+
+    return tasks
+
+
+def get_worker_connection(database_file):
+    stat = os.stat(database_file)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = WORKER_CONNECTIONS.get(database_file)
+    if cached and cached[0] == version:
+        return cached[1]
+    if cached:
+        cached[1].close()
+
+    conn = sqlite3.connect(Path(database_file).as_uri() + "?mode=ro", uri=True)
+    conn.execute("PRAGMA cache_size=-64000;")  # Increase cache size (~64MB)
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    WORKER_CONNECTIONS[database_file] = (version, conn)
+    return conn
+
+
+def execute_query_batch(batch, database_file):
+    start_time = time.time()
+    results = []
+    conn = get_worker_connection(database_file)
+    for query_params in batch:
+        try:
+            results.append(execute_query(conn, *query_params[:2]))
+        except sqlite3.Error as error:
+            # a missing result would silently drop the item's metrics and leave its other chunks unmerged
+            params = query_params[1]
+            logging.error(f"Query of {params[0] if isinstance(params, tuple) else params} failed: {error}")
+            raise
+    return results, os.getpid(), time.time() - start_time
+
+
+def parse_batch(parse_functions, results):
+    start_time = time.time()
+    parsed = [parse_function(data) for parse_function, data in zip(parse_functions, results)]
+    return parsed, os.getpid(), time.time() - start_time
+
+
+def report_load_balance(stage, busy_times, num_workers=MAX_WORKERS):
+    if not busy_times:
+        return None
+
+    num_workers = max(num_workers, len(busy_times))
+    busiest = max(busy_times.values())
+    mean = sum(busy_times.values()) / num_workers
+    balance = mean / busiest * 100 if busiest > 0 else 100.0
+    logging.info(f"{stage} load balance: {len(busy_times)}/{num_workers} workers used, busiest {busiest:.2f}s, "
+                 f"mean {mean:.2f}s ({balance:.1f}% balanced)")
+
+    return balance
+
+
+def stream_parsed_queries(queries_with_params, database_file, parse_function, costs=None, max_buffered=None,
+                          memory_budget=None):
+    # Query results flow straight into the parse pool, at most max_buffered raw results are held at once;
+    # a query may carry its own parse function as a third element; with a memory budget new batches also wait
+    # until their estimated result size fits next to the results already in flight
+    max_buffered = max_buffered or 2 * MAX_WORKERS
+    database_file = os.path.abspath(database_file)
+    total_queries = len(queries_with_params)
+    if costs is None:
+        costs = [TASK_OVERHEAD] * total_queries
+    completed_tasks = 0
+    pending_tasks = deque(schedule_queries(queries_with_params, costs))
+    in_flight_bytes = 0
+    query_futures = {}
+    parse_futures = {}
+    query_busy = {}
+    parse_busy = {}
+
+    query_executor = acquire_worker_pool('Query')
+    parse_executor = acquire_worker_pool('Parse')
+
+    def submit_queries():
+        nonlocal in_flight_bytes
+        while pending_tasks and len(query_futures) + len(parse_futures) < max_buffered:
+            cost, batch = pending_tasks[0]
+            task_bytes = estimate_result_bytes(cost)
+            if not in_flight_allowed(memory_budget, in_flight_bytes, task_bytes):
+                break
+            pending_tasks.popleft()
+            in_flight_bytes += task_bytes
+            future = query_executor.submit(execute_query_batch, batch, database_file)
+            query_futures[future] = (batch, task_bytes)
+
+    try:
+        submit_queries()
+        while query_futures or parse_futures:
+            done, _ = wait(set(query_futures) | set(parse_futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                results, pid, elapsed = future.result()
+                if future in query_futures:
+                    batch, task_bytes = query_futures.pop(future)
+                    query_busy[pid] = query_busy.get(pid, 0) + elapsed
+                    parse_functions = [query_params[2] if len(query_params) > 2 else parse_function
+                                       for query_params in batch]
+                    parse_futures[parse_executor.submit(parse_batch, parse_functions, results)] = task_bytes
+                else:
+                    in_flight_bytes -= parse_futures.pop(future)
+                    parse_busy[pid] = parse_busy.get(pid, 0) + elapsed
+                    for result in results:
+                        completed_tasks += 1
+                        if int((completed_tasks / total_queries) * 100) % 10 == 0:
+                            logging.info(f"Progress: {(completed_tasks / total_queries) * 100:.1f}%")
+                        yield result
+            submit_queries()
+    finally:
+        release_worker_pool(query_executor)
+        release_worker_pool(parse_executor)
+
+    report_load_balance("Query", query_busy)
+    report_load_balance("Parse", parse_busy)
+
+
+def stream_parsed_groups(groups, parse_function):
+    # rows fetched in one pass and grouped by id, every group is parsed in the pool like the result of its own query
+    parse_busy = {}
+    parse_executor = acquire_worker_pool('Parse')
+    try:
+        futures = [parse_executor.submit(parse_batch, [parse_function], [(id, rows)]) for id, rows in groups.items()]
+        for future in as_completed(futures):
+            results, pid, elapsed = future.result()
+            parse_busy[pid] = parse_busy.get(pid, 0) + elapsed
+            yield from results
+    finally:
+        release_worker_pool(parse_executor)
+
+    report_load_balance("Parse", parse_busy)
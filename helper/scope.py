@@ -0,0 +1,154 @@
+import sqlite3
+
+from absl import logging, app
+
+from helper.general import execute_query_in_thread, mutiple_table_exists, QUERY_TOTAL_DURATION, \
+    DURATION_REQUIRED_TABLE
+
+QUERY_NVTX_RANGES = """
+SELECT
+    ne.start AS range_start,
+    ne.end AS range_end
+FROM
+    NVTX_EVENTS AS ne
+LEFT OUTER JOIN
+    StringIds AS sid
+    ON ne.textId = sid.id
+WHERE
+    ne.eventType IN (59, 60, 70, 71)
+    AND ne.end IS NOT NULL
+    AND coalesce(sid.value, ne.text) IN ({names})
+ORDER BY 1
+"""
+
+NVTX_RANGE_REQUIRED_TABLES = ['NVTX_EVENTS', 'StringIds']
+
+# Tables shadowed by a filtered CTE of the same name, queries read trace-wide rows such as NVTX domain definitions
+# and the trace end from main.<table> so the filter never hides them
+SCOPED_TABLES = [
+    'CUPTI_ACTIVITY_KIND_KERNEL',
+    'CUPTI_ACTIVITY_KIND_MEMCPY',
+    'CUPTI_ACTIVITY_KIND_MEMSET',
+    'MPI_P2P_EVENTS',
+    'MPI_COLLECTIVES_EVENTS',
+    'UCP_SUBMIT_EVENTS',
+    'NVTX_EVENTS',
+]
+
+
+def sql_string(value):
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def merge_intervals(intervals):
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+def intersect_intervals(intervals, window_start, window_end):
+    clipped = []
+    for start, end in intervals:
+        start = max(start, window_start)
+        end = min(end, window_end)
+        if start < end:
+            clipped.append([start, end])
+    return clipped
+
+
+def parse_time_window(time_window):
+    try:
+        window_start, window_end = [value.strip() for value in time_window.split(',')]
+        window_start = int(float(window_start)) if window_start else 0
+        window_end = int(float(window_end)) if window_end else None
+    except ValueError:
+        raise app.UsageError("Time window must be provided as \"start,end\" in trace nanoseconds")
+
+    if window_end is not None and window_end <= window_start:
+        raise app.UsageError("Time window end must be greater than its start")
+
+    return window_start, window_end
+
+
+def build_scope(database_file, time_window=None, nvtx_range=None):
+    if not time_window and not nvtx_range:
+        return None
+
+    trace_end = None
+    if mutiple_table_exists(database_file, DURATION_REQUIRED_TABLE):
+        trace_end = execute_query_in_thread((QUERY_TOTAL_DURATION, None), database_file)[1][0][0]
+
+    window_start, window_end = parse_time_window(time_window) if time_window else (0, None)
+    if window_end is None:
+        window_end = trace_end if trace_end is not None else 2 ** 63 - 1
+
+    intervals = [[window_start, window_end]]
+    range_names = []
+
+    if nvtx_range:
+        range_names = [name.strip() for name in nvtx_range.split(',') if name.strip()]
+        if not mutiple_table_exists(database_file, NVTX_RANGE_REQUIRED_TABLES):
+            raise app.UsageError("NVTX range scoping was requested but the trace has no NVTX_EVENTS")
+        query = QUERY_NVTX_RANGES.format(names=", ".join(sql_string(name) for name in range_names))
+        with sqlite3.connect(database_file) as conn:
+            ranges = conn.execute(query).fetchall()
+        if not ranges:
+            raise app.UsageError(f"No NVTX ranges named {', '.join(range_names)} found in {database_file}")
+        intervals = intersect_intervals(merge_intervals(ranges), window_start, window_end)
+
+    covered_duration = sum(end - start for start, end in intervals)
+    logging.info(f"Restricting extraction to {len(intervals)} interval(s) covering {covered_duration} ns")
+
+    return {
+        'Time Window': [window_start, window_end],
+        'NVTX Ranges': range_names,
+        'Intervals': intervals,
+        'Covered Duration': covered_duration
+    }
+
+
+def interval_condition(column, boundaries):
+    # boundaries alternate start/end, a value is inside when an odd number of boundaries are <= value;
+    # a balanced CASE tree keeps the test at O(log n) comparisons per row
+    def build(low, high):
+        if high - low == 1:
+            return '1' if low % 2 == 0 else '0'
+        middle = (low + high) // 2
+        return f"CASE WHEN {column} < {boundaries[middle]} THEN {build(low, middle)} ELSE {build(middle, high)} END"
+
+    if len(boundaries) == 2:
+        return f"({column} >= {boundaries[0]} AND {column} < {boundaries[1]})"
+    return f"({column} >= {boundaries[0]} AND {build(0, len(boundaries))} = 1)"
+
+
+def scope_condition(scope, column='start'):
+    if not scope['Intervals']:
+        return '0'
+    boundaries = [int(boundary) for interval in scope['Intervals'] for boundary in interval]
+    return interval_condition(column, boundaries)
+
+
+def shadow_tables(query, conditions):
+    # conditions maps table names to the filter of their shadowing CTE, later CTEs may refer to earlier ones
+    ctes = [f"{table_name} AS (SELECT * FROM main.{table_name} WHERE {condition})"
+            for table_name, condition in conditions.items()]
+
+    if not ctes:
+        return query
+
+    stripped_query = query.lstrip()
+    if stripped_query[:4].upper() == 'WITH':
+        return "WITH\n    " + ",\n    ".join(ctes) + "," + stripped_query[4:]
+    return "WITH\n    " + ",\n    ".join(ctes) + "\n" + stripped_query
+
+
+def scope_query(query, scope):
+    if not scope:
+        return query
+
+    condition = scope_condition(scope)
+    return shadow_tables(query, {table_name: condition for table_name in SCOPED_TABLES if table_name in query})
@@ -1,5 +1,7 @@
 import csv
 
+from helper.output import open_output
+
 
 def latex_safe_string(title):
     translation_table = str.maketrans ( {char: f'\{char}' for char in '\`*_{}[]()<>#+-.!$:;,/'} )
@@ -11,7 +13,7 @@ def export_single_general_stat_to_latex(data_dict, parent_dir, title):
     underscore_title = title.replace ( ' ', '_' )
     latex_filename = parent_dir + f'/{underscore_title}_general_statistics.tex'
     safe_title = latex_safe_string ( title )
-    with open ( latex_filename, 'w' ) as latexfile:
+    with open_output ( latex_filename ) as latexfile:
         latexfile.write ( "\\begin{table}[ht]\n" )
         latexfile.write ( "\\centering\n" )
         latexfile.write ( "\\caption{" + safe_title + " General Statistics}\n" )
@@ -24,6 +26,8 @@ def export_single_general_stat_to_latex(data_dict, parent_dir, title):
             if isinstance ( stats, dict ) and 'Individual' not in metric and 'Bandwidth Distribution' not in metric:
                 if 'Duration' in metric or 'Slack' in metric or 'Overhead' in metric:
                     units = ' (us)'
+                elif 'Bandwidth' in metric:
+                    units = ' (B/s)'
                 else:
                     units = ' (B)'
 
@@ -43,7 +47,7 @@ def export_single_general_stat_to_latex(data_dict, parent_dir, title):
 def export_single_general_stat_to_CSV(data_dict, parent_dir, title):
     underscore_title = title.replace ( ' ', '_' )
     csv_filename = parent_dir + f'/{underscore_title}_general_statistics.csv'
-    with open ( csv_filename, 'w', newline='' ) as csvfile:
+    with open_output ( csv_filename ) as csvfile:
         writer = csv.writer ( csvfile )
         writer.writerow ( [f"{title} General Statistics"] )
         writer.writerow ( ['Metric', 'Mean', 'Median', 'Minimum', 'Maximum', 'Standard Deviation'] )
@@ -52,6 +56,8 @@ def export_single_general_stat_to_CSV(data_dict, parent_dir, title):
                             dict ) and 'Individual' not in metric_name and 'Bandwidth Distribution' not in metric_name:
                 if 'Duration' in metric_name or 'Slack' in metric_name or 'Overhead' in metric_name:
                     units = ' (us)'
+                elif 'Bandwidth' in metric_name:
+                    units = ' (B/s)'
                 else:
                     units = ' (B)'
                 writer.writerow ( [metric_name + units] + [stats.get ( stat, '' ) for stat in
@@ -69,7 +75,7 @@ def export_summary_stat_to_latex(data_dict, parent_dir, title, stat_name):
     else:
         header = "\\textbf{Name} & \\textbf{Total Time (\\%)} & \\textbf{Total Time (us)} & \\textbf{Instances} & \\textbf{Mean (B)} & \\textbf{Median (B)} & \\textbf{Minimum (B)} & \\textbf{Maximum (B)} & \\textbf{Standard Deviation} \\\\\n"
 
-    with open ( latex_filename, 'w' ) as latexfile:
+    with open_output ( latex_filename ) as latexfile:
         latexfile.write ( "\\begin{table}[ht]\n" )
         latexfile.write ( "\\centering\n" )
         latexfile.write ( "\\caption{" + safe_title + " Summary " + stat_name + " Statistics}\n" )
@@ -84,7 +90,7 @@ def export_summary_stat_to_latex(data_dict, parent_dir, title, stat_name):
             time_duration = stats['Time Total']
             instances = stats['Instance']
 
-            if isinstance ( stats[stat_name], dict ):
+            if isinstance ( stats.get ( stat_name ), dict ):
                 mean = stats[stat_name].get ( 'Mean', '' )
                 median = stats[stat_name].get ( 'Median', '' )
                 minimum = stats[stat_name].get ( 'Minimum', '' )
@@ -100,7 +106,7 @@ def export_summary_stat_to_latex(data_dict, parent_dir, title, stat_name):
 def export_summary_stat_to_CSV(data_dict, parent_dir, title, stat_name):
     stat_name_replaced = stat_name.replace ( ' ', '_' )
     csv_filename = parent_dir + f'/{stat_name_replaced}_summary_statistics.csv'
-    with open ( csv_filename, 'w', newline='' ) as csvfile:
+    with open_output ( csv_filename ) as csvfile:
         writer = csv.writer ( csvfile )
         writer.writerow ( [f"{title} Summary {stat_name} Statistics"] )
         if 'Duration' in stat_name or 'Slack' in stat_name or 'Overhead' in stat_name:
@@ -114,7 +120,7 @@ def export_summary_stat_to_CSV(data_dict, parent_dir, title, stat_name):
             time_duration = stats['Time Total']
             instances = stats['Instance']
 
-            if isinstance ( stats[stat_name], dict ):
+            if isinstance ( stats.get ( stat_name ), dict ):
                 writer.writerow ( [name, time_percent, time_duration, instances] +
                                   [stats[stat_name].get ( stat, '' ) for stat in
                                    ['Mean', 'Median', 'Minimum', 'Maximum', 'Standard Deviation']] )
@@ -124,7 +130,7 @@ def export_overall_summary_stat_to_latex(data_dict, parent_dir):
     latex_filename = parent_dir + '/overall_application_summary_statistics.tex'
     total_time = data_dict['Time Total']
 
-    with open ( latex_filename, 'w' ) as latexfile:
+    with open_output ( latex_filename ) as latexfile:
         latexfile.write ( "\\begin{table}[ht]\n" )
         latexfile.write ( "\\centering\n" )
         latexfile.write ( "\\caption{Overall Application Duration Summary}\n" )
@@ -148,7 +154,7 @@ def export_summary_summary_stat_to_CSV(data_dict, parent_dir):
     csv_filename = parent_dir + f'/overall_application_summary_statistics.csv'
     total_time = data_dict['Time Total']
 
-    with open ( csv_filename, 'w', newline='' ) as csvfile:
+    with open_output ( csv_filename ) as csvfile:
         writer = csv.writer ( csvfile )
         writer.writerow ( [f"Overall Application Duration Summary"] )
         writer.writerow ( ['Name', 'Total Relative Time (%)', 'Total Time (us)', 'Instances'] )
@@ -163,7 +169,7 @@ def export_summary_summary_stat_to_CSV(data_dict, parent_dir):
 def export_combined_overall_component_summary_stat_to_latex(data_dict, stat, parent_dir):
     latex_filename = parent_dir + '/overall_combined_' + stat.replace(' ', '_') + '_summary_statistics.tex'
 
-    with open ( latex_filename, 'w' ) as latexfile:
+    with open_output ( latex_filename ) as latexfile:
         latexfile.write ( "\\begin{table}[ht]\n" )
         latexfile.write ( "\\centering\n" )
         latexfile.write ( "\\caption{Overall" + stat + " Duration Summary}\n" )
@@ -186,7 +192,7 @@ def export_combined_overall_component_summary_stat_to_latex(data_dict, stat, par
 def export_combined_overall_component_summary_stat_to_CSV(data_dict, stat, parent_dir):
     csv_filename = parent_dir + '/overall_combined_' + stat.replace(' ', '_') + '_summary_statistics.csv'
 
-    with open ( csv_filename, 'w', newline='' ) as csvfile:
+    with open_output ( csv_filename ) as csvfile:
         writer = csv.writer ( csvfile )
         writer.writerow([f"Overall {stat} Duration Summary"])
         writer.writerow ( ['Trace Name', 'Individual Trace Duration (%)', 'Total Time (us)', 'Instances'] )
@@ -201,7 +207,7 @@ def export_combined_overall_component_summary_stat_to_CSV(data_dict, stat, paren
 def export_combined_overall_duration_summary_stat_to_latex(data_dict, parent_dir):
     latex_filename = parent_dir + '/overall_combined_duration_summary_statistics.tex'
 
-    with open ( latex_filename, 'w' ) as latexfile:
+    with open_output ( latex_filename ) as latexfile:
         latexfile.write ( "\\begin{table}[ht]\n" )
         latexfile.write ( "\\centering\n" )
         latexfile.write ( "\\caption{Overall Trace Duration Summary}\n" )
@@ -221,7 +227,7 @@ def export_combined_overall_duration_summary_stat_to_latex(data_dict, parent_dir
 def export_combined_overall_duration_summary_stat_to_CSV(data_dict, parent_dir):
     csv_filename = parent_dir + '/overall_combined_duration_summary_statistics.csv'
 
-    with open ( csv_filename, 'w', newline='' ) as csvfile:
+    with open_output ( csv_filename ) as csvfile:
         writer = csv.writer ( csvfile )
         writer.writerow([f"Overall Trace Duration Summary"])
         writer.writerow ( ['Trace Name', 'Total Trace Time (us)'] )
@@ -240,7 +246,7 @@ def export_combined_summary_stat_to_latex(data_dict, parent_dir, title, stat_nam
     else:
         header = "\\textbf{Name} & \\textbf{Total Time (\\%)} & \\textbf{Total Time (us)} & \\textbf{Instances} & \\textbf{Mean (B)} & \\textbf{Median (B)} & \\textbf{Minimum (B)} & \\textbf{Maximum (B)} & \\textbf{Standard Deviation} \\\\\n"
 
-    with open ( latex_filename, 'w' ) as latexfile:
+    with open_output ( latex_filename ) as latexfile:
         latexfile.write ( "\\begin{table}[ht]\n" )
         latexfile.write ( "\\centering\n" )
         latexfile.write ( "\\caption{" + safe_title + " Combined  " + stat_name + " Summary Statistics}\n" )
@@ -255,7 +261,7 @@ def export_combined_summary_stat_to_latex(data_dict, parent_dir, title, stat_nam
             time_duration = stats['Time Total']
             instances = stats['Instance']
 
-            if isinstance ( stats[stat_name], dict ):
+            if isinstance ( stats.get ( stat_name ), dict ):
                 mean = stats[stat_name].get ( 'Mean', '' )
                 median = stats[stat_name].get ( 'Median', '' )
                 minimum = stats[stat_name].get ( 'Minimum', '' )
@@ -272,7 +278,7 @@ def export_combined_summary_stat_to_CSV(data_dict, parent_dir, title, stat_name)
     stat_name_replaced = stat_name.replace ( ' ', '_' )
     csv_filename = parent_dir + f'/{title}_{stat_name_replaced}_combined_summary_statistics.csv'
 
-    with open ( csv_filename, 'w', newline='' ) as csvfile:
+    with open_output ( csv_filename ) as csvfile:
         writer = csv.writer ( csvfile )
         writer.writerow ( [f"{title} Combined {stat_name} Summary Statistics"] )
         if 'Duration' in stat_name or 'Slack' in stat_name or 'Overhead' in stat_name:
@@ -290,7 +296,7 @@ def export_combined_summary_stat_to_CSV(data_dict, parent_dir, title, stat_name)
             time_duration = stats['Time Total']
             instances = stats['Instance']
 
-            if isinstance ( stats[stat_name], dict ):
+            if isinstance ( stats.get ( stat_name ), dict ):
                 writer.writerow ( [name, time_percent, time_duration, instances] +
                                   [stats[stat_name].get ( stat, '' ) for stat in
                                    ['Mean', 'Median', 'Minimum', 'Maximum', 'Standard Deviation']] )
@@ -307,7 +313,7 @@ def export_combined_overall_summary_stat_to_latex(data_dict, parent_dir, title,
     else:
         header = "\\textbf{Name} &  \\textbf{Mean (B)} & \\textbf{Median (B)} & \\textbf{Minimum (B)} & \\textbf{Maximum (B)} & \\textbf{Standard Deviation} \\\\\n"
 
-    with open ( latex_filename, 'w' ) as latexfile:
+    with open_output ( latex_filename ) as latexfile:
         latexfile.write ( "\\begin{table}[ht]\n" )
         latexfile.write ( "\\centering\n" )
         latexfile.write ( "\\caption{" + safe_title + " Combined  " + stat_name + " Summary Statistics}\n" )
@@ -336,7 +342,7 @@ def export_combined_overall_summary_stat_to_CSV(data_dict, parent_dir, title, st
     title_replaced = title.replace ( ' ', '_' )
     csv_filename = parent_dir + f'/{title_replaced}_{stat_name_replaced}_combined_summary_statistics.csv'
 
-    with open ( csv_filename, 'w', newline='' ) as csvfile:
+    with open_output ( csv_filename ) as csvfile:
         writer = csv.writer ( csvfile )
         writer.writerow ( [f"{title} Combined {stat_name} Summary Statistics"] )
         if 'Duration' in stat_name or 'Slack' in stat_name or 'Overhead' in stat_name:
@@ -355,3 +361,106 @@ def export_combined_overall_summary_stat_to_CSV(data_dict, parent_dir, title, st
                 writer.writerow ( [name] +
                                   [stats.get ( stat, '' ) for stat in
                                    ['Mean', 'Median', 'Minimum', 'Maximum', 'Standard Deviation']] )
+
+
+def export_other_summary_to_latex(rows, parent_dir, title):
+    latex_filename = parent_dir + '/Other_summary_statistics.tex'
+    safe_title = latex_safe_string ( title )
+    with open_output ( latex_filename ) as latexfile:
+        latexfile.write ( "\\begin{table}[ht]\n" )
+        latexfile.write ( "\\centering\n" )
+        latexfile.write ( "\\caption{" + safe_title + " Other Summary Statistics}\n" )
+        latexfile.write ( "\\begin{tabular}{|c|c|c|c|c|}\n" )
+        latexfile.write ( "\\hline\n" )
+        latexfile.write ( "\\textbf{Name} & \\textbf{Trace} & \\textbf{Total Time (\\%)} & \\textbf{Total Time (us)} & \\textbf{Instances} \\\\\n" )
+        latexfile.write ( "\\hline\n" )
+        for name, trace, time_percent, time_total, instances in rows:
+            latexfile.write ( f"{latex_safe_string ( str ( name ) )} & {latex_safe_string ( trace )} & {time_percent} & {time_total} & {instances} \\\\\n" )
+            latexfile.write ( "\\hline\n" )
+        latexfile.write ( "\\end{tabular}\n" )
+        latexfile.write ( "\\label{tab:" + title.replace ( ' ', '_' ) + "_other_summary_stats}\n" )
+        latexfile.write ( "\\end{table}\n" )
+
+
+def export_other_summary_to_CSV(rows, parent_dir, title):
+    csv_filename = parent_dir + '/Other_summary_statistics.csv'
+    with open_output ( csv_filename ) as csvfile:
+        writer = csv.writer ( csvfile )
+        writer.writerow ( [f"{title} Other Summary Statistics"] )
+        writer.writerow ( ['Name', 'Trace', 'Total Time (%)', 'Total Time (us)', 'Instances'] )
+        for row in rows:
+            writer.writerow ( row )
+
+
+def nvtx_attribution_rows(attribution):
+    entries = list ( attribution.get ( 'Ranges', {} ).values () ) + [attribution['Unattributed']]
+    return [[entry['Name'], entry.get ( 'Range Instances', '' ), entry['Kernel Count'], entry['Kernel Time'],
+             entry['Kernel Time Percent'],
+             '; '.join ( f"{kernel['Name']} ({kernel['Kernel Time Percent']}%)" for kernel in entry['Top Kernels'] )]
+            for entry in entries]
+
+
+def export_nvtx_attribution_to_latex(attribution, parent_dir):
+    latex_filename = parent_dir + '/NVTX_kernel_attribution.tex'
+    with open_output ( latex_filename ) as latexfile:
+        latexfile.write ( "\\begin{table}[ht]\n" )
+        latexfile.write ( "\\centering\n" )
+        latexfile.write ( "\\caption{Kernel Time by enclosing NVTX Range}\n" )
+        latexfile.write ( "\\begin{tabular}{|c|c|c|c|c|c|}\n" )
+        latexfile.write ( "\\hline\n" )
+        latexfile.write ( "\\textbf{NVTX Range} & \\textbf{Range Instances} & \\textbf{Kernels} & \\textbf{Kernel Time (us)} & \\textbf{Kernel Time (\\%)} & \\textbf{Top Kernels} \\\\\n" )
+        latexfile.write ( "\\hline\n" )
+        for name, range_instances, kernel_count, kernel_time, time_percent, kernels in nvtx_attribution_rows ( attribution ):
+            kernels = latex_safe_string ( kernels ).replace ( '%', '\\%' )
+            latexfile.write ( f"{latex_safe_string ( str ( name ) )} & {range_instances} & {kernel_count} & {kernel_time} & {time_percent} & {kernels} \\\\\n" )
+            latexfile.write ( "\\hline\n" )
+        latexfile.write ( "\\end{tabular}\n" )
+        latexfile.write ( "\\label{tab:nvtx_kernel_attribution}\n" )
+        latexfile.write ( "\\end{table}\n" )
+
+
+def export_nvtx_attribution_to_CSV(attribution, parent_dir):
+    csv_filename = parent_dir + '/NVTX_kernel_attribution.csv'
+    with open_output ( csv_filename ) as csvfile:
+        writer = csv.writer ( csvfile )
+        writer.writerow ( ["Kernel Time by enclosing NVTX Range"] )
+        writer.writerow ( ['NVTX Range', 'Range Instances', 'Kernels', 'Kernel Time (us)', 'Kernel Time (%)', 'Top Kernels'] )
+        for row in nvtx_attribution_rows ( attribution ):
+            writer.writerow ( row )
+
+
+def rank_imbalance_rows(items):
+    return [[item.get ( 'Name' ) or item.get ( 'Type' ) or name, item['Ranks'], item['Time Total'],
+             item['Rank Time Minimum'], item['Rank Time Median'], item['Rank Time Maximum'], item['Load Imbalance'],
+             '; '.join ( f"{rank} ({time})" for rank, time in item['Slowest Ranks'] )]
+            for name, item in items.items () if 'Load Imbalance' in item]
+
+
+def export_rank_imbalance_to_latex(items, parent_dir, title):
+    latex_filename = parent_dir + '/Rank_imbalance.tex'
+    safe_title = latex_safe_string ( title )
+    with open_output ( latex_filename ) as latexfile:
+        latexfile.write ( "\\begin{table}[ht]\n" )
+        latexfile.write ( "\\centering\n" )
+        latexfile.write ( "\\caption{" + safe_title + " Load Imbalance across Ranks}\n" )
+        latexfile.write ( "\\begin{tabular}{|c|c|c|c|c|c|c|c|}\n" )
+        latexfile.write ( "\\hline\n" )
+        latexfile.write ( "\\textbf{Name} & \\textbf{Ranks} & \\textbf{Total Time (us)} & \\textbf{Rank Minimum (us)} & \\textbf{Rank Median (us)} & \\textbf{Rank Maximum (us)} & \\textbf{Load Imbalance} & \\textbf{Slowest Ranks} \\\\\n" )
+        latexfile.write ( "\\hline\n" )
+        for name, ranks, time_total, minimum, median, maximum, imbalance, slowest in rank_imbalance_rows ( items ):
+            latexfile.write ( f"{latex_safe_string ( str ( name ) )} & {ranks} & {time_total} & {minimum} & {median} & {maximum} & {imbalance} & {latex_safe_string ( slowest )} \\\\\n" )
+            latexfile.write ( "\\hline\n" )
+        latexfile.write ( "\\end{tabular}\n" )
+        latexfile.write ( "\\label{tab:" + title.replace ( ' ', '_' ) + "_rank_imbalance}\n" )
+        latexfile.write ( "\\end{table}\n" )
+
+
+def export_rank_imbalance_to_CSV(items, parent_dir, title):
+    csv_filename = parent_dir + '/Rank_imbalance.csv'
+    with open_output ( csv_filename ) as csvfile:
+        writer = csv.writer ( csvfile )
+        writer.writerow ( [f"{title} Load Imbalance across Ranks"] )
+        writer.writerow ( ['Name', 'Ranks', 'Total Time (us)', 'Rank Minimum (us)', 'Rank Median (us)',
+                           'Rank Maximum (us)', 'Load Imbalance', 'Slowest Ranks'] )
+        for row in rank_imbalance_rows ( items ):
+            writer.writerow ( row )
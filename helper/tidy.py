@@ -0,0 +1,121 @@
+import csv
+import os
+from contextlib import contextmanager, nullcontext
+
+from absl import app, logging
+
+from helper.general import NON_CATEGORY_KEYS
+from helper.trend import metric_rows, GENERAL_NAME
+
+TIDY_FORMATS = ('.parquet', '.csv')
+
+# one row per trace, category, item and metric, the columns of the trend store so both load the same way
+STATISTICS_COLUMNS = {
+    'trace': 'string', 'category': 'string', 'item': 'string', 'metric': 'string', 'time_total': 'float64',
+    'time_percent': 'float64', 'instances': 'int64', 'count': 'int64', 'mean': 'float64', 'median': 'float64',
+    'q05': 'float64', 'q25': 'float64', 'q75': 'float64', 'q95': 'float64', 'minimum': 'float64',
+    'maximum': 'float64', 'standard_deviation': 'float64',
+}
+SAMPLES_COLUMNS = {'trace': 'string', 'category': 'string', 'item': 'string', 'metric': 'string', 'value': 'float64'}
+INTEGER_COLUMNS = ('instances', 'count')
+SAMPLES_BATCH_ROWS = 1 << 20  # samples are buffered up to one Parquet row group before each write
+
+
+def samples_file_of(tidy_file):
+    stem, suffix = os.path.splitext(tidy_file)
+    return f'{stem}_samples{suffix}'
+
+
+@contextmanager
+def parquet_writer(file, columns):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise app.UsageError(f"Writing the Parquet table {file} requires pyarrow (pip install pyarrow), "
+                             f"use a .csv file instead")
+
+    schema = pa.schema([(name, pa.type_for_alias(type)) for name, type in columns.items()])
+    with pq.ParquetWriter(file, schema) as writer:
+        yield lambda batch: writer.write_table(pa.Table.from_pydict(batch, schema=schema))
+
+
+@contextmanager
+def csv_writer(file, columns):
+    with open(file, 'w', newline='') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        yield lambda batch: writer.writerows(zip(*(batch[name] for name in columns)))
+
+
+def table_writer(file, columns):
+    return parquet_writer(file, columns) if file.endswith('.parquet') else csv_writer(file, columns)
+
+
+def new_batch(columns):
+    return {name: [] for name in columns}
+
+
+def append_row(batch, row):
+    for (name, values), value in zip(batch.items(), row):
+        values.append(int(value) if value is not None and name in INTEGER_COLUMNS else value)
+
+
+def extend_samples(batch, trace, category, name, metric, raw_data):
+    batch['trace'].extend([trace] * len(raw_data))
+    batch['category'].extend([category] * len(raw_data))
+    batch['item'].extend([name] * len(raw_data))
+    batch['metric'].extend([metric] * len(raw_data))
+    batch['value'].extend(float(value) for value in raw_data)
+
+
+def category_items(category_stats):
+    # (item name, item statistics) of a category, its general statistics last under GENERAL_NAME
+    for key, items in category_stats.items():
+        if key.startswith('Individual') and isinstance(items, dict):
+            for id, item in items.items():
+                if isinstance(item, dict):
+                    yield item.get('Name') or item.get('Type') or str(id), item
+    yield GENERAL_NAME, category_stats
+
+
+def export_tidy(statistics_by_trace, tidy_file, samples=False):
+    # a single pass over the NAV statistics, statistics rows are written once and Raw Data in batches of
+    # SAMPLES_BATCH_ROWS as it is read, so the samples table never has to fit in memory
+    if not tidy_file.endswith(TIDY_FORMATS):
+        raise app.UsageError(f"Tidy export file {tidy_file} must end with {' or '.join(TIDY_FORMATS)}")
+    samples_file = samples_file_of(tidy_file) if samples else None
+    statistics_rows = new_batch(STATISTICS_COLUMNS)
+    samples_rows = new_batch(SAMPLES_COLUMNS)
+    num_samples = 0
+
+    with table_writer(tidy_file, STATISTICS_COLUMNS) as write_statistics, \
+            (table_writer(samples_file, SAMPLES_COLUMNS) if samples else nullcontext()) as write_samples:
+        for trace, statistics in statistics_by_trace.items():
+            for category, category_stats in statistics.items():
+                if category in NON_CATEGORY_KEYS or not isinstance(category_stats, dict):
+                    continue
+                for name, item in category_items(category_stats):
+                    if name == GENERAL_NAME:
+                        rows = metric_rows(item)
+                    else:
+                        rows = metric_rows(item, item.get('Time Total'), item.get('Time Percent'), item.get('Instance'))
+                    for row in rows:
+                        append_row(statistics_rows, [trace, category, str(name)] + row)
+                    if not samples or name == GENERAL_NAME:
+                        continue
+                    for metric, stats in item.items():
+                        if isinstance(stats, dict) and 'Mean' in stats and stats.get('Raw Data'):
+                            extend_samples(samples_rows, trace, category, str(name), metric, stats['Raw Data'])
+                            num_samples += len(stats['Raw Data'])
+                            if len(samples_rows['value']) >= SAMPLES_BATCH_ROWS:
+                                write_samples(samples_rows)
+                                samples_rows = new_batch(SAMPLES_COLUMNS)
+        write_statistics(statistics_rows)
+        if samples and samples_rows['value']:
+            write_samples(samples_rows)
+
+    logging.info(f"Exported {len(statistics_rows['trace'])} statistics rows to {tidy_file}")
+    if samples:
+        logging.info(f"Exported {num_samples} Raw Data samples to {samples_file}")
+    return tidy_file, samples_file
@@ -1,8 +1,8 @@
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from helper.general import generate_statistics, create_histogram, summary_query, finalize_metric_statistics, \
+    bucket_rows_from_values
+from helper.outliers import metric_outlier_mask, apply_outlier_mask, record_outliers
 
-from absl import logging
-
-from helper.general import generate_statistics, MAX_WORKERS, create_histogram, remove_outliers
+CONVERSION_TO_SECONDS = 1e-6 #Nsight claims ns for duration but found to be us
 
 QUERY_TRANSFERS = """
 WITH
@@ -83,42 +83,108 @@ WITH
                 ELSE 'Unknown'
             END AS name,
             mcpy.end - mcpy.start AS duration,
-            mcpy.bytes AS size
+            mcpy.bytes AS size,
+            mcpy.start AS start
         FROM
             CUPTI_ACTIVITY_KIND_MEMCPY as mcpy
         UNION ALL
         SELECT
             'Memset' AS name,
             end - start AS duration,
-            bytes AS size
+            bytes AS size,
+            start AS start
         FROM
             CUPTI_ACTIVITY_KIND_MEMSET
     )
 SELECT
     name AS "Name",
     duration AS "Duration",
-    size AS "Size"
+    size AS "Size",
+    start AS "Start"
 FROM
     transfers
 WHERE
     name = ?
 """
 
-TRANSFER_REQUIRED_TABLES = ['CUPTI_ACTIVITY_KIND_MEMCPY', 'CUPTI_ACTIVITY_KIND_MEMSET']
+TRANSFER_METRIC_VALUES = f"""
+WITH
+    transfers AS (
+        SELECT
+            CASE
+                WHEN mcpy.copyKind = 0 THEN 'Unknown'
+                WHEN mcpy.copyKind = 1 THEN 'Host-to-Device'
+                WHEN mcpy.copyKind = 2 THEN 'Device-to-Host'
+                WHEN mcpy.copyKind = 3 THEN 'Host-to-Array'
+                WHEN mcpy.copyKind = 4 THEN 'Array-to-Host'
+                WHEN mcpy.copyKind = 5 THEN 'Array-to-Array'
+                WHEN mcpy.copyKind = 6 THEN 'Array-to-Device'
+                WHEN mcpy.copyKind = 7 THEN 'Device-to-Array'
+                WHEN mcpy.copyKind = 8 THEN 'Device-to-Device'
+                WHEN mcpy.copyKind = 9 THEN 'Host-to-Host'
+                WHEN mcpy.copyKind = 10 THEN 'Peer-to-Peer'
+                WHEN mcpy.copyKind = 11 THEN 'Unified Host-to-Device'
+                WHEN mcpy.copyKind = 12 THEN 'Unified Device-to-Host'
+                WHEN mcpy.copyKind = 13 THEN 'Unified Device-to-Device'
+                ELSE 'Unknown'
+            END AS name,
+            mcpy.end - mcpy.start AS duration,
+            mcpy.bytes AS size
+        FROM
+            CUPTI_ACTIVITY_KIND_MEMCPY as mcpy
+        UNION ALL
+        SELECT
+            'Memset' AS name,
+            end - start AS duration,
+            bytes AS size
+        FROM
+            CUPTI_ACTIVITY_KIND_MEMSET
+    ),
+    metric_values AS (
+        SELECT
+            T.name AS id,
+            metric_index.metric AS metric,
+            CASE metric_index.metric
+                WHEN 0 THEN T.size
+                WHEN 1 THEN T.duration
+                ELSE T.size / (T.duration * {CONVERSION_TO_SECONDS})
+            END AS value
+        FROM
+            transfers AS T
+        CROSS JOIN
+            (SELECT 0 AS metric UNION ALL SELECT 1 UNION ALL SELECT 2) AS metric_index
+    )
+"""
 
-CONVERSION_TO_SECONDS = 1e-6 #Nsight claims ns for duration but found to be us
+QUERY_TRANSFERS_SUMMARY = summary_query(TRANSFER_METRIC_VALUES)
+
+TRANSFER_METRICS = ['Transfer Size', 'Transfer Durations']
+TRANSFER_SUMMARY_METRICS = TRANSFER_METRICS + ['Transfer Bandwidth']
 
-def generate_transfer_stats(transfers):
+TRANSFER_REQUIRED_TABLES = ['CUPTI_ACTIVITY_KIND_MEMCPY', 'CUPTI_ACTIVITY_KIND_MEMSET']
+
+def generate_transfer_stats(transfers, outlier_filters=None):
     transfer_sizes = []
     transfer_durations = []
     temp_bandwidth = []
     histgram_bins = []
 
-    for _, duration, size in transfers[1]:
+    for _, duration, size, *_ in transfers[1]:
         transfer_sizes.append ( size )
         transfer_durations.append ( duration )
         temp_bandwidth.append ( (size, size / (duration * CONVERSION_TO_SECONDS))) # convert to B/s
 
+    dropped = {}
+    size_keep = metric_outlier_mask ( transfer_sizes, 'Transfer Size', outlier_filters )
+    duration_keep = metric_outlier_mask ( transfer_durations, 'Transfer Durations', outlier_filters )
+    transfer_sizes = apply_outlier_mask ( transfer_sizes, size_keep, 'Transfer Size', dropped )
+    transfer_durations = apply_outlier_mask ( transfer_durations, duration_keep, 'Transfer Durations', dropped )
+    # bandwidth pairs are kept when neither the size nor the duration of the transfer was removed
+    pair_keep = size_keep if duration_keep is None else \
+        duration_keep if size_keep is None else size_keep & duration_keep
+    if pair_keep is not None:
+        temp_bandwidth = [pair for pair, kept in zip ( temp_bandwidth, pair_keep ) if kept]
+
     transfer_data = {}
 
     if transfer_sizes:
@@ -151,69 +217,32 @@ def generate_transfer_stats(transfers):
     else:
         transfer_data['Bandwidth Distribution'] = None
 
-    return transfers[0], transfer_data
+    return transfers[0], record_outliers ( transfer_data, dropped )
 
 
-def parallel_parse_transfer_data(queries_res):
-    total_tasks = len ( queries_res )
-    completed_tasks = 0
-
-    with ProcessPoolExecutor ( max_workers=MAX_WORKERS ) as executor:
-        futures = []
-        for data in queries_res:
-            future = executor.submit ( generate_transfer_stats, data )
-            futures.append ( future )
+def parse_transfer_chunk(transfers, precision=0):
+    transfer_sizes = []
+    transfer_durations = []
+    transfer_bandwidths = []
 
-        results = []
-        for future in as_completed ( futures ):
-            results.append ( future.result () )
-            completed_tasks += 1
-            if int ( (completed_tasks / total_tasks) * 100 ) % 10 == 0:
-                logging.info ( f"Progress: {(completed_tasks / total_tasks) * 100:.1f}%" )
+    for _, duration, size, *_ in transfers[1]:
+        transfer_sizes.append ( size )
+        transfer_durations.append ( duration )
+        if duration > 0:
+            transfer_bandwidths.append ( size / (duration * CONVERSION_TO_SECONDS) ) # convert to B/s
 
-    return results
+    return transfers[0], {
+        'Transfer Size': bucket_rows_from_values ( transfer_sizes, precision ),
+        'Transfer Durations': bucket_rows_from_values ( transfer_durations, precision ),
+        'Transfer Bandwidth': bucket_rows_from_values ( transfer_bandwidths, precision )
+    }
 
 
-def create_specific_transfer_stats(transfer_stats, handle_outliers=False):
+def finalize_transfer_stats(accumulator):
     dict = {}
-    duration_cluster_data = []
-    size_cluster_data = []
-    combined_raw_duration_data = []
-    combined_raw_size_data = []
-
-    for transfer_id, transfer_info in transfer_stats.items ():
-        if transfer_info:
-            if transfer_info['Transfer Size']:
-                if transfer_info['Transfer Size']["Raw Data"]:
-                    combined_raw_size_data.extend ( transfer_info['Transfer Size']["Raw Data"] )
-                if transfer_info['Transfer Size']['Mean'] and transfer_info['Transfer Size'][
-                    'Median'] and transfer_info[
-                    "Instance"]:
-                    size_cluster_data.append ( [transfer_info['Transfer Size']['Mean'],
-                                                transfer_info['Transfer Size']['Median'],
-                                                transfer_info["Instance"]] )
-            if transfer_info['Transfer Durations']:
-                if transfer_info['Transfer Durations']["Raw Data"]:
-                    combined_raw_duration_data.extend ( transfer_info['Transfer Durations']["Raw Data"] )
-                if transfer_info['Transfer Durations']['Mean'] and transfer_info['Transfer Durations'][
-                    'Median'] and transfer_info[
-                    "Instance"]:
-                    duration_cluster_data.append ( [transfer_info['Transfer Durations']['Mean'],
-                                                    transfer_info['Transfer Durations']['Median'],
-                                                    transfer_info["Instance"]] )
-
-    if handle_outliers and duration_cluster_data: duration_cluster_data = remove_outliers ( duration_cluster_data )
-    if handle_outliers and size_cluster_data: size_cluster_data = remove_outliers ( size_cluster_data )
-
-    if combined_raw_duration_data:
-        dict.update ( generate_statistics ( combined_raw_duration_data, 'Transfer Durations', disable_raw=True ) )
-        dict['Transfer Durations']['Distribution'] = create_histogram ( combined_raw_duration_data )
-    if combined_raw_size_data:
-        dict.update ( generate_statistics ( combined_raw_size_data, 'Transfer Size', disable_raw=True ) )
-        dict['Transfer Size']['Distribution'] = create_histogram ( combined_raw_size_data )
-    if duration_cluster_data:
-        dict['Transfer Durations']['k-mean'] = {'Raw Data': duration_cluster_data}
-    if size_cluster_data:
-        dict['Transfer Size']['k-mean'] = {'Raw Data': size_cluster_data}
+
+    for label, label_accumulator in accumulator.items ():
+        convert_bytes = label != 'Transfer Durations'
+        dict.update ( finalize_metric_statistics ( label_accumulator, label, convert_bytes ) )
 
     return dict
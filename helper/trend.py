@@ -0,0 +1,225 @@
+import csv
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import numpy as np
+from absl import logging, app
+
+from helper.general import NAV_METADATA, NON_CATEGORY_KEYS, quantile_from_buckets
+
+TREND_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    label TEXT NOT NULL,
+    source TEXT NOT NULL,
+    run_time REAL NOT NULL,
+    ingested_at REAL NOT NULL,
+    total_duration INTEGER,
+    metadata TEXT,
+    UNIQUE (source, run_time)
+);
+CREATE TABLE IF NOT EXISTS items (
+    item_id INTEGER PRIMARY KEY,
+    category TEXT NOT NULL,
+    name TEXT NOT NULL,
+    UNIQUE (name, category)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    item_id INTEGER NOT NULL,
+    metric TEXT NOT NULL,
+    run_id INTEGER NOT NULL,
+    time_total REAL,
+    time_percent REAL,
+    instances INTEGER,
+    count INTEGER,
+    mean REAL,
+    median REAL,
+    q05 REAL,
+    q25 REAL,
+    q75 REAL,
+    q95 REAL,
+    minimum REAL,
+    maximum REAL,
+    standard_deviation REAL,
+    PRIMARY KEY (item_id, metric, run_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS stats_run ON stats (run_id);
+CREATE INDEX IF NOT EXISTS runs_time ON runs (run_time);
+"""
+
+QUERY_TREND = """
+SELECT
+    runs.run_time,
+    runs.label,
+    stats.time_total,
+    stats.instances,
+    stats.mean,
+    stats.median,
+    stats.q05,
+    stats.q25,
+    stats.q75,
+    stats.q95,
+    stats.minimum,
+    stats.maximum,
+    stats.standard_deviation
+FROM
+    stats
+JOIN
+    runs
+    ON runs.run_id = stats.run_id
+WHERE
+    stats.item_id = ?
+    AND stats.metric = ?
+ORDER BY 1
+"""
+
+TREND_COLUMNS = ['Run Time', 'Label', 'Time Total', 'Instances', 'Mean', 'Median', 'Q05', 'Q25', 'Q75', 'Q95',
+                 'Minimum', 'Maximum', 'Standard Deviation']
+TREND_QUANTILES = [0.05, 0.25, 0.75, 0.95]
+GENERAL_NAME = '(General)'  # name under which the category wide statistics of a run are stored
+
+
+def connect_trend_store(trend_store):
+    conn = sqlite3.connect(trend_store)
+    conn.executescript(TREND_SCHEMA)
+    return conn
+
+
+def parse_run_time(run_time, source):
+    if not run_time:
+        return os.path.getmtime(source) if os.path.exists(source) else time.time()
+    try:
+        return float(run_time)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(run_time).timestamp()
+    except ValueError:
+        raise app.UsageError("Trend time must be a UNIX timestamp or an ISO 8601 date (e.g. 2024-05-01T02:00)")
+
+
+def metric_quantiles(stats):
+    if stats.get('Raw Data'):
+        return [float(value) for value in np.quantile(stats['Raw Data'], TREND_QUANTILES)]
+    if stats.get('Buckets'):
+        return [float(quantile_from_buckets(stats['Buckets'], quantile)) for quantile in TREND_QUANTILES]
+    return [None] * len(TREND_QUANTILES)
+
+
+def metric_rows(item, time_total=None, time_percent=None, instances=None):
+    rows = []
+    for metric, stats in item.items():
+        if not isinstance(stats, dict) or 'Mean' not in stats:
+            continue
+        count = stats.get('Count') or (len(stats['Raw Data']) if stats.get('Raw Data') else None)
+        rows.append([metric, time_total, time_percent, instances, count, stats.get('Mean'), stats.get('Median')] +
+                    metric_quantiles(stats) +
+                    [stats.get('Minimum'), stats.get('Maximum'), stats.get('Standard Deviation')])
+    return rows
+
+
+def get_item_id(conn, item_ids, category, name):
+    key = (category, name)
+    if key not in item_ids:
+        conn.execute("INSERT OR IGNORE INTO items (category, name) VALUES (?, ?)", key)
+        item_ids[key] = conn.execute("SELECT item_id FROM items WHERE category = ? AND name = ?", key).fetchone()[0]
+    return item_ids[key]
+
+
+def ingest_statistics(trend_store, statistics, label, source, run_time=None):
+    source = os.path.abspath(source)
+    run_time = parse_run_time(run_time, source)
+    conn = connect_trend_store(trend_store)
+    item_ids = {}
+    stats_rows = []
+
+    try:
+        with conn:
+            # runs are kept per source and run time, re-ingesting the same run replaces it
+            previous = conn.execute("SELECT run_id FROM runs WHERE source = ? AND run_time = ?",
+                                    (source, run_time)).fetchone()
+            if previous:
+                conn.execute("DELETE FROM stats WHERE run_id = ?", previous)
+                conn.execute("DELETE FROM runs WHERE run_id = ?", previous)
+
+            run_id = conn.execute(
+                "INSERT INTO runs (label, source, run_time, ingested_at, total_duration, metadata) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (label, source, run_time, time.time(), statistics.get('Total Duration'),
+                 json.dumps(statistics.get(NAV_METADATA)) if NAV_METADATA in statistics else None)).lastrowid
+
+            for category, category_stats in statistics.items():
+                if category in NON_CATEGORY_KEYS or not isinstance(category_stats, dict):
+                    continue
+                for key, value in category_stats.items():
+                    if key.startswith('Individual'):
+                        for id, item in value.items():
+                            name = item.get('Name') or item.get('Type') or str(id)
+                            item_id = get_item_id(conn, item_ids, category, name)
+                            for row in metric_rows(item, item.get('Time Total'), item.get('Time Percent'),
+                                                   item.get('Instance')):
+                                stats_rows.append([item_id, row[0], run_id] + row[1:])
+                item_id = get_item_id(conn, item_ids, category, GENERAL_NAME)
+                for row in metric_rows(category_stats):
+                    stats_rows.append([item_id, row[0], run_id] + row[1:])
+
+            conn.executemany(f"INSERT INTO stats VALUES ({', '.join(['?'] * 16)})", stats_rows)
+    finally:
+        conn.close()
+
+    logging.info(f"Ingested {len(stats_rows)} summary rows of {label} ({source}) into {trend_store}")
+    return run_id
+
+
+def query_trend(trend_store, name, metric=None):
+    conn = sqlite3.connect(f"file:{trend_store}?mode=ro", uri=True)
+    trends = {}
+
+    try:
+        items = conn.execute("SELECT item_id, category FROM items WHERE name = ?", (name,)).fetchall()
+        if not items:
+            similar = conn.execute("SELECT DISTINCT name FROM items WHERE name LIKE ? LIMIT 10",
+                                   (f'%{name}%',)).fetchall()
+            raise app.UsageError(f"No trend data for {name} in {trend_store}" +
+                                 (", similar names: " + ", ".join(similar_name for similar_name, in similar)
+                                  if similar else ""))
+
+        for item_id, category in items:
+            if metric:
+                metrics = [metric]
+            else:
+                metrics = [metric_name for metric_name, in conn.execute(
+                    "SELECT DISTINCT metric FROM stats WHERE item_id = ?", (item_id,))]
+            for metric_name in metrics:
+                rows = conn.execute(QUERY_TREND, (item_id, metric_name)).fetchall()
+                if rows:
+                    trends[(category, metric_name)] = rows
+    finally:
+        conn.close()
+
+    return trends
+
+
+def export_trend(trend_store, name, output_dir, metric=None):
+    from helper.figures import plot_trend
+    start_time = time.time()
+    trends = query_trend(trend_store, name, metric)
+    logging.info(f"Queried {sum(len(rows) for rows in trends.values())} trend rows of {name} in "
+                 f"{(time.time() - start_time) * 1000:.1f} ms")
+
+    os.makedirs(output_dir, exist_ok=True)
+    for (category, metric_name), rows in trends.items():
+        title = f"{name} {metric_name}"
+        file_name = os.path.join(output_dir, f"trend_{category.split(' ')[0]}_{name}_{metric_name}".replace(' ', '_')
+                                 .replace('/', '_').replace(':', '_'))
+        with open(file_name + '.csv', 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(TREND_COLUMNS)
+            for run_time, *values in rows:
+                writer.writerow([datetime.fromtimestamp(run_time).isoformat(timespec='seconds')] + values)
+        plot_trend(rows, title, metric_name, file_name + '.png')
+
+    return trends
@@ -3,9 +3,16 @@ import multiprocessing
 import time
 from absl import flags
 
+from helper.backend import open_trace
 from helper.extraction import create_statistics_from_file
 from helper.general import *
-from helper.export_statistics import generation_tables_and_figures
+from helper.query_profiler import profile_queries
+from helper.ranks import create_rank_statistics, RANK_AGGREGATE
+from helper.regression import regression_check, REGRESSION_EXIT_CODE, CORRECTION_METHODS
+from helper.trend import ingest_statistics, export_trend
+from helper.tidy import export_tidy
+from helper.daemon import serve
+from helper.report import write_html_report
 
 # General Flags
 flags.DEFINE_string('output_dir', "output", "Name of directory to save generated NAV files and export Tables and Figures (default: ./output)", short_name='o')
@@ -13,12 +20,51 @@ flags.DEFINE_string('multi_data_label', None, "(REQUIRED for multi-files) Labels
 flags.DEFINE_integer('max_workers', None, "Number of threads to split work (Default to CPU count)", short_name='mw')
 
 # Extraction Flags
-flags.DEFINE_string('data_file', None, "Data Base file for extraction (sqlite)", short_name='df')
+flags.DEFINE_string('data_file', None, "Data Base file for extraction (sqlite), or an nsys Parquet/Arrow export directory (parquetdir/arrowdir, requires pyarrow)", short_name='df')
 flags.DEFINE_string('nav_file', None, "NAV file with extracted statistics", short_name='nf')
 flags.DEFINE_boolean('no_kernel_metrics', False, "export kernel metrics", short_name='nkm')
 flags.DEFINE_boolean('no_transfer_metrics', False, "export transfer metrics", short_name='ntm')
 flags.DEFINE_boolean('no_communication_metrics', False, "export communication metrics", short_name='ncm')
+flags.DEFINE_boolean('no_mpi_metrics', False, "export MPI and UCX message metrics", short_name='nmm')
 flags.DEFINE_boolean('no_save_data', False, "Save metrics to NAV file", short_name='nsd')
+flags.DEFINE_string('time_window', None, "Only extract activity starting inside this \"start,end\" window in trace nanoseconds, either side may be left empty", short_name='tw')
+flags.DEFINE_string('nvtx_range', None, "Only extract activity starting inside NVTX ranges with these names, commas used to split names ex:(train_step,eval_step)", short_name='nr')
+flags.DEFINE_integer('sample_cap', None, "Keep at most this many Raw Data samples per kernel/transfer kind/NVTX tag, Count, Mean, Minimum, Maximum and Standard Deviation stay exact", short_name='sc')
+flags.DEFINE_boolean('summary_only', False, "Compute Count, Mean, Minimum, Maximum, Standard Deviation, approximate Median and power-of-2 histograms inside SQLite without extracting Raw Data", short_name='so')
+flags.DEFINE_integer('chunk_rows', None, "Split any kernel/transfer kind/NVTX tag with more rows than this into start time range chunks extracted in parallel ex:(1000000), chunked items keep bucket statistics instead of Raw Data (Default no chunking)", short_name='cr')
+flags.DEFINE_float('memory_budget', None, "Memory budget in GB for extraction, caps in-flight queries by estimated result size and observed RSS and spills completed results to disk when exceeded. Only extraction and the NAV file are covered, spilled results are loaded back for figures, tables, trend ingest, tidy export and regression checks, so the budget only bounds peak memory with -nmo and none of these (Default no budget)", short_name='mb')
+flags.DEFINE_integer('histogram_precision', None, "Store every histogram as sparse counts on a global log bucket grid with 2^precision buckets per power of 2 ex:(3), histograms of items, chunks and traces then merge by addition and quantiles from counts are off by at most 2^-precision of the value (Default quantile histograms)", short_name='hp', lower_bound=0, upper_bound=10)
+flags.DEFINE_string('outlier_filter', None, "Remove outliers from the RAW Data of each item before its statistics are computed, \"method[:threshold]\" for every metric or \"Metric=method[:threshold],...\" per metric with method iqr (Tukey fences, default 1.5), mad (modified z-score, default 3.5) or percentile (trim percent per side, default 1) ex:(\"Launch Overhead=iqr,Slack=mad:3\"), the removed sample counts are stored in the NAV file", short_name='of')
+flags.DEFINE_boolean('nvtx_kernel_attribution', False, "Attribute every kernel to the innermost NVTX push/pop range open on the thread that launched it, and store the kernel time, kernel count and top kernels of each range", short_name='nka')
+
+# Rank Aggregation Flags
+flags.DEFINE_string('rank_files', None, "Per-rank .sqlite traces of one job as a glob pattern or files separated by spaces ex:(\"ranks/rank_*.sqlite\"), summarized in parallel and merged into one job level NAV file with the spread of every kernel/transfer kind/NVTX range across ranks", short_name='rf')
+
+# Query Profiling Flags
+flags.DEFINE_boolean('profile_queries', False, "Run EXPLAIN QUERY PLAN and timed execution of each NAV query against the data base file instead of extracting statistics", short_name='pq')
+flags.DEFINE_integer('query_timeout', None, "Cancel a profiled query after this many seconds (Default no timeout)", short_name='qt')
+
+# Regression Check Flags
+flags.DEFINE_boolean('regression_check', False, "Test every common kernel, transfer kind and NVTX range of the second file (candidate) against the first file (baseline) and exit non-zero when a regression is found", short_name='rc')
+flags.DEFINE_float('regression_alpha', 0.05, "Significance level applied to the corrected p-values of the regression check", short_name='ra')
+flags.DEFINE_float('regression_threshold', 0.05, "Minimum relative change of the median for a significant difference to count as a regression or improvement (0.05 = 5%)", short_name='rt')
+flags.DEFINE_enum('regression_correction', 'bh', CORRECTION_METHODS, "Multiple comparison correction of the regression check: bh (Benjamini-Hochberg), bonferroni or none", short_name='rmc')
+
+# Tidy Export Flags
+flags.DEFINE_string('tidy_export', None, "Write all statistics as one long-format table with a row per trace, category, item and metric (count, mean, median, 5/25/75/95% quantiles, minimum, maximum, standard deviation) to this .parquet (requires pyarrow) or .csv file", short_name='te')
+flags.DEFINE_boolean('tidy_samples', False, "Also write the Raw Data samples as a long-format table next to the tidy export (<file>_samples.parquet/.csv)", short_name='tsm')
+
+# Trend Store Flags
+flags.DEFINE_string('trend_store', None, "SQLite trend database holding per kernel/transfer/NVTX summary statistics of ingested runs", short_name='ts')
+flags.DEFINE_boolean('trend_ingest', False, "Ingest the summary statistics of the provided files into the trend database, multi-file labels are used as run labels", short_name='ti')
+flags.DEFINE_string('trend_time', None, "Run time recorded for ingested files as UNIX timestamp or ISO 8601 date (Default file modification time)", short_name='tt')
+flags.DEFINE_string('trend_query', None, "Name of a kernel, transfer kind or NVTX range to export the trend of from the trend database, no data base or NAV file needed", short_name='tq')
+flags.DEFINE_string('trend_metric', None, "Metric of the trend export ex:(Execution Duration) (Default all metrics of the item)", short_name='tm')
+
+# Daemon Flags
+flags.DEFINE_boolean('serve', False, "Run as analysis daemon keeping worker pools, trace connections and parsed NAV files warm between jobs submitted with client.py", short_name='sv')
+flags.DEFINE_string('daemon_socket', f"/tmp/nav-{os.getuid()}.sock", "Unix socket the analysis daemon listens on", short_name='dsk')
+flags.DEFINE_integer('daemon_jobs', 2, "Number of jobs the analysis daemon runs at the same time, further jobs wait for a free slot", short_name='dj')
 
 # Graphics and Table Flags
 flags.DEFINE_boolean('no_metrics_output', None, "disable metrics export after extraction", short_name='nmo')
@@ -26,13 +72,31 @@ flags.DEFINE_boolean('no_compare_metrics_output', False, "disable comparison met
 flags.DEFINE_boolean('no_general_metrics_output', False, "disable general metrics export (Kernel, Transfer, Communication)", short_name='ngmo')
 flags.DEFINE_boolean('no_specific_metrics_output', False, "disable specific metrics export (Duration, Size, Slack, Overhead, etc)", short_name='nsmo')
 flags.DEFINE_boolean('no_individual_metrics_output', False, "disable individual metrics export (individual kernel, transfer, communication statistics)", short_name='nimo')
+flags.DEFINE_float('render_coverage', None, "Only export individual kernels/types/NVTX ranges in detail until they cover this share of the Time Total ex:(0.99), the rest is summarized in an Other table", short_name='rcv', lower_bound=0, upper_bound=1)
+flags.DEFINE_float('render_budget', None, "Wall-clock budget in seconds for the detailed individual exports of each category, estimated from the rendering times of previous runs", short_name='rb', lower_bound=0)
+flags.DEFINE_integer('comparison_samples', 100000, "Comparison figures of a kernel/transfer kind/NVTX range or category use Raw Data only up to this many samples per trace, beyond that and for NAV files without Raw Data they are drawn from bucket counts, 0 always uses bucket counts", short_name='cs', lower_bound=0)
+flags.DEFINE_enum('violin_method', 'histogram', ['histogram', 'kde'], "Density of the violin figures: histogram (smoothed histogram densities and exact median computed with NumPy, cost linear in the samples) or kde (exact Gaussian KDE as in matplotlib violinplot, slow for millions of samples)", short_name='vm')
+flags.DEFINE_string('output_archive', None, "Write all Tables and Figures into this single .zip, .tar or .tar.gz archive instead of separate files, the directory layout is kept as archive paths", short_name='oa')
+flags.DEFINE_boolean('html_report', False, "Export a single self-contained HTML report with embedded summaries rendered in the browser instead of Tables and Figures", short_name='hr')
 
 FLAGS = flags.FLAGS
 
 def run(args):
-    files, num_files, file_labels, output_data, extract_data = file_args_checking(args)
+    output_dir_name = args.output_dir
+
+    if (args.trend_query or args.trend_ingest) and not args.trend_store:
+        raise app.UsageError("Trend ingest and trend queries require a trend database (--trend_store)")
+    if args.trend_query and not args.data_file and not args.nav_file:
+        export_trend(args.trend_store, args.trend_query, f"./{output_dir_name}/", args.trend_metric)
+        return 0
+
+    if args.rank_files:
+        # the merged ranks are handled like a single extracted trace from here on
+        files, num_files, file_labels, extract_data = RANK_AGGREGATE, 1, None, False
+        output_data = not args.no_metrics_output
+    else:
+        files, num_files, file_labels, output_data, extract_data = file_args_checking(args)
     output_dir = None
-    output_dir_name = FLAGS.output_dir
 
     if num_files > 1:
         temp = []
@@ -48,12 +112,26 @@ def run(args):
 
     extracted_data = {}
 
-    if extract_data:
+    if extract_data and args.profile_queries:
         if num_files > 1:
             for i, file in enumerate(files):
-                extracted_data[file_labels[i]] = create_statistics_from_file(file, output_dir[i], FLAGS)
+                with open_trace(file, output_dir[i], args.time_window, args.nvtx_range) as trace_file:
+                    profile_queries(trace_file, output_dir[i], args.query_timeout, time_window=args.time_window,
+                                    nvtx_range=args.nvtx_range)
         else:
-            extracted_data.update(create_statistics_from_file(files, output_dir, FLAGS))
+            with open_trace(files, output_dir, args.time_window, args.nvtx_range) as trace_file:
+                profile_queries(trace_file, output_dir, args.query_timeout, time_window=args.time_window,
+                                nvtx_range=args.nvtx_range)
+        return None
+
+    if args.rank_files:
+        extracted_data.update(create_rank_statistics(args.rank_files, output_dir, args))
+    elif extract_data:
+        if num_files > 1:
+            for i, file in enumerate(files):
+                extracted_data[file_labels[i]] = create_statistics_from_file(file, output_dir[i], args)
+        else:
+            extracted_data.update(create_statistics_from_file(files, output_dir, args))
     else:
         if num_files > 1:
             for i, file in enumerate(files):
@@ -61,15 +139,47 @@ def run(args):
         else:
             extracted_data.update(import_from_NAV(files))
 
-    if output_data and extracted_data:
+    if args.trend_ingest:
+        if num_files > 1:
+            for i, file in enumerate(files):
+                ingest_statistics(args.trend_store, extracted_data[file_labels[i]], file_labels[i], file,
+                                  args.trend_time)
+        else:
+            ingest_statistics(args.trend_store, extracted_data, os.path.basename(files).split(".")[0], files,
+                              args.trend_time)
+    if args.trend_query:
+        export_trend(args.trend_store, args.trend_query, f"./{output_dir_name}/", args.trend_metric)
+    if args.tidy_export:
+        export_tidy(extracted_data if num_files > 1 else {os.path.basename(files).split(".")[0]: extracted_data},
+                    args.tidy_export, args.tidy_samples)
+
+    gate_failed = False
+    if args.regression_check:
+        if num_files != 2:
+            raise app.UsageError("Regression check requires exactly two files, the baseline first and the candidate second")
+        gate_failed = regression_check(extracted_data[file_labels[0]], extracted_data[file_labels[1]], file_labels,
+                                       output_dir[-1], args.regression_alpha, args.regression_threshold,
+                                       args.regression_correction)
+
+    if output_data and extracted_data and args.html_report:
+        write_html_report(extracted_data, output_dir[-1] if num_files > 1 else output_dir, num_files > 1)
+    elif output_data and extracted_data:
+        # plotting, table and clustering modules are only loaded when the export stage runs
+        from helper.export_statistics import generation_tables_and_figures
         no_compare = True if num_files < 2 and not args.no_compare_metrics_output else False
-        generation_tables_and_figures(extracted_data, no_compare, args.no_general_metrics_output, args.no_specific_metrics_output, args.no_individual_metrics_output, num_files, output_dir)
+        render_limits = {'Coverage': args.render_coverage, 'Budget': args.render_budget,
+                         'Comparison Samples': args.comparison_samples, 'Violin Method': args.violin_method}
+        generation_tables_and_figures(extracted_data, no_compare, args.no_general_metrics_output, args.no_specific_metrics_output, args.no_individual_metrics_output, num_files, output_dir, args.output_archive, render_limits)
+
+    return REGRESSION_EXIT_CODE if gate_failed else 0
 
 
 def main(argv):
     args = FLAGS
     logging.set_verbosity(logging.INFO)
-    if not args.data_file and not args.nav_file:
+    if args.serve:
+        exit(serve(args.daemon_socket, run, args, args.daemon_jobs))
+    if not args.data_file and not args.nav_file and not args.trend_query and not args.rank_files:
         raise app.UsageError("Must provide path to data base file or already parsed json file")
 
     if not args.max_workers:
@@ -80,7 +190,7 @@ def main(argv):
     logging.info(f"Using {MAX_WORKERS} threads")
     start_time = time.time()
     try:
-        run(args)
+        status = run(args)
     except Exception as e:
         logging.exception(f"An error occurred: {e}")
         exit(1)
@@ -98,6 +208,9 @@ def main(argv):
     )
     logging.info("Script Execution Time: %s", formatted_time)
 
+    if status:
+        exit(status)
+
 
 if __name__ == "__main__":
     app.run(main)
@@ -0,0 +1,86 @@
+import sqlite3
+
+import pytest
+
+pa = pytest.importorskip('pyarrow')
+pq = pytest.importorskip('pyarrow.parquet')
+
+from helper.backend import open_trace
+from helper.kernel import QUERY_KERNEL, QUERY_KERNEL_STATS
+
+NUM_KERNELS = 1000
+
+
+def generated_tables():
+    # two kernels launched by runtime calls, an NVTX domain and ranges, the columns nsys exports for them
+    kernels = {'start': [], 'end': [], 'shortName': [], 'demangledName': [], 'correlationId': []}
+    runtime = {'start': [], 'end': [], 'correlationId': [], 'eventClass': [], 'globalTid': []}
+    for index in range(NUM_KERNELS):
+        launch = index * 100
+        kernels['start'].append(launch + 40 + index % 7)
+        kernels['end'].append(launch + 60 + index % 13 * (1 + index % 2))
+        kernels['shortName'].append(1 + index % 2)
+        kernels['demangledName'].append(1 + index % 2)
+        kernels['correlationId'].append(index)
+        runtime['start'].append(launch)
+        runtime['end'].append(launch + 10 + index % 5)
+        runtime['correlationId'].append(index)
+        runtime['eventClass'].append(1)
+        runtime['globalTid'].append(7)
+    nvtx = {'start': [0, 10, 5000], 'end': [None, 2000, 9000], 'text': ['domain', 'step', None],
+            'textId': [None, None, 3], 'domainId': [1, 0, 0], 'globalTid': [7, 7, 7], 'eventType': [75, 59, 59]}
+    strings = {'id': [1, 2, 3], 'value': ['gemm_kernel', 'relu_kernel', 'eval']}
+    return {'CUPTI_ACTIVITY_KIND_KERNEL': kernels, 'CUPTI_ACTIVITY_KIND_RUNTIME': runtime, 'NVTX_EVENTS': nvtx,
+            'StringIds': strings}
+
+
+@pytest.fixture
+def exported_trace(tmp_path):
+    # the same tables as a parquetdir export and as an .sqlite export
+    export_dir = tmp_path / 'trace_parquet'
+    export_dir.mkdir()
+    sqlite_file = tmp_path / 'trace.sqlite'
+    with sqlite3.connect(sqlite_file) as conn:
+        for table, columns in generated_tables().items():
+            pq.write_table(pa.table(columns), export_dir / f'{table}.parquet', row_group_size=256)
+            conn.execute(f'CREATE TABLE {table} ({", ".join(columns)})')
+            conn.executemany(f'INSERT INTO {table} VALUES ({", ".join("?" * len(columns))})',
+                             zip(*columns.values()))
+    return str(export_dir), str(sqlite_file)
+
+
+def query_both(exported_trace, query, params=None):
+    export_dir, sqlite_file = exported_trace
+    results = []
+    for trace_file in (export_dir, sqlite_file):
+        with open_trace(trace_file) as database_file, sqlite3.connect(database_file) as conn:
+            results.append(conn.execute(query, params or ()).fetchall())
+    return results
+
+
+def test_staged_export_matches_sqlite(exported_trace):
+    staged, sqlite = query_both(exported_trace, QUERY_KERNEL)
+    assert staged == sqlite
+    assert sorted(row[3] for row in staged) == [NUM_KERNELS // 2, NUM_KERNELS // 2]
+
+    for kernel_id in (1, 2):
+        staged, sqlite = query_both(exported_trace, QUERY_KERNEL_STATS, (kernel_id,))
+        assert sorted(staged) == sorted(sqlite)
+        assert all(launch_overhead is not None for _, _, launch_overhead, _, _ in staged)
+
+
+def test_runtime_join_key_is_indexed(exported_trace):
+    with open_trace(exported_trace[0]) as database_file, sqlite3.connect(database_file) as conn:
+        indexed = [column for _, _, column in conn.execute(
+            "SELECT * FROM pragma_index_info('CUPTI_ACTIVITY_KIND_RUNTIME_correlationId')")]
+    assert indexed == ['correlationId']
+
+
+def test_time_window_stages_a_superset(exported_trace):
+    with open_trace(exported_trace[0], time_window='20000,40000') as database_file, \
+            sqlite3.connect(database_file) as conn:
+        starts = [start for start, in conn.execute("SELECT start FROM CUPTI_ACTIVITY_KIND_KERNEL")]
+        event_types = [event_type for event_type, in conn.execute("SELECT eventType FROM NVTX_EVENTS")]
+    assert len(starts) == 200 and all(20000 <= start < 40000 for start in starts)
+    # domain definitions start before the window and are kept for the NVTX queries
+    assert event_types == [75]
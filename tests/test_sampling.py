@@ -0,0 +1,44 @@
+import sqlite3
+
+import pytest
+
+from helper.extraction import create_statistics, KERNEL_STATS
+from helper.kernel import QUERY_KERNEL, QUERY_KERNEL_STATS, QUERY_KERNEL_SUMMARY, KERNEL_METRICS
+
+NUM_KERNELS = 2000
+
+
+@pytest.fixture
+def kernel_trace(tmp_path):
+    # skewed durations so a sample of every other kernel moves the general mean
+    sqlite_file = str(tmp_path / 'trace.sqlite')
+    with sqlite3.connect(sqlite_file) as conn:
+        conn.execute('CREATE TABLE CUPTI_ACTIVITY_KIND_KERNEL (start, end, shortName, demangledName, correlationId)')
+        conn.execute('CREATE TABLE CUPTI_ACTIVITY_KIND_RUNTIME (start, end, correlationId, eventClass, globalTid)')
+        conn.execute('CREATE TABLE StringIds (id, value)')
+        kernels = []
+        for index in range(NUM_KERNELS):
+            launch = index * 1000
+            duration = 100 + index % 2 * 400 + index % 10
+            kernels.append((launch + 50, launch + 50 + duration, 1 + index % 3, 1 + index % 3, index))
+        conn.executemany('INSERT INTO CUPTI_ACTIVITY_KIND_KERNEL VALUES (?, ?, ?, ?, ?)', kernels)
+        conn.executemany('INSERT INTO CUPTI_ACTIVITY_KIND_RUNTIME VALUES (?, ?, ?, 1, 7)',
+                         [(index * 1000, index * 1000 + 20, index) for index in range(NUM_KERNELS)])
+        conn.executemany('INSERT INTO StringIds VALUES (?, ?)', [(1, 'gemm'), (2, 'relu'), (3, 'copy')])
+    return sqlite_file
+
+
+def kernel_statistics(kernel_trace, sample_cap=None):
+    return create_statistics(kernel_trace, QUERY_KERNEL, QUERY_KERNEL_STATS, metric_type=KERNEL_STATS,
+                             summary_query=QUERY_KERNEL_SUMMARY, sample_cap=sample_cap)
+
+
+def test_sampled_general_statistics_are_exact(kernel_trace):
+    exact_kernels, exact_general = kernel_statistics(kernel_trace)
+    sampled_kernels, sampled_general = kernel_statistics(kernel_trace, sample_cap=50)
+
+    assert all(kernel['Sample Rate'] < 1 for kernel in sampled_kernels.values())
+    for label in KERNEL_METRICS:
+        assert sampled_general[label]['Mean'] == pytest.approx(exact_general[label]['Mean'])
+        assert sampled_general[label]['Minimum'] == exact_general[label]['Minimum']
+        assert sampled_general[label]['Maximum'] == exact_general[label]['Maximum']
@@ -0,0 +1,51 @@
+import csv
+
+import pytest
+
+from helper import tidy
+from helper.general import generate_statistics
+from helper.tidy import export_tidy, samples_file_of
+
+
+def kernel_statistics(num_kernels=5, instances=30):
+    kernels = {}
+    for kernel_id in range(num_kernels):
+        raw_data = [1000 + kernel_id * 100 + index for index in range(instances)]
+        kernels[kernel_id] = {'Name': f'kernel_{kernel_id}', 'Time Total': sum(raw_data), 'Time Percent': 20.0,
+                              'Instance': instances}
+        kernels[kernel_id].update(generate_statistics(raw_data, 'Execution Duration'))
+    statistics = {'Kernel Statistics': {'Individual Kernels': kernels}}
+    statistics['Kernel Statistics'].update(generate_statistics(list(range(100)), 'Execution Duration', True))
+    return statistics
+
+
+def test_csv_export_rows(tmp_path):
+    tidy_file = str(tmp_path / 'stats.csv')
+    export_tidy({'trace': kernel_statistics()}, tidy_file, samples=True)
+
+    with open(tidy_file) as statistics_file:
+        rows = list(csv.DictReader(statistics_file))
+    assert [row['item'] for row in rows] == [f'kernel_{index}' for index in range(5)] + ['(General)']
+    assert rows[0]['count'] == '30' and float(rows[0]['mean']) == 1014.5
+    with open(samples_file_of(tidy_file)) as samples_file:
+        samples = list(csv.DictReader(samples_file))
+    assert len(samples) == 150
+    assert samples[30] == {'trace': 'trace', 'category': 'Kernel Statistics', 'item': 'kernel_1',
+                           'metric': 'Execution Duration', 'value': '1100.0'}
+
+
+def test_parquet_samples_are_buffered_into_row_groups(tmp_path, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    monkeypatch.setattr(tidy, 'SAMPLES_BATCH_ROWS', 64)
+    tidy_file = str(tmp_path / 'stats.parquet')
+    export_tidy({'a': kernel_statistics(), 'b': kernel_statistics()}, tidy_file, samples=True)
+
+    statistics = pq.read_table(tidy_file)
+    assert statistics.num_rows == 12
+    assert statistics.schema.field('instances').type == 'int64'
+    samples_file = pq.ParquetFile(samples_file_of(tidy_file))
+    # 300 samples from items of 30 go out as three batches of 90 and the remaining 30, not a row group per item
+    assert samples_file.metadata.num_rows == 300
+    assert samples_file.metadata.num_row_groups == 4
+    values = samples_file.read().column('value').to_pylist()
+    assert values[:31] == [1000.0 + index for index in range(30)] + [1100.0]